@@ -0,0 +1,221 @@
+# bench_end_to_end.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+
+import fitz
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+import fake_docai_server
+
+"""
+End-to-end load test of main_file.py against the local fake Document AI server (fake_docai_server.py).
+
+FILES synthetic PDF files of PAGES_PER_FILE pages are built from a sample form: every page gets a
+stamp, so no two pages have the same bytes. The fake server is started once, then for each value of
+--concurrency (the workers of the upload stage) main_file.main() processes every file in a new Python
+process, with the response cache off and a fresh job state, so the runs do not share any state. The
+processors get the ID of their name, so the fake server answers each one with its recorded Documents.
+
+Reported for each run: the pages written per second, the p50/p95/p99 latency of a page in the upload
+stage (from the first request of the page to the last response, including the rate limits, retries
+and batching windows), the peak RSS of the process, and the requests, injected errors and throttled
+requests seen by the server.
+
+The client rate limit (QUOTA_REQUESTS_PER_MINUTE of the processors) is set by --client-quota, far
+above the Document AI quota by default so the pipeline itself is measured. --client-quota 120 runs
+with the production rate limit, --quota-per-minute makes the server throttle.
+
+The runs keep the tracing of main_file.py (tracing.py) on, as in production; --no-trace measures
+without it. --trace-dir keeps the metric and trace files of each run.
+
+Usage:
+    python benchmarks/bench_end_to_end.py [--files 20] [--pages-per-file 3] [--concurrency 4 16 32] [--latency-ms 800] [--error-rate 0.01]
+"""
+
+DEFAULT_SOURCE = os.path.join(app_dir, 'input_data', 'Form9- T.O.pdf')
+
+
+def make_synthetic_files(folder, files, pages_per_file, source_pdf=DEFAULT_SOURCE):
+    """
+    Writes synthetic PDF files built from the pages of a sample PDF.
+
+    Args:
+        folder (str): The output folder.
+        files (int): The number of files.
+        pages_per_file (int): The number of pages of each file.
+        source_pdf (str): The sample PDF, its pages are used in turn.
+
+    Returns:
+        int: The number of pages written.
+    """
+    with fitz.open(source_pdf) as source:
+        for file_index in range(files):
+            with fitz.open() as pdf:
+                for page_index in range(pages_per_file):
+                    source_page = (file_index * pages_per_file + page_index) % len(source)
+                    pdf.insert_pdf(source, from_page=source_page, to_page=source_page)
+                    # The stamp makes every page unique
+                    pdf[-1].insert_text((20, 20), f"bench {file_index}-{page_index}", fontsize=6)
+                pdf.save(os.path.join(folder, f"bench_{file_index:05d}.pdf"))
+    return files * pages_per_file
+
+
+def percentile(values, fraction):
+    """Returns a percentile of a list of values (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of the process in MB, None where the resource module is missing (Windows)."""
+    # On Linux, ru_maxrss keeps the peak of the parent process across exec, VmHWM does not
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(input_dir, output_dir, upload_workers, client_quota):
+    """
+    Processes the files of input_dir with main_file.main() and prints the measures as JSON.
+    Runs in the process started by run_benchmark(), with DOCAI_API_ENDPOINT set to the fake server.
+    """
+    import main_file
+    import response_cache
+    import output_writers
+
+    logging.getLogger().setLevel(logging.WARNING)
+    response_cache.configure(enabled=False)
+    main_file.INPUT_PATH = input_dir
+    main_file.OUTPUT_DIR = output_dir
+    config_dir = tempfile.mkdtemp()
+
+    # Each processor gets a configuration with its name as processor ID and the client quota
+    load_processors = main_file.load_processors
+
+    def load_benchmark_processors(processors_dir):
+        in_process, _ = load_processors(processors_dir)
+        for name in in_process:
+            module = sys.modules[main_file.PROCESSOR_REGISTRY[name]["fetch"].__module__]
+            with open(module.CONFIG_PATH, 'r') as f:
+                config = json.load(f)
+            config.update(PROCESSOR_ID=name, QUOTA_REQUESTS_PER_MINUTE=client_quota,
+                          MAX_CONCURRENT_REQUESTS=max(upload_workers, config.get('MAX_CONCURRENT_REQUESTS', 0)))
+            module.CONFIG_PATH = os.path.join(config_dir, f"{name}.json")
+            with open(module.CONFIG_PATH, 'w') as f:
+                json.dump(config, f)
+        # External processor scripts are not part of the benchmark
+        return in_process, []
+
+    main_file.load_processors = load_benchmark_processors
+
+    # Latency of each page in the upload stage
+    latencies = []
+    process_page = main_file.process_page
+
+    async def timed_process_page(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await process_page(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    main_file.process_page = timed_process_page
+
+    start = time.perf_counter()
+    asyncio.run(main_file.main(concurrency={"upload": upload_workers}))
+    seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        # The per-file documents of document_assembly.py are not pages
+        "pages": sum(name.endswith(output_writers.FILE_SUFFIXES["json"]) for name in os.listdir(output_dir)),
+        "seconds": seconds,
+        "p50": percentile(latencies, 0.5) if latencies else None,
+        "p95": percentile(latencies, 0.95) if latencies else None,
+        "p99": percentile(latencies, 0.99) if latencies else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def run_benchmark(input_dir, port, upload_workers, client_quota, verbose=False, trace=True, trace_dir=None):
+    """Runs run_child() in a new Python process and returns its measures."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(output_dir)
+        env = {**os.environ, "DOCAI_API_ENDPOINT": f"localhost:{port}", "DOCAI_CACHE": "0",
+               "DOCAI_JOB_STATE_PATH": os.path.join(work_dir, 'job_state.sqlite'), "DOCAI_TRACE": "1" if trace else "0",
+               "DOCAI_TRACE_DIR": os.path.join(trace_dir, f"upload_{upload_workers}") if trace_dir else os.path.join(work_dir, 'traces')}
+        command = [sys.executable, os.path.abspath(__file__), '--child', input_dir, output_dir,
+                   str(upload_workers), str(client_quota)]
+        completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=None if verbose else subprocess.DEVNULL,
+                                   text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        input_dir, output_dir, upload_workers, client_quota = sys.argv[2:6]
+        run_child(input_dir, output_dir, int(upload_workers), float(client_quota))
+        return
+
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of main_file.py against a fake Document AI server.")
+    parser.add_argument('--files', type=int, default=20)
+    parser.add_argument('--pages-per-file', type=int, default=3)
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help="The sample PDF the synthetic files are built from.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16, 32], help="Workers of the upload stage, one run each.")
+    parser.add_argument('--latency-ms', type=float, default=800)
+    parser.add_argument('--latency-sigma', type=float, default=0.3)
+    parser.add_argument('--per-page-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--quota-per-minute', type=int, default=0, help="Server quota per processor, 0 for no quota.")
+    parser.add_argument('--client-quota', type=float, default=60000, help="QUOTA_REQUESTS_PER_MINUTE of the processors.")
+    parser.add_argument('--recorded', help="Directory of recorded Documents for the fake server (see fake_docai_server.py).")
+    parser.add_argument('--no-trace', action='store_true', help="Run main_file.py without its tracing spans.")
+    parser.add_argument('--trace-dir', help="Keep the metric and trace files of each run in this directory.")
+    parser.add_argument('--verbose', action='store_true', help="Show the logs of main_file.py.")
+    args = parser.parse_args()
+
+    server = fake_docai_server.FakeDocumentAI(fake_docai_server.default_documents(args.recorded), args.latency_ms, args.latency_sigma,
+                                              args.per_page_ms, args.error_rate, args.quota_per_minute)
+    port = server.start()
+
+    with tempfile.TemporaryDirectory() as input_dir:
+        pages = make_synthetic_files(input_dir, args.files, args.pages_per_file, args.source)
+        print(f"{args.files} files, {pages} pages, server latency {args.latency_ms:.0f} ms (sigma {args.latency_sigma}), "
+              f"error rate {args.error_rate:.1%}, server quota {args.quota_per_minute or '-'}/min, client quota {args.client_quota:.0f}/min")
+        print(f"{'upload':>7}{'pages':>7}{'seconds':>9}{'pages/s':>9}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'RSS MB':>8}"
+              f"{'requests':>10}{'errors':>8}{'throttled':>11}")
+        for upload_workers in args.concurrency:
+            before = server.get_stats()
+            result = run_benchmark(input_dir, port, upload_workers, args.client_quota, args.verbose, not args.no_trace, args.trace_dir)
+            after = server.get_stats()
+            requests, errors, throttled = (after[key] - before[key] for key in ("requests", "errors", "throttled"))
+            latency = ''.join(f"{result[key]:>8.2f}" if result[key] is not None else f"{'-':>8}" for key in ("p50", "p95", "p99"))
+            rss = f"{result['peak_rss_mb']:>8.0f}" if result['peak_rss_mb'] is not None else f"{'-':>8}"
+            print(f"{upload_workers:>7}{result['pages']:>7}{result['seconds']:>9.1f}{result['pages'] / result['seconds']:>9.2f}"
+                  f"{latency}{rss}{requests:>10}{errors:>8}{throttled:>11}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench_output_formats.py
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+import output_writers
+
+"""
+Benchmark of the output formats of output_writers.py.
+
+Writes the same merged results for PAGES pages with every output format, then reads them back, and
+reports the write and read throughput and the size on disk. The merged results of each page are the
+sample output of a one-page form (temp/Form9- T.O_extraction_output.json) by default.
+
+Formats whose libraries are not installed are skipped.
+
+Usage:
+    python benchmarks/bench_output_formats.py [--pages 500] [--sample path/to/extraction_output.json] [--formats json msgpack parquet]
+"""
+
+SAMPLE_PATH = os.path.join(app_dir, 'temp', 'Form9- T.O_extraction_output.json')
+
+
+def directory_size(path):
+    """Returns the total size of the files of a directory tree, in bytes."""
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def write_pages(output_format, output_dir, pages):
+    """Writes every page with the writer of a format, returns the duration in seconds."""
+    start = time.perf_counter()
+    writer = output_writers.get_writer(output_format, output_dir)
+    for page_name, merged_results in pages:
+        writer.write(page_name, merged_results)
+    writer.close()
+    return time.perf_counter() - start
+
+
+def read_pages(output_format, output_dir, pages):
+    """Reads every page (or every columnar table) back, returns the duration in seconds."""
+    start = time.perf_counter()
+    if output_format in ("parquet", "arrow"):
+        for table_name in output_writers.TABLE_SCHEMAS:
+            output_writers.read_table(output_dir, table_name, output_format)
+    else:
+        for page_name, _ in pages:
+            output_writers.read_page_output(output_writers.output_path(output_dir, page_name, output_format))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the extraction output formats.")
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--sample', default=SAMPLE_PATH, help="Merged results of one page, used for every page.")
+    parser.add_argument('--formats', nargs='+', default=output_writers.OUTPUT_FORMATS, choices=output_writers.OUTPUT_FORMATS)
+    args = parser.parse_args()
+
+    with open(args.sample, 'r', encoding='utf-8') as f:
+        sample = json.load(f)
+    pages = [(f"page-{index:06d}.pdf", sample) for index in range(args.pages)]
+
+    print(f"{args.pages} pages of {os.path.basename(args.sample)}")
+    print(f"{'format':<14}{'size (MB)':>12}{'bytes/page':>12}{'write pages/s':>15}{'write MB/s':>12}{'read pages/s':>14}")
+    for output_format in args.formats:
+        output_dir = tempfile.mkdtemp(prefix=f"bench-{output_format}-")
+        try:
+            try:
+                write_seconds = write_pages(output_format, output_dir, pages)
+            except ImportError as e:
+                print(f"{output_format:<14}skipped ({e})")
+                continue
+            read_seconds = read_pages(output_format, output_dir, pages)
+            size = directory_size(output_dir)
+            print(f"{output_format:<14}{size / 1e6:>12.2f}{size / args.pages:>12.0f}{args.pages / write_seconds:>15.0f}"
+                  f"{size / 1e6 / write_seconds:>12.1f}{args.pages / read_seconds:>14.0f}")
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
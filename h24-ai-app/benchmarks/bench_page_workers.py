@@ -0,0 +1,119 @@
+# bench_page_workers.py
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+from bench_end_to_end import DEFAULT_SOURCE, make_synthetic_files, peak_rss_mb
+
+"""
+Scaling benchmark of the page workers of the split stage (page_workers.py, main_file.py --split-workers).
+
+A synthetic PDF of PAGES pages is built from a sample form (see bench_end_to_end.make_synthetic_files).
+For each value of --workers, a new Python process splits it CHUNK_PAGES at a time, as the split
+stage does, and with --preprocess / --fingerprint also re-renders and fingerprints every page:
+
+- 0: the page stream and the threads of the event loop executor (one thread per core), the default
+  of main_file.py. PyMuPDF holds the GIL, so the threads do not add cores.
+- N: a PageWorkerPool of N processes, each chunk sharded in page ranges.
+
+Reported for each run: the seconds, the pages per second, the speedup against the first run and the
+peak RSS of the parent process (the worker processes are not included). The speedup is bounded by
+the cores of the machine (shown in the header).
+
+Usage:
+    python benchmarks/bench_page_workers.py [--pages 512] [--workers 0 1 2 4 8 16] [--preprocess] [--fingerprint]
+"""
+
+
+def run_child(pdf_path, workers, chunk_pages, preprocess, fingerprint):
+    """Splits (and prepares) every page of the file and prints the measures as JSON. Runs in the process started by run_benchmark()."""
+    from page_stream import PageStream
+    from page_workers import PageWorkerPool
+    from page_preprocessing import preprocess_page
+    from page_dedup import page_fingerprint
+
+    def prepare_in_thread(page_bytes):
+        page_info = fingerprint_value = None
+        if fingerprint:
+            fingerprint_value = page_fingerprint(page_bytes)
+        if preprocess:
+            page_bytes, page_info = preprocess_page(page_bytes)
+        return page_bytes, page_info, fingerprint_value
+
+    pool = PageWorkerPool(workers) if workers > 0 else None
+    threads = ThreadPoolExecutor(max_workers=os.cpu_count())
+    if pool is not None:
+        # The worker processes are started before the measure, as they are once the first file of a run is split
+        pool.prepare([b''], False, False)
+
+    start = time.perf_counter()
+    pages = 0
+    with PageStream(pdf_path) as stream:
+        while True:
+            chunk = stream.read(chunk_pages) if pool is None else pool.read(stream, chunk_pages)
+            if not chunk:
+                break
+            pages += len(chunk)
+            if preprocess or fingerprint:
+                page_bytes = [page for _, page in chunk]
+                if pool is None:
+                    list(threads.map(prepare_in_thread, page_bytes))
+                else:
+                    pool.prepare(page_bytes, preprocess, fingerprint)
+    seconds = time.perf_counter() - start
+    if pool is not None:
+        pool.close()
+    threads.shutdown()
+
+    print(json.dumps({"pages": pages, "seconds": seconds, "peak_rss_mb": peak_rss_mb()}))
+
+
+def run_benchmark(pdf_path, workers, chunk_pages, preprocess, fingerprint):
+    """Runs run_child() in a new Python process and returns its measures."""
+    command = [sys.executable, os.path.abspath(__file__), '--child', pdf_path, str(workers), str(chunk_pages),
+               str(int(preprocess)), str(int(fingerprint))]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        pdf_path, workers, chunk_pages, preprocess, fingerprint = sys.argv[2:7]
+        run_child(pdf_path, int(workers), int(chunk_pages), preprocess == '1', fingerprint == '1')
+        return
+
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the page worker processes.")
+    parser.add_argument('--pages', type=int, default=512)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8, 16], help="Worker processes, one run each (0: threads).")
+    parser.add_argument('--chunk-pages', type=int, default=32, help="Pages split at a time, as SPLIT_CHUNK_PAGES.")
+    parser.add_argument('--preprocess', action='store_true', help="Also re-render the pages (page_preprocessing.py).")
+    parser.add_argument('--fingerprint', action='store_true', help="Also fingerprint the pages (page_dedup.py).")
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help="The sample PDF the synthetic file is built from.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as input_dir:
+        make_synthetic_files(input_dir, 1, args.pages, args.source)
+        pdf_path = os.path.join(input_dir, os.listdir(input_dir)[0])
+        work = "split" + (" + preprocess" if args.preprocess else "") + (" + fingerprint" if args.fingerprint else "")
+        print(f"{args.pages} pages, {work}, chunks of {args.chunk_pages} pages, {os.cpu_count()} cores")
+        print(f"{'workers':>8}{'seconds':>9}{'pages/s':>9}{'speedup':>9}{'RSS MB':>8}")
+        baseline = None
+        for workers in args.workers:
+            result = run_benchmark(pdf_path, workers, args.chunk_pages, args.preprocess, args.fingerprint)
+            baseline = baseline or result["seconds"]
+            rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else "-"
+            print(f"{workers or 'threads':>8}{result['seconds']:>9.1f}{result['pages'] / result['seconds']:>9.1f}"
+                  f"{baseline / result['seconds']:>8.2f}x{rss:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# bench_preprocessing.py
+import os
+import sys
+import time
+import argparse
+import statistics
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+import page_preprocessing
+import response_cache
+from main_file import split_pages
+from processor_runtime import load_processors, run_fetch
+
+"""
+Benchmark of the page preprocessing of page_preprocessing.py.
+
+Every page of the input PDF files is preprocessed with each variant of VARIANTS, and the payload size
+and the preprocessing time are compared with the original page. With --processor, every variant of
+every page is also sent to a Document AI processor (with the response cache disabled), and the
+end-to-end latency (preprocessing + request) is reported against the mean confidence of the entities
+and table cells of the response, to check that the smaller payloads do not degrade the extraction.
+
+Usage:
+    python benchmarks/bench_preprocessing.py [--input input_data] [--variants original gray-200 bilevel-200] [--processor ml_tabular_ext]
+"""
+
+# Preprocessing options of each variant, None sends the original page
+VARIANTS = {
+    "original": None,
+    "gray-200": {"dpi": 200, "mode": "gray", "jpeg_quality": 75, "crop": False},
+    "gray-200-crop": {"dpi": 200, "mode": "gray", "jpeg_quality": 75, "crop": True},
+    "gray-150-q60": {"dpi": 150, "mode": "gray", "jpeg_quality": 60, "crop": False},
+    "bilevel-200": {"dpi": 200, "mode": "bilevel", "crop": False},
+    "bilevel-300": {"dpi": 300, "mode": "bilevel", "crop": False},
+    "color-200": {"dpi": 200, "mode": "color", "jpeg_quality": 75, "crop": False},
+}
+DEFAULT_INPUT = os.path.join(app_dir, 'input_data')
+
+
+def load_pages(input_path):
+    """Returns the (page_name, page_bytes) of every page of the PDF files of a folder (or of one PDF file)."""
+    file_paths = [input_path] if os.path.isfile(input_path) else [
+        os.path.join(input_path, name) for name in sorted(os.listdir(input_path)) if name.lower().endswith('.pdf')]
+    pages = []
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            pages.extend(split_pages(os.path.basename(file_path), f.read()))
+    return pages
+
+
+def document_confidence(document):
+    """Returns the mean confidence of the entities and table cells of a processed document, None without any."""
+    confidences = [entity.confidence for entity in document.entities]
+    for page in document.pages:
+        for table in page.tables:
+            for row in list(table.header_rows) + list(table.body_rows):
+                confidences.extend(cell.layout.confidence for cell in row.cells)
+    return statistics.mean(confidences) if confidences else None
+
+
+def percentile(values, fraction):
+    """Returns a percentile of a list of values (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the page preprocessing.")
+    parser.add_argument('--input', default=DEFAULT_INPUT, help="A folder of PDF files, or a PDF file.")
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('--processor', help="Also send every variant to this registered processor (calls Document AI).")
+    args = parser.parse_args()
+
+    pages = load_pages(args.input)
+    if not pages:
+        raise SystemExit(f"No PDF page found in {args.input}.")
+    original_bytes = sum(len(page_bytes) for _, page_bytes in pages)
+    print(f"{len(pages)} pages, {original_bytes / 1e3:.0f} KB ({original_bytes / len(pages) / 1e3:.0f} KB/page)")
+
+    if args.processor:
+        load_processors(os.path.join(app_dir, 'processors'))
+        # Every variant must reach Document AI, identical pages would be served from the cache
+        response_cache.configure(enabled=False)
+
+    header = f"{'variant':<16}{'KB/page':>10}{'reduction':>11}{'prep ms/page':>14}"
+    if args.processor:
+        header += f"{'p50 s':>9}{'p95 s':>9}{'confidence':>12}"
+    print(header)
+
+    for variant in args.variants:
+        options = VARIANTS[variant]
+        sizes = []
+        prep_seconds = []
+        latencies = []
+        confidences = []
+        for page_name, page_bytes in pages:
+            start = time.perf_counter()
+            payload = page_bytes if options is None else page_preprocessing.preprocess_page(page_bytes, options)[0]
+            prep_seconds.append(time.perf_counter() - start)
+            sizes.append(len(payload))
+
+            if args.processor:
+                document = run_fetch(args.processor, payload, page_name)
+                latencies.append(time.perf_counter() - start)
+                confidence = document_confidence(document) if document is not None and hasattr(document, 'entities') else None
+                if confidence is not None:
+                    confidences.append(confidence)
+
+        total = sum(sizes)
+        line = (f"{variant:<16}{total / len(pages) / 1e3:>10.1f}{1 - total / original_bytes:>10.1%}"
+                f"{statistics.mean(prep_seconds) * 1e3:>14.0f}")
+        if args.processor:
+            confidence = f"{statistics.mean(confidences):.3f}" if confidences else "-"
+            line += f"{percentile(latencies, 0.5):>9.2f}{percentile(latencies, 0.95):>9.2f}{confidence:>12}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench_split.py
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+from bench_end_to_end import DEFAULT_SOURCE, make_synthetic_files, peak_rss_mb
+
+"""
+Benchmark of the split of a large PDF file: in memory (main_file.page_splitter) against the page
+stream of the split stage (page_stream.PageStream).
+
+A synthetic PDF of PAGES pages is built from a sample form (every page stamped, see
+bench_end_to_end.make_synthetic_files), then each mode splits it in a new Python process, so the peak
+RSS of a mode does not include the memory of the other one:
+
+- memory: the file is read, and every page is split, before the first page is returned.
+- stream: the pages are read CHUNK_PAGES at a time, each chunk dropped before the next one is read,
+  as the split stage does once the pipeline queues are full.
+
+Reported for each mode: the time to the first page, the total time, the pages per second and the
+peak RSS of the process.
+
+Usage:
+    python benchmarks/bench_split.py [--pages 5000] [--chunk-pages 32]
+"""
+
+
+def run_child(mode, pdf_path, chunk_pages):
+    """Splits the file in one mode and prints the measures as JSON. Runs in the process started by run_benchmark()."""
+    import main_file
+    from page_stream import PageStream
+
+    start = time.perf_counter()
+    first_page_seconds = None
+    pages = 0
+    page_bytes = 0
+    if mode == "memory":
+        first_pages, other_pages = main_file.page_splitter([pdf_path], show_progress=False)
+        first_page_seconds = time.perf_counter() - start
+        for _, page in first_pages + other_pages:
+            pages += 1
+            page_bytes += len(page)
+    else:
+        with PageStream(pdf_path) as stream:
+            while True:
+                chunk = stream.read(chunk_pages)
+                if not chunk:
+                    break
+                if first_page_seconds is None:
+                    first_page_seconds = time.perf_counter() - start
+                pages += len(chunk)
+                page_bytes += sum(len(page) for _, page in chunk)
+    seconds = time.perf_counter() - start
+
+    print(json.dumps({"pages": pages, "page_bytes": page_bytes, "first_page_seconds": first_page_seconds,
+                      "seconds": seconds, "peak_rss_mb": peak_rss_mb()}))
+
+
+def run_benchmark(mode, pdf_path, chunk_pages):
+    """Runs run_child() in a new Python process and returns its measures."""
+    command = [sys.executable, os.path.abspath(__file__), '--child', mode, pdf_path, str(chunk_pages)]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        mode, pdf_path, chunk_pages = sys.argv[2:5]
+        run_child(mode, pdf_path, int(chunk_pages))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark of the in-memory split against the page stream.")
+    parser.add_argument('--pages', type=int, default=5000)
+    parser.add_argument('--chunk-pages', type=int, default=32, help="Pages read at a time by the page stream.")
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help="The sample PDF the synthetic file is built from.")
+    parser.add_argument('--modes', nargs='+', choices=["memory", "stream"], default=["memory", "stream"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as input_dir:
+        make_synthetic_files(input_dir, 1, args.pages, args.source)
+        pdf_path = os.path.join(input_dir, os.listdir(input_dir)[0])
+        print(f"{args.pages} pages, {os.path.getsize(pdf_path) / 1e6:.1f} MB, chunks of {args.chunk_pages} pages")
+        print(f"{'mode':<8}{'first page s':>14}{'seconds':>9}{'pages/s':>9}{'pages MB':>10}{'RSS MB':>8}")
+        for mode in args.modes:
+            result = run_benchmark(mode, pdf_path, args.chunk_pages)
+            rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else "-"
+            print(f"{mode:<8}{result['first_page_seconds']:>14.2f}{result['seconds']:>9.1f}{result['pages'] / result['seconds']:>9.0f}"
+                  f"{result['page_bytes'] / 1e6:>10.1f}{rss:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# bench_table_extraction.py
+import os
+import sys
+import time
+import random
+import argparse
+import itertools
+
+import numpy as np
+from google.cloud import documentai
+
+# The processors and the shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(app_dir, 'processors'))
+sys.path.insert(0, app_dir)
+import ml_tabular_ext
+
+"""
+Benchmark of the table extraction of ml_tabular_ext on large multi-table documents.
+
+Compares the single-pass extraction (ml_tabular_ext.build_output: one extract_tables() traversal over
+the raw protobuf, the four views derived from it) with the previous implementation, kept below as
+legacy_*: get_table_data, get_row_data, get_col_data and get_cell_data each walking the proto-plus
+document again. Both outputs are checked to be identical before timing. The bulk point queries of the
+cell geometry (table_geometry.CellGeometry.locate_points) are timed too.
+
+The documents are synthetic (no Document AI call): PAGES pages with TABLES tables of ROWS x COLS cells,
+each cell with its text anchor, its bounding polygon and its confidence.
+
+Usage:
+    python benchmarks/bench_table_extraction.py [--pages 20] [--tables 3] [--rows 40] [--cols 8] [--repeat 3]
+"""
+
+
+def build_document(pages, tables, rows, cols, seed=0):
+    """
+    Builds a synthetic Document AI document with tables, like the form parser output.
+
+    Args:
+        pages (int): The number of pages.
+        tables (int): The number of tables per page.
+        rows (int): The number of rows per table, the first one being the header row.
+        cols (int): The number of cells per row.
+
+    Returns:
+        documentai.Document: The document.
+    """
+    rng = random.Random(seed)
+    text_parts = []
+    offset = 0
+
+    def layout(x, y, width, height, content):
+        nonlocal offset
+        text_parts.append(content + "\n")
+        start = offset
+        offset += len(content) + 1
+        vertices = [{"x": x, "y": y}, {"x": x + width, "y": y}, {"x": x + width, "y": y + height}, {"x": x, "y": y + height}]
+        return {
+            "text_anchor": {"text_segments": [{"start_index": start, "end_index": offset}]},
+            "bounding_poly": {"vertices": vertices},
+            "confidence": rng.random(),
+        }
+
+    document_pages = []
+    for page_number in range(1, pages + 1):
+        page_tables = []
+        for table_index in range(tables):
+            top = 100 + table_index * (rows * 30 + 50)
+            table_rows = [
+                {"cells": [{"layout": layout(80 + col * 120, top + row * 30, 120, 30, f"cell {page_number}.{table_index}.{row}.{col} {rng.randint(0, 9999)}")}
+                           for col in range(cols)]}
+                for row in range(rows)
+            ]
+            page_tables.append({
+                "layout": {"bounding_poly": {"vertices": [{"x": 80, "y": top}, {"x": 80 + cols * 120, "y": top},
+                                                          {"x": 80 + cols * 120, "y": top + rows * 30}, {"x": 80, "y": top + rows * 30}]}},
+                "header_rows": table_rows[:1],
+                "body_rows": table_rows[1:],
+            })
+        document_pages.append({"page_number": page_number, "tables": page_tables})
+
+    return documentai.Document(text="".join(text_parts), pages=document_pages)
+
+
+# Previous implementation: one traversal of the proto-plus document per view
+
+def legacy_text_anchor_data_table(text_anchor, text):
+    extracted_text = ''
+    start_indices = []
+    end_indices = []
+    for segment in text_anchor.text_segments:
+        start_index = int(segment.start_index)
+        end_index = int(segment.end_index)
+        extracted_text += text[start_index:end_index]
+        start_indices.append(start_index)
+        end_indices.append(end_index)
+    clean_text = extracted_text.strip().replace('\n', ' ')
+    return {'text': clean_text, 'start_index': min(start_indices) if start_indices else None, 'end_index': max(end_indices) if end_indices else None}
+
+def legacy_get_boundaries_limits(bounding_poly):
+    if not bounding_poly or not bounding_poly.vertices or len(bounding_poly.vertices) < 4:
+        return None
+    top_left = bounding_poly.vertices[0]
+    top_right = bounding_poly.vertices[1]
+    bottom_right = bounding_poly.vertices[2]
+    bottom_left = bounding_poly.vertices[3]
+    left_limit = {'x_position': top_left.x, 'vertical_extent': {'top': top_left.y, 'bottom': bottom_left.y}}
+    right_limit = {'x_position': top_right.x, 'vertical_extent': {'top': top_right.y, 'bottom': bottom_right.y}}
+    top_limit = {'y_position': top_left.y, 'horizontal_extent': {'left': top_left.x, 'right': top_right.x}}
+    bottom_limit = {'y_position': bottom_left.y, 'horizontal_extent': {'left': bottom_left.x, 'right': bottom_right.x}}
+    return {'left_limit': left_limit, 'right_limit': right_limit, 'top_limit': top_limit, 'bottom_limit': bottom_limit}
+
+def legacy_get_table_data(document):
+    tables_data = []
+    for page in document.pages:
+        if page.tables:
+            for table in page.tables:
+                table_dict = {'total_rows': len(table.body_rows) + len(table.header_rows), 'total_cols': 0, 'table_limits': None}
+                if table.layout.bounding_poly:
+                    table_dict['table_limits'] = legacy_get_boundaries_limits(table.layout.bounding_poly)
+                max_cols = 0
+                for row in itertools.chain(table.header_rows, table.body_rows):
+                    max_cols = max(max_cols, len(row.cells))
+                table_dict['total_cols'] = max_cols
+                tables_data.append(table_dict)
+    return tables_data
+
+def legacy_get_row_data(document):
+    row_data = []
+    for page in document.pages:
+        if page.tables:
+            for table in page.tables:
+                for row_index, row in enumerate(table.body_rows):
+                    row_dict = {'row_index': row_index, 'row_first_cell_text': None, 'row_limits': None}
+                    if row.cells:
+                        first_cell = row.cells[0]
+                        row_dict['row_first_cell_text'] = legacy_text_anchor_data_table(first_cell.layout.text_anchor, document.text)
+                    x_mins, x_maxs, y_mins, y_maxs = ([], [], [], [])
+                    for cell in row.cells:
+                        if cell.layout.bounding_poly:
+                            bounds = legacy_get_boundaries_limits(cell.layout.bounding_poly)
+                            x_mins.append(bounds['left_limit']['x_position'])
+                            x_maxs.append(bounds['right_limit']['x_position'])
+                            y_mins.append(bounds['top_limit']['y_position'])
+                            y_maxs.append(bounds['bottom_limit']['y_position'])
+                    if x_mins and x_maxs and y_mins and y_maxs:
+                        row_dict['row_limits'] = {'left_limit': min(x_mins), 'right_limit': max(x_maxs), 'top_limit': min(y_mins), 'bottom_limit': max(y_maxs)}
+                    else:
+                        row_dict['row_limits'] = {'left_limit': None, 'right_limit': None, 'top_limit': None, 'bottom_limit': None}
+                    row_data.append(row_dict)
+    return row_data
+
+def legacy_get_col_data(document):
+    col_data = []
+    if not document.pages[0].tables:
+        return col_data
+    table = document.pages[0].tables[0]
+    num_cols = len(table.body_rows[0].cells)
+    for col_index in range(num_cols):
+        col_dict = {'col_index': col_index, 'col_cell_text': None, 'col_limits': {'left_limit': None, 'right_limit': None, 'top_limit': None, 'bottom_limit': None}}
+        header_cell = table.header_rows[0].cells[col_index]
+        col_dict['col_cell_text'] = legacy_text_anchor_data_table(header_cell.layout.text_anchor, document.text)
+        x_mins, x_maxs, y_mins, y_maxs = ([], [], [], [])
+        if header_cell.layout.bounding_poly:
+            bounds = legacy_get_boundaries_limits(header_cell.layout.bounding_poly)
+            x_mins.append(bounds['left_limit']['x_position'])
+            x_maxs.append(bounds['right_limit']['x_position'])
+            y_mins.append(bounds['top_limit']['y_position'])
+            y_maxs.append(bounds['bottom_limit']['y_position'])
+        for row in table.body_rows:
+            if col_index < len(row.cells):
+                cell = row.cells[col_index]
+                if cell.layout.bounding_poly:
+                    bounds = legacy_get_boundaries_limits(cell.layout.bounding_poly)
+                    x_mins.append(bounds['left_limit']['x_position'])
+                    x_maxs.append(bounds['right_limit']['x_position'])
+                    y_mins.append(bounds['top_limit']['y_position'])
+                    y_maxs.append(bounds['bottom_limit']['y_position'])
+        col_dict['col_limits']['left_limit'] = min(x_mins) if x_mins else None
+        col_dict['col_limits']['right_limit'] = max(x_maxs) if x_maxs else None
+        col_dict['col_limits']['top_limit'] = min(y_mins) if y_mins else None
+        col_dict['col_limits']['bottom_limit'] = max(y_maxs) if y_maxs else None
+        col_data.append(col_dict)
+    return col_data
+
+def legacy_get_cell_data(document):
+    all_cell_data = []
+    for page in document.pages:
+        if page.tables:
+            for table in page.tables:
+                total_header_rows = len(table.header_rows)
+                for is_header, rows in ((True, table.header_rows), (False, table.body_rows)):
+                    for row_index, row in enumerate(rows, start=0 if is_header else total_header_rows):
+                        for col_index, cell in enumerate(row.cells):
+                            cell_text_data = legacy_text_anchor_data_table(cell.layout.text_anchor, document.text)
+                            cell_boundaries = legacy_get_boundaries_limits(cell.layout.bounding_poly) if cell.layout.bounding_poly else None
+                            cell_data = {'row_type': 'header' if is_header else 'body', 'row_index': row_index, 'col_index': col_index, 'cell_data': {'cell_content': cell_text_data, 'cell_extraction_confidence': cell.layout.confidence if hasattr(cell.layout, 'confidence') else None, 'cell_limits': cell_boundaries}}
+                            all_cell_data.append(cell_data)
+    return all_cell_data
+
+def legacy_build_output(document):
+    return {
+        "table_data": legacy_get_table_data(document),
+        "column_data": legacy_get_col_data(document),
+        "row_data": legacy_get_row_data(document),
+        "content_data": legacy_get_cell_data(document),
+    }
+
+
+def fused_build_output(document):
+    return ml_tabular_ext.build_output(document, "benchmark.pdf")["table_entities"]
+
+
+def best_time(func, document, repeat):
+    """Returns the best duration of func(document) over repeat runs, in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(document)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the ml_tabular_ext table extraction.")
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--tables', type=int, default=3, help="Tables per page.")
+    parser.add_argument('--rows', type=int, default=40, help="Rows per table, including the header row.")
+    parser.add_argument('--cols', type=int, default=8, help="Cells per row.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--points', type=int, default=10000, help="Points located in the cells.")
+    args = parser.parse_args()
+
+    document = build_document(args.pages, args.tables, args.rows, args.cols)
+    cells = args.pages * args.tables * args.rows * args.cols
+    print(f"Document: {args.pages} pages, {args.pages * args.tables} tables, {cells} cells")
+
+    if legacy_build_output(document) != fused_build_output(document):
+        raise SystemExit("The single-pass extraction output differs from the legacy output.")
+
+    legacy_seconds = best_time(legacy_build_output, document, args.repeat)
+    fused_seconds = best_time(fused_build_output, document, args.repeat)
+    print(f"legacy (4 traversals): {legacy_seconds * 1000:9.1f} ms  {cells / legacy_seconds:12.0f} cells/s")
+    print(f"single pass:           {fused_seconds * 1000:9.1f} ms  {cells / fused_seconds:12.0f} cells/s")
+    print(f"speedup: {legacy_seconds / fused_seconds:.1f}x")
+
+    # Bulk point queries on the cell geometry (table_geometry.CellGeometry)
+    geometry = ml_tabular_ext.extract_tables(document)["geometry"]
+    points = np.random.default_rng(0).uniform(0, [80 + args.cols * 120, 100 + args.tables * (args.rows * 30 + 50)], size=(args.points, 2))
+    start = time.perf_counter()
+    cell_ids = geometry.locate_points(points)
+    seconds = time.perf_counter() - start
+    print(f"point queries: {args.points} points in {len(geometry)} cells, {(cell_ids >= 0).sum()} inside a cell, {seconds * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench_tracing.py
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+import tracing
+
+"""
+Benchmark of the overhead of the tracing spans of tracing.py.
+
+Measures the cost of a span (a parent span with a nested child span, as the fetch and docai_request
+spans of a page) with tracing on and off, in plain code, in THREADS concurrent threads and in asyncio
+tasks, then the time taken to export the metric and trace files of the recorded spans. A page opens
+about a dozen spans, against hundreds of milliseconds spent in the Document AI round trip.
+
+Usage:
+    python benchmarks/bench_tracing.py [--spans 100000] [--threads 8]
+"""
+
+
+def nested_spans(count):
+    """Opens count parent spans with a child span each."""
+    for index in range(count):
+        with tracing.span("fetch", page=f"page-{index % 100}.pdf", processor="ml_tabular_ext"):
+            with tracing.span("docai_request", attempt=1):
+                pass
+
+
+async def async_spans(count, tasks):
+    """Opens the nested spans in concurrent asyncio tasks."""
+    async def task(task_count):
+        for index in range(task_count):
+            async with tracing.span("upload_stage", page=f"page-{index % 100}.pdf"):
+                with tracing.span("fetch", processor="ml_tabular_ext"):
+                    pass
+            if index % 100 == 0:
+                await asyncio.sleep(0)
+
+    await asyncio.gather(*(task(count // tasks) for _ in range(tasks)))
+
+
+def measure(label, run, count, enabled):
+    """Runs a workload of count nested spans and prints the cost of one span in microseconds."""
+    tracing.configure(enabled=enabled, max_trace_events=count * 2)
+    tracing.reset()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    # Two spans per iteration
+    print(f"{label:<10}{'on' if enabled else 'off':>8}{seconds * 1e6 / (count * 2):>12.2f}{count * 2 / seconds:>14,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the tracing spans.")
+    parser.add_argument('--spans', type=int, default=100000, help="Parent spans per workload, each with one child span.")
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    def threaded():
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(nested_spans, [args.spans // args.threads] * args.threads))
+
+    workloads = [
+        ("plain", lambda: nested_spans(args.spans)),
+        ("threads", threaded),
+        ("asyncio", lambda: asyncio.run(async_spans(args.spans, args.threads))),
+    ]
+    print(f"{'workload':<10}{'tracing':>8}{'us/span':>12}{'spans/s':>14}")
+    for label, run in workloads:
+        for enabled in (False, True):
+            measure(label, run, args.spans, enabled)
+
+    # Export of the spans recorded by the last workload
+    with tempfile.TemporaryDirectory() as trace_dir:
+        start = time.perf_counter()
+        metrics_path = tracing.write_metrics(trace_dir)
+        metrics_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        trace_path = tracing.write_trace(trace_dir)
+        trace_seconds = time.perf_counter() - start
+        print(f"metrics file: {os.path.getsize(metrics_path) / 1e3:.1f} KB in {metrics_seconds * 1000:.1f} ms, "
+              f"trace file: {os.path.getsize(trace_path) / 1e6:.1f} MB in {trace_seconds * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
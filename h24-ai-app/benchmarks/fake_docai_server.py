@@ -0,0 +1,414 @@
+# fake_docai_server.py
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from concurrent import futures
+
+import grpc
+import fitz
+from google.cloud import documentai
+
+# The shared runtime modules are imported from the application directory
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, app_dir)
+from page_batcher import _shift_text_anchors
+
+"""
+Local stand-in of the Document AI online processing service, for load tests without the Google
+endpoints and their quota.
+
+The server speaks the DocumentProcessorService gRPC protocol, so main_file.py and the processors run
+unchanged against it once DOCAI_API_ENDPOINT points at it (see docai_clients.py):
+
+- ProcessDocument: replays a recorded Document of the processor named in the request, repeated for
+  every page of the request (batched requests of page_batcher.py get one page per source page). The
+  Document is picked from the hash of the request content, so a page always gets the same response.
+- GetProcessor: every processor is ENABLED, so the processor lifecycle never enables one.
+
+The recorded Documents are rebuilt from the outputs of real runs:
+- temp/Form9- T.O_extraction_output.json: the category, entities and table of a processed form.
+- h24_ml_model/ml_model - form_classifier/output_analysis/output_model_v4.csv: the category
+  predictions (and confidences) of the form classifier on 147 forms.
+- h24_ml_model/ml_model - tabular_extractor/output_analysis/*_extracted-*.json: extracted tables.
+- --recorded DIR: Documents saved as <processor_name>/*.json (Document.to_json) or *.pb (raw
+  protobuf, e.g. files of the response cache).
+
+Latency, errors and quota are injected per request: a lognormal latency around --latency-ms (plus
+--per-page-ms for each extra page), --error-rate of UNAVAILABLE answers, and RESOURCE_EXHAUSTED once a
+processor gets more than --quota-per-minute requests in a minute.
+
+The processors are identified by the processor ID of the request name, mapped to a processor name
+with --processor ID=NAME (the ID is taken as the name otherwise). Requests of unknown processors get a
+Document without entities.
+
+Usage:
+    python benchmarks/fake_docai_server.py [--port 50051] [--latency-ms 800] [--error-rate 0.01] [--quota-per-minute 120]
+"""
+
+SERVICE_NAME = "google.cloud.documentai.v1.DocumentProcessorService"
+ml_model_dir = os.path.join(os.path.dirname(app_dir), 'h24_ml_model')
+DEFAULT_EXTRACTION_OUTPUTS = [os.path.join(app_dir, 'temp', 'Form9- T.O_extraction_output.json')]
+DEFAULT_CATEGORY_SAMPLES = os.path.join(ml_model_dir, 'ml_model - form_classifier', 'output_analysis', 'output_model_v4.csv')
+DEFAULT_TABLE_SAMPLES = sorted(glob.glob(os.path.join(ml_model_dir, 'ml_model - tabular_extractor', 'output_analysis', '*_extracted-*.json')))
+PAGE_WIDTH, PAGE_HEIGHT = 1654, 2339  # Pixels of the sample scans (A4 at 200 DPI)
+
+
+def _text_anchor(start, end):
+    return {"text_segments": [{"start_index": start, "end_index": end}]}
+
+
+def _bounding_poly(box):
+    """Returns the bounding polygon of an (x_min, y_min, x_max, y_max) box, None without box."""
+    if box is None:
+        return None
+    x_min, y_min, x_max, y_max = box
+    return {"vertices": [{"x": x_min, "y": y_min}, {"x": x_max, "y": y_min}, {"x": x_max, "y": y_max}, {"x": x_min, "y": y_max}]}
+
+
+def _single_page_document(text, page=None, entities=()):
+    """Returns a one-page Document whose page layout covers the whole text."""
+    page = {**(page or {}), "page_number": 1, "dimension": {"width": PAGE_WIDTH, "height": PAGE_HEIGHT, "unit": "pixels"},
+            "layout": {"text_anchor": _text_anchor(0, len(text))}}
+    return documentai.Document(mime_type="application/pdf", text=text, pages=[page], entities=list(entities))
+
+
+def category_document(category, confidence):
+    """Returns the Document of a classifier prediction: one entity typed with the category."""
+    return _single_page_document("", entities=[{"type_": category, "confidence": confidence}])
+
+
+def entities_document(entities):
+    """
+    Returns the Document of a custom extractor.
+
+    Args:
+        entities (list): The (entity_type, entity_text, confidence) of each entity.
+    """
+    text = ""
+    document_entities = []
+    for entity_type, entity_text, confidence in entities:
+        start = len(text)
+        text += entity_text + "\n"
+        document_entities.append({"type_": entity_type, "mention_text": entity_text, "confidence": confidence,
+                                  "text_anchor": _text_anchor(start, len(text)), "page_anchor": {"page_refs": [{"page": 0}]}})
+    return _single_page_document(text, entities=document_entities)
+
+
+def table_document(rows):
+    """
+    Returns the Document of the form parser with one table.
+
+    Args:
+        rows (list): The (is_header, cells) of each row, a cell being a (text, confidence, box) tuple
+            with box an (x_min, y_min, x_max, y_max) pixel box or None.
+    """
+    text = ""
+    header_rows = []
+    body_rows = []
+    for is_header, cells in rows:
+        row_cells = []
+        for cell_text, confidence, box in cells:
+            start = len(text)
+            text += cell_text + "\n"
+            row_cells.append({"layout": {"text_anchor": _text_anchor(start, len(text)), "confidence": confidence,
+                                         "bounding_poly": _bounding_poly(box)}})
+        (header_rows if is_header else body_rows).append({"cells": row_cells})
+    # The recorded outputs have no table boundaries
+    table = {"header_rows": header_rows, "body_rows": body_rows}
+    return _single_page_document(text, page={"tables": [table]})
+
+
+def documents_from_extraction_output(path):
+    """
+    Rebuilds the Documents of the processors from a merged extraction output of main_file.py.
+
+    Returns:
+        dict: A list of Documents keyed by processor name.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        outputs = json.load(f)["processor_outputs"]
+
+    documents = {}
+    for processor_name, output in outputs.items():
+        if "category_prediction" in output:
+            document = category_document(output["category_prediction"], output["confidence"])
+        elif "document_entities" in output:
+            document = entities_document([(entity["entity_type"], entity["entity_text"], entity["entity_confidence"])
+                                          for entity in output["document_entities"]])
+        elif "table_entities" in output:
+            rows = {}
+            for cell in output["table_entities"]["content_data"]:
+                limits = cell["cell_data"]["cell_limits"]
+                box = None if limits is None else (limits["left_limit"]["x_position"], limits["top_limit"]["y_position"],
+                                                   limits["right_limit"]["x_position"], limits["bottom_limit"]["y_position"])
+                content = cell["cell_data"]["cell_content"]
+                rows.setdefault((cell["row_type"], cell["row_index"]), []).append(
+                    (content["text"] if content else "", cell["cell_data"]["cell_extraction_confidence"], box))
+            document = table_document([(row_type == "header", cells) for (row_type, _), cells in rows.items()])
+        else:
+            continue
+        documents.setdefault(processor_name, []).append(document)
+    return documents
+
+
+def category_documents_from_csv(path):
+    """Returns a classifier Document for each prediction (category_prediction, confidence) of a CSV file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [category_document(row["category_prediction"], float(row["confidence"])) for row in csv.DictReader(f)]
+
+
+def table_documents_from_samples(paths):
+    """Returns a form parser Document for each table sample (rows of cells with column_name, cell_text, position)."""
+    documents = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            sample_rows = json.load(f)
+        if not sample_rows:
+            continue
+        column_names = [cell["column_name"] for cell in sample_rows[0]["cells"]]
+        rows = [(True, [(name, 1.0, None) for name in column_names])]
+        for sample_row in sample_rows:
+            cells = []
+            for cell in sample_row["cells"]:
+                xs = [vertex["x"] for vertex in cell.get("bounding_poly") or []]
+                ys = [vertex["y"] for vertex in cell.get("bounding_poly") or []]
+                box = (min(xs), min(ys), max(xs), max(ys)) if xs else None
+                cells.append((cell["cell_text"] or "", cell["cell_confidence"], box))
+            rows.append((False, cells))
+        documents.append(table_document(rows))
+    return documents
+
+
+def load_recorded_documents(directory):
+    """
+    Loads recorded Documents saved as <directory>/<processor_name>/*.json or *.pb.
+
+    Returns:
+        dict: A list of Documents keyed by processor name.
+    """
+    documents = {}
+    for processor_name in sorted(os.listdir(directory)):
+        for path in sorted(glob.glob(os.path.join(directory, processor_name, '*'))):
+            if path.endswith('.json'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    document = documentai.Document.from_json(f.read(), ignore_unknown_fields=True)
+            elif path.endswith('.pb'):
+                with open(path, 'rb') as f:
+                    document = documentai.Document.deserialize(f.read())
+            else:
+                continue
+            documents.setdefault(processor_name, []).append(document)
+    return documents
+
+
+def default_documents(recorded_dir=None):
+    """Returns the recorded Documents of every default sample (and of recorded_dir), keyed by processor name."""
+    documents = {}
+    for path in DEFAULT_EXTRACTION_OUTPUTS:
+        if os.path.exists(path):
+            for processor_name, processor_documents in documents_from_extraction_output(path).items():
+                documents.setdefault(processor_name, []).extend(processor_documents)
+    if os.path.exists(DEFAULT_CATEGORY_SAMPLES):
+        documents.setdefault("ml_cat_prediction", []).extend(category_documents_from_csv(DEFAULT_CATEGORY_SAMPLES))
+    documents.setdefault("ml_tabular_ext", []).extend(table_documents_from_samples(DEFAULT_TABLE_SAMPLES))
+    if recorded_dir:
+        for processor_name, processor_documents in load_recorded_documents(recorded_dir).items():
+            documents.setdefault(processor_name, []).extend(processor_documents)
+    return documents
+
+
+def repeat_document(document, page_count):
+    """
+    Returns a Document made of page_count copies of a one-page Document, with the text anchors and
+    page references of each copy moved to its page.
+    """
+    source = documentai.Document.pb(document)
+    if page_count == 1:
+        return document
+    repeated = type(source)(mime_type=source.mime_type, text=source.text * page_count)
+    for page_index in range(page_count):
+        offset = page_index * len(source.text)
+        for page in source.pages:
+            new_page = repeated.pages.add()
+            new_page.CopyFrom(page)
+            new_page.page_number = len(repeated.pages)
+            _shift_text_anchors(new_page, -offset)
+        for entity in source.entities:
+            new_entity = repeated.entities.add()
+            new_entity.CopyFrom(entity)
+            _shift_text_anchors(new_entity, -offset)
+            for page_ref in new_entity.page_anchor.page_refs:
+                page_ref.page += page_index * len(source.pages)
+    return documentai.Document.wrap(repeated)
+
+
+class FakeDocumentAI:
+    """
+    The fake DocumentProcessorService.
+
+    Args:
+        documents (dict): The recorded Documents of each processor name (see default_documents).
+        latency_ms (float): The median latency of a one-page request.
+        latency_sigma (float): The shape of the lognormal latency, 0 for a constant latency.
+        per_page_ms (float): The latency added by each extra page of a request.
+        error_rate (float): The fraction of requests answered UNAVAILABLE.
+        quota_per_minute (int): The requests accepted per processor per minute, 0 for no quota.
+        processor_names (dict, optional): The processor name of each processor ID.
+        seed (int): The seed of the latency and error draws.
+    """
+
+    def __init__(self, documents, latency_ms=800, latency_sigma=0.3, per_page_ms=50, error_rate=0.0, quota_per_minute=0,
+                 processor_names=None, seed=0):
+        self.documents = documents
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.per_page_ms = per_page_ms
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.processor_names = processor_names or {}
+        self.stats = {"requests": 0, "pages": 0, "errors": 0, "throttled": 0}
+        self._random = random.Random(seed)
+        self._requests = {}  # processor ID -> times of the requests of the last minute
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _within_quota(self, processor_id):
+        if not self.quota_per_minute:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            requests = self._requests.setdefault(processor_id, deque())
+            while requests and now - requests[0] >= 60:
+                requests.popleft()
+            if len(requests) >= self.quota_per_minute:
+                return False
+            requests.append(now)
+            return True
+
+    def _latency(self, page_count):
+        with self._lock:
+            factor = self._random.lognormvariate(0, self.latency_sigma) if self.latency_sigma else 1.0
+            failed = self._random.random() < self.error_rate
+        return (self.latency_ms * factor + self.per_page_ms * (page_count - 1)) / 1000, failed
+
+    def process_document(self, request, context):
+        # projects/{project}/locations/{location}/processors/{processor}[/processorVersions/{version}]
+        processor_id = request.name.split('/processors/')[-1].split('/')[0]
+        self._count("requests")
+        if not self._within_quota(processor_id):
+            self._count("throttled")
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"Quota exceeded for processor {processor_id}.")
+
+        content = request.raw_document.content
+        with fitz.open(stream=content, filetype='pdf') as pdf:
+            page_count = len(pdf)
+        latency, failed = self._latency(page_count)
+        time.sleep(latency)
+        if failed:
+            self._count("errors")
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected error.")
+        self._count("pages", page_count)
+
+        documents = self.documents.get(self.processor_names.get(processor_id, processor_id))
+        if documents:
+            document = documents[int(hashlib.sha256(content).hexdigest(), 16) % len(documents)]
+        else:
+            document = _single_page_document("")
+        return documentai.ProcessResponse(document=repeat_document(document, page_count))
+
+    def get_processor(self, request, context):
+        return documentai.Processor(name=request.name, state=documentai.Processor.State.ENABLED)
+
+    def start(self, port=0, max_workers=64):
+        """
+        Starts the server on localhost.
+
+        Args:
+            port (int): The port, a free port if 0.
+            max_workers (int): The number of requests handled at the same time.
+
+        Returns:
+            int: The port of the server.
+        """
+        handlers = grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            "ProcessDocument": grpc.unary_unary_rpc_method_handler(
+                self.process_document,
+                request_deserializer=documentai.ProcessRequest.deserialize,
+                response_serializer=documentai.ProcessResponse.serialize),
+            "GetProcessor": grpc.unary_unary_rpc_method_handler(
+                self.get_processor,
+                request_deserializer=documentai.GetProcessorRequest.deserialize,
+                response_serializer=documentai.Processor.serialize),
+        })
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers),
+                                   options=[('grpc.max_receive_message_length', 64 * 1024 * 1024)])
+        self._server.add_generic_rpc_handlers((handlers,))
+        port = self._server.add_insecure_port(f"localhost:{port}")
+        self._server.start()
+        return port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop(grace=None)
+            self._server = None
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+def parse_processor_names(values):
+    """Converts the ID=NAME values of --processor into a dictionary."""
+    names = {}
+    for value in values:
+        processor_id, _, name = value.partition('=')
+        if not processor_id or not name:
+            raise SystemExit(f"Invalid --processor value '{value}', expected ID=NAME.")
+        names[processor_id] = name
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Document AI server.")
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--latency-ms', type=float, default=800, help="Median latency of a one-page request.")
+    parser.add_argument('--latency-sigma', type=float, default=0.3, help="Shape of the lognormal latency (0: constant).")
+    parser.add_argument('--per-page-ms', type=float, default=50, help="Latency of each extra page of a request.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered UNAVAILABLE.")
+    parser.add_argument('--quota-per-minute', type=int, default=0, help="Requests per processor per minute, 0 for no quota.")
+    parser.add_argument('--processor', action='append', default=[], metavar='ID=NAME',
+                        help="Processor name of a processor ID of the keys configuration. Can be repeated.")
+    parser.add_argument('--recorded', help="Directory of recorded Documents, <processor_name>/*.json or *.pb.")
+    parser.add_argument('--workers', type=int, default=64, help="Requests handled at the same time.")
+    args = parser.parse_args()
+
+    documents = default_documents(args.recorded)
+    server = FakeDocumentAI(documents, args.latency_ms, args.latency_sigma, args.per_page_ms, args.error_rate,
+                            args.quota_per_minute, parse_processor_names(args.processor))
+    port = server.start(args.port, args.workers)
+    print(f"Fake Document AI listening on localhost:{port} ({', '.join(f'{name}: {len(docs)} documents' for name, docs in documents.items())}).")
+    print(f"Run main_file.py with DOCAI_API_ENDPOINT=localhost:{port}. Stop with Ctrl-C.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"Requests: {server.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
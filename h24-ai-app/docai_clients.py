@@ -0,0 +1,166 @@
+# docai_clients.py
+import os
+import logging
+import threading
+import itertools
+
+import grpc
+from google.cloud import documentai
+from google.cloud.documentai_v1.services.document_processor_service.transports.grpc import DocumentProcessorServiceGrpcTransport
+
+"""
+Shared Document AI clients, one pool of gRPC channels per API endpoint.
+
+Building a DocumentProcessorServiceClient opens a new gRPC channel, which means a new TLS handshake
+and a new auth token fetch. The processors (online_process) and the processor lifecycle functions
+in main_file.py (enable_processor / disable_processor) get their client from get_client(location),
+so every request to the same endpoint ({location}-documentai.googleapis.com) reuses the same channels.
+
+Configuration:
+- CHANNEL_POOL_SIZE: Number of clients (each with its own channel) kept per endpoint. Requests are
+  distributed round-robin over them, which spreads the concurrent calls over several HTTP/2 connections.
+- KEEPALIVE_TIME_MS / KEEPALIVE_TIMEOUT_MS: gRPC keepalive pings, so idle channels are not dropped
+  between batches.
+- API_ENDPOINT_OVERRIDE: Send every request to this host instead of the Google endpoint, using a
+  plaintext channel. Used to test the processors against a local fake Document AI server
+  (e.g. DOCAI_API_ENDPOINT=localhost:50051).
+
+The values can be set with the DOCAI_* environment variables or with configure().
+get_stats() returns the number of channels created and reused per endpoint.
+"""
+
+#Configuration
+CHANNEL_POOL_SIZE = int(os.environ.get("DOCAI_CHANNEL_POOL_SIZE", 2))
+KEEPALIVE_TIME_MS = int(os.environ.get("DOCAI_KEEPALIVE_TIME_MS", 30000))
+KEEPALIVE_TIMEOUT_MS = int(os.environ.get("DOCAI_KEEPALIVE_TIMEOUT_MS", 10000))
+API_ENDPOINT_OVERRIDE = os.environ.get("DOCAI_API_ENDPOINT")
+
+# Pools of clients keyed by API endpoint
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def configure(pool_size=None, keepalive_time_ms=None, keepalive_timeout_ms=None, api_endpoint=None):
+    """
+    Changes the client configuration. Pools already created are closed, so the next
+    get_client() call builds the channels with the new values.
+
+    Args:
+        pool_size (int, optional): Number of channels per endpoint.
+        keepalive_time_ms (int, optional): Interval between keepalive pings.
+        keepalive_timeout_ms (int, optional): Time to wait for a keepalive acknowledgement.
+        api_endpoint (str, optional): Host used instead of the Google endpoint (local fake server).
+    """
+    global CHANNEL_POOL_SIZE, KEEPALIVE_TIME_MS, KEEPALIVE_TIMEOUT_MS, API_ENDPOINT_OVERRIDE
+
+    if pool_size is not None:
+        CHANNEL_POOL_SIZE = max(1, int(pool_size))
+    if keepalive_time_ms is not None:
+        KEEPALIVE_TIME_MS = int(keepalive_time_ms)
+    if keepalive_timeout_ms is not None:
+        KEEPALIVE_TIMEOUT_MS = int(keepalive_timeout_ms)
+    if api_endpoint is not None:
+        API_ENDPOINT_OVERRIDE = api_endpoint
+
+    close_clients()
+
+
+def get_api_endpoint(location):
+    """Returns the Document AI endpoint used for a location."""
+    return API_ENDPOINT_OVERRIDE or f"{location}-documentai.googleapis.com"
+
+
+def _channel_options():
+    """gRPC channel options shared by every channel of the pools."""
+    return [
+        ("grpc.max_send_message_length", -1),
+        ("grpc.max_receive_message_length", -1),
+        ("grpc.keepalive_time_ms", KEEPALIVE_TIME_MS),
+        ("grpc.keepalive_timeout_ms", KEEPALIVE_TIMEOUT_MS),
+        ("grpc.keepalive_permit_without_calls", 1),
+    ]
+
+
+def _create_client(api_endpoint):
+    """
+    Creates a Document AI client with its own gRPC channel.
+
+    Args:
+        api_endpoint (str): The host of the Document AI service.
+
+    Returns:
+        documentai.DocumentProcessorServiceClient: The new client.
+    """
+    if API_ENDPOINT_OVERRIDE:
+        # Local fake server: plaintext channel, no credentials
+        channel = grpc.insecure_channel(api_endpoint, options=_channel_options())
+    else:
+        channel = DocumentProcessorServiceGrpcTransport.create_channel(
+            api_endpoint,
+            scopes=DocumentProcessorServiceGrpcTransport.AUTH_SCOPES,
+            options=_channel_options(),
+        )
+    transport = DocumentProcessorServiceGrpcTransport(host=api_endpoint, channel=channel)
+    return documentai.DocumentProcessorServiceClient(transport=transport)
+
+
+def get_client(location):
+    """
+    Returns a Document AI client for the location, reusing the channels of the endpoint pool.
+
+    Args:
+        location (str): The location of the Document AI processor.
+
+    Returns:
+        documentai.DocumentProcessorServiceClient: A client of the endpoint pool.
+    """
+    api_endpoint = get_api_endpoint(location)
+
+    with _pools_lock:
+        pool = _pools.get(api_endpoint)
+        if pool is None:
+            pool = {
+                "clients": [],
+                "next_client": itertools.cycle(range(CHANNEL_POOL_SIZE)),
+                "channels_created": 0,
+                "channel_reuses": 0,
+            }
+            _pools[api_endpoint] = pool
+
+        index = next(pool["next_client"])
+        if index < len(pool["clients"]):
+            pool["channel_reuses"] += 1
+            return pool["clients"][index]
+
+        client = _create_client(api_endpoint)
+        pool["clients"].append(client)
+        pool["channels_created"] += 1
+        logging.info(f"Created Document AI channel {len(pool['clients'])}/{CHANNEL_POOL_SIZE} for {api_endpoint}.")
+        return client
+
+
+def get_stats():
+    """
+    Returns the channel counters of each endpoint.
+
+    Returns:
+        dict: For each endpoint, the number of channels created and the number of requests
+        that reused an existing channel.
+    """
+    with _pools_lock:
+        return {
+            api_endpoint: {
+                "channels_created": pool["channels_created"],
+                "channel_reuses": pool["channel_reuses"],
+            }
+            for api_endpoint, pool in _pools.items()
+        }
+
+
+def close_clients():
+    """Closes every channel of the pools."""
+    with _pools_lock:
+        for pool in _pools.values():
+            for client in pool["clients"]:
+                client.transport.close()
+        _pools.clear()
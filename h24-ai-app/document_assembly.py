@@ -0,0 +1,221 @@
+# document_assembly.py
+import os
+import time
+import logging
+import threading
+
+from output_writers import FILE_SUFFIXES, output_path, read_page_output
+
+"""
+Reassembly of the page outputs of main_file.py into one document per input file.
+
+Every page of a file is an independent item of the pipeline (see main_file.build_pipeline_stages):
+the pages are sent to their processors in parallel, so they finish in any order, and some of them may
+fail. The split stage registers the pages of a file as it reads them (start_file, add_pages, end_file).
+The DocumentAssembler follows them and, once every page is registered and the last page is written or
+has failed, writes the document of the file with every page in page order:
+
+    {
+        "file_name": "caregiver.pdf",
+        "page_count": 60,
+        "status": "partial",
+        "failed_pages": [17],
+        "pages": [
+            {"page_number": 1, "page_name": "caregiver-p1.pdf", "status": "done", "page_type": "presentismo",
+             "failed_processors": [], "error": null, "output_file": "caregiver-p1_extraction_output.json"},
+            ...
+        ]
+    }
+
+Page status:
+- done: the page output was written and every processor succeeded.
+- partial: the page output was written, but the processors of failed_processors returned no output.
+- failed: the page raised an error (error) and has no output.
+- skipped: the page was not sent to any processor (its page type is not extracted, see --page-types).
+
+The status of the document is done when no page is failed or partial, failed when no page was
+written, partial otherwise. The pages written by a previous run (see job_state.py) are included when
+their output file is found.
+
+The documents are written by the output writer (write_document): <file>_document.json (or
+.msgpack.zst) for the per-page formats, and rows of the documents table for the columnar formats.
+A document references the output file of each page (output_file, in the directory of the document)
+instead of copying the output: the assembler only keeps the status of the pages of a file, so its
+memory does not grow with the page outputs, and each output is written once. read_document() reads a
+document back with the outputs of its pages, one page at a time.
+"""
+
+#Configuration
+ASSEMBLE = os.environ.get("DOCAI_ASSEMBLE", "1") != "0"  # Default of main_file.py --no-assemble
+
+
+class DocumentAssembler:
+    """
+    Collects the page outputs of each file and writes the document of the file after its last page (thread-safe).
+
+    Args:
+        writer: The output writer (see output_writers.py), with write_document(file_name, document).
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        # The page outputs of the columnar formats are rows of the other tables, not files
+        self.output_files = getattr(writer, "output_format", None) in FILE_SUFFIXES
+        self.stats = {"documents": 0, "done": 0, "partial": 0, "failed": 0, "pages": 0, "failed_pages": 0}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def start_file(self, file_name):
+        """Registers a file, before its pages."""
+        with self._lock:
+            self._files[file_name] = {"pages": {}, "pending": 0, "registering": True, "started_at": time.time()}
+
+    def add_pages(self, file_name, pages):
+        """
+        Registers the next pages of a file, in page order.
+
+        Args:
+            file_name (str): The name of the input file.
+            pages (list): One dict per page: page_name, page_type (None without page classifier), and
+                status: "pending" (sent to the processors), "skipped" (not sent) or "resumed" (written
+                by a previous run).
+        """
+        entries = []
+        for page in pages:
+            entry = {"page_number": None, "page_name": page["page_name"], "status": page["status"],
+                     "page_type": page.get("page_type"), "failed_processors": [], "error": None, "output_file": None}
+            if page["status"] == "resumed":
+                entry.update(status="done", output_file=self._previous_output_file(page["page_name"]), resumed=True)
+            entries.append(entry)
+
+        with self._lock:
+            document = self._files[file_name]
+            for entry in entries:
+                entry["page_number"] = len(document["pages"]) + 1
+                document["pages"][entry["page_name"]] = entry
+                document["pending"] += entry["status"] == "pending"
+
+    def end_file(self, file_name):
+        """
+        Marks the end of the pages of a file.
+
+        Returns:
+            str: The path of the document when no page is pending (it is written at once), None otherwise.
+        """
+        with self._lock:
+            document = self._files[file_name]
+            document["registering"] = False
+            complete = document["pending"] == 0
+        return self._finish(file_name) if complete else None
+
+    def _output_file(self, page_name):
+        """Returns the name of the output file of a page (in the output directory), None for the columnar formats."""
+        if not self.output_files:
+            return None
+        return os.path.basename(output_path(self.writer.output_dir, page_name, self.writer.output_format))
+
+    def _previous_output_file(self, page_name):
+        """Returns the name of the output file a previous run wrote for a page, None when it is not found."""
+        output_file = self._output_file(page_name)
+        if output_file is not None and not os.path.exists(os.path.join(self.writer.output_dir, output_file)):
+            logging.warning(f"The previous output of {page_name} was not found in {self.writer.output_dir}.")
+            return None
+        return output_file
+
+    def page_written(self, file_name, page_name, merged_results):
+        """
+        Records the output of a page.
+
+        Returns:
+            str: The path of the document when this was the last page of the file, None otherwise.
+        """
+        failed_processors = merged_results.get("failed_processors", [])
+        return self._settle(file_name, page_name, status="partial" if failed_processors else "done", failed_processors=failed_processors,
+                            output_file=self._output_file(page_name))
+
+    def page_failed(self, file_name, page_name, error):
+        """
+        Records the failure of a page.
+
+        Returns:
+            str: The path of the document when this was the last page of the file, None otherwise.
+        """
+        return self._settle(file_name, page_name, status="failed", error=str(error))
+
+    def _settle(self, file_name, page_name, **values):
+        with self._lock:
+            document = self._files.get(file_name)
+            if document is None or page_name not in document["pages"]:
+                return None
+            entry = document["pages"][page_name]
+            if entry["status"] != "pending":
+                return None  # Already settled, e.g. a failure after the page was written
+            entry.update(values)
+            document["pending"] -= 1
+            last_page = document["pending"] == 0 and not document["registering"]
+        return self._finish(file_name) if last_page else None
+
+    def _finish(self, file_name):
+        """Writes the document of a file whose pages are all settled."""
+        with self._lock:
+            pages = list(self._files.pop(file_name)["pages"].values())
+
+        statuses = [page["status"] for page in pages]
+        failed_pages = [page["page_number"] for page in pages if page["status"] in ("failed", "partial")]
+        if not failed_pages:
+            status = "done"
+        elif "done" in statuses or "partial" in statuses:
+            status = "partial"
+        else:
+            status = "failed"
+        document = {"file_name": file_name, "page_count": len(pages), "status": status, "failed_pages": failed_pages, "pages": pages}
+
+        with self._lock:
+            self.stats["documents"] += 1
+            self.stats[status] += 1
+            self.stats["pages"] += len(pages)
+            self.stats["failed_pages"] += len(failed_pages)
+        return self.writer.write_document(file_name, document)
+
+    def close(self):
+        """Writes the documents of the files with pages still pending (pages lost by the pipeline), as failed pages."""
+        with self._lock:
+            unfinished = {file_name: [name for name, entry in document["pages"].items() if entry["status"] == "pending"]
+                          for file_name, document in self._files.items()}
+            for document in self._files.values():
+                # A file whose split failed halfway keeps the pages registered so far
+                document["registering"] = False
+        for file_name, page_names in unfinished.items():
+            logging.warning(f"{file_name}: {len(page_names)} pages were never written, the document is incomplete.")
+            for page_name in page_names:
+                self.page_failed(file_name, page_name, "The page was not processed.")
+            if not page_names:
+                self._finish(file_name)
+
+
+def read_document(path):
+    """
+    Reads a document written for a per-page format, with the outputs of its pages.
+
+    Args:
+        path (str): The <file>_document.json (or .msgpack.zst) file.
+
+    Returns:
+        tuple: The document, and a generator of (page, output) tuples in page order. Each output is
+        read when its page is reached, None when the page has no output file or it cannot be read.
+    """
+    document = read_page_output(path)
+    output_dir = os.path.dirname(path)
+
+    def page_outputs():
+        for page in document["pages"]:
+            output = None
+            if page.get("output_file"):
+                output_file = os.path.join(output_dir, page["output_file"])
+                try:
+                    output = read_page_output(output_file)
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Could not read the output of {page['page_name']} from {output_file}: {e}")
+            yield page, output
+
+    return document, page_outputs()
@@ -0,0 +1,142 @@
+# folder_watcher.py
+import os
+import time
+import asyncio
+import logging
+
+"""
+Watch of the input folder, used by main_file.py --watch.
+
+watch_folder() is an asynchronous generator of the PDF files of a folder: the files already in the
+folder first, then the files as they land. The folder is watched with watchdog when it is installed
+(inotify on Linux, ReadDirectoryChangesW on Windows), otherwise it is scanned every POLL_INTERVAL seconds.
+
+A file is only returned once it is complete: its size and modification time must be unchanged for
+SETTLE_SECONDS, so a PDF still being copied into the folder is not split halfway. A file that is
+written again later is returned again (the job state of main_file.py skips it if its content did not change).
+A file removed from the folder is forgotten, so a long-running watch only keeps the files currently in the folder.
+"""
+
+#Configuration
+POLL_INTERVAL = float(os.environ.get("DOCAI_WATCH_POLL_SECONDS", 2))  # Scan interval without watchdog, and longest wait
+SETTLE_SECONDS = float(os.environ.get("DOCAI_WATCH_SETTLE_SECONDS", 2))  # Time a file must stay unchanged before it is handled
+
+
+def _start_observer(folder, on_change):
+    """
+    Starts a watchdog observer of a folder.
+
+    Args:
+        folder (str): The watched folder.
+        on_change (callable): Called from the observer thread with the path of each created, modified, deleted or moved file
+            (both paths of a move).
+
+    Returns:
+        The started observer, None when watchdog is not installed.
+    """
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        logging.info(f"watchdog is not installed, {folder} is scanned every {POLL_INTERVAL}s.")
+        return None
+
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            on_change(event.src_path)
+            if getattr(event, 'dest_path', None):
+                on_change(event.dest_path)
+
+    observer = Observer()
+    observer.schedule(ChangeHandler(), folder, recursive=False)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+
+async def watch_folder(folder, stop_event, poll_interval=POLL_INTERVAL, settle_seconds=SETTLE_SECONDS):
+    """
+    Yields the PDF files of a folder as they land, until stop_event is set.
+
+    Args:
+        folder (str): The watched folder.
+        stop_event (asyncio.Event): Ends the watch.
+        poll_interval (float): The scan interval when watchdog is not installed.
+        settle_seconds (float): The time a file must stay unchanged before it is returned.
+
+    Yields:
+        str: The path of each complete PDF file.
+    """
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    changed = set()
+
+    def on_change(path):
+        # Observer thread -> event loop
+        loop.call_soon_threadsafe(lambda: (changed.add(path), wakeup.set()))
+
+    observer = _start_observer(folder, on_change)
+    pending = {}  # path -> ((size, mtime), time since which it is unchanged)
+    handled = {}  # path -> (size, mtime) of the version already returned
+    warned = set()
+    full_scan = True
+
+    try:
+        while not stop_event.is_set():
+            if observer is None or full_scan:
+                paths = [os.path.join(folder, name) for name in os.listdir(folder)]
+                full_scan = False
+                # Forget the files removed since the last scan
+                present = set(paths)
+                for path in [path for path in handled if path not in present]:
+                    del handled[path]
+                warned &= present
+            else:
+                paths = list(changed)
+            changed.clear()
+
+            for path in paths:
+                name = os.path.basename(path)
+                if name.lower().endswith('.pdf'):
+                    pending.setdefault(path, None)
+                elif not os.path.isfile(path):
+                    warned.discard(path)
+                elif path not in warned and not name.startswith('.'):
+                    warned.add(path)
+                    logging.warning(f"Warning: The file format of '{name}' is not recognized as a PDF.")
+
+            now = time.monotonic()
+            ready = []
+            for path, previous in list(pending.items()):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del pending[path]
+                    handled.pop(path, None)
+                    continue
+                signature = (stat.st_size, stat.st_mtime)
+                if handled.get(path) == signature:
+                    del pending[path]
+                elif previous is None or previous[0] != signature:
+                    pending[path] = (signature, now)
+                elif now - previous[1] >= settle_seconds:
+                    del pending[path]
+                    handled[path] = signature
+                    ready.append(path)
+
+            for path in sorted(ready):
+                yield path
+
+            # Woken up by the observer, or at least every poll_interval (stop_event, settling files)
+            timeout = min(poll_interval, settle_seconds) if pending else poll_interval
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
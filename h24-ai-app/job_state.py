@@ -0,0 +1,318 @@
+# job_state.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+"""
+Job-state store of the runs of main_file.py, used to resume an interrupted run.
+
+The progress of every input file is recorded in a SQLite database, keyed by the SHA-256 of the file
+content, the set of processors of the run and the settings that change its outputs (output format,
+preprocessing options): the same file processed by other processors, or written in another format, is
+another job.
+
+- files: one row per job, with its status: "running" (started, or interrupted), "failed" (a processor
+  failed on one of its pages) or "done" (every page written without failure).
+- tasks: one row per page and processor, "done" with the analyzed processor output, or "failed".
+- pages: the pages whose output has been written.
+
+When main_file.main() runs again, the files already done are skipped, the pages already written are
+not processed again, and the processors that already succeeded on a page are not called again: their
+stored outputs are merged with the new ones. The stored outputs of a file are deleted once it is done.
+
+Selectors (main_file.py options):
+- force: process every file from scratch, the previous state of the files is discarded.
+- only_failed: only process the files of a previous run that are not done (failed or interrupted),
+  the new files are skipped.
+
+The store also holds the processor leases of processor_lifecycle.py, shared by every main_file.py
+process using the same database:
+
+- processor_leases: one row per process using a processor, with its expiry, renewed while the process
+  runs (a process that dies stops renewing its leases, they expire).
+- enabled_processors: the processors enabled by a run, disabled once their last live lease is released.
+
+Every change is committed at once, so the state survives a crash or a Ctrl-C.
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+JOB_STATE_PATH = os.environ.get("DOCAI_JOB_STATE_PATH", os.path.join(script_dir, 'temp', 'job_state.sqlite'))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    job_key TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    file_hash TEXT NOT NULL,
+    processors TEXT NOT NULL,
+    status TEXT NOT NULL,
+    page_count INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    job_key TEXT NOT NULL,
+    page_name TEXT NOT NULL,
+    processor TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_key, page_name, processor)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    job_key TEXT NOT NULL,
+    page_name TEXT NOT NULL,
+    written_at REAL NOT NULL,
+    PRIMARY KEY (job_key, page_name)
+);
+CREATE TABLE IF NOT EXISTS processor_leases (
+    processor TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (processor, holder)
+);
+CREATE TABLE IF NOT EXISTS enabled_processors (
+    processor TEXT PRIMARY KEY,
+    enabled_by TEXT NOT NULL,
+    enabled_at REAL NOT NULL
+);
+"""
+
+
+def hash_file(file_path):
+    """Returns the SHA-256 of the content of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JobStateStore:
+    """
+    SQLite store of the state of the jobs (thread-safe).
+
+    Args:
+        db_path (str): The path to the SQLite database, created if missing.
+        force (bool): Process every file from scratch.
+        only_failed (bool): Only process the files of a previous run that are not done.
+    """
+
+    def __init__(self, db_path=JOB_STATE_PATH, force=False, only_failed=False):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.force = force
+        self.only_failed = only_failed
+        self.stats = {"skipped_files": 0, "resumed_files": 0, "reused_results": 0}
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def job_key(file_hash, processor_names, settings=None):
+        """
+        Returns the key of the job of a file content processed by a set of processors.
+
+        Args:
+            file_hash (str): The SHA-256 of the file content.
+            processor_names (list): The processors of the run.
+            settings (dict, optional): The settings of the run that change its outputs (JSON-serializable).
+        """
+        key = f"{file_hash}|{','.join(sorted(processor_names))}"
+        if settings:
+            key += f"|{json.dumps(settings, sort_keys=True)}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._connection.execute(query, parameters).fetchall()
+
+    def file_status(self, job_key):
+        """Returns the status of a job, None if it was never started."""
+        rows = self._execute("SELECT status FROM files WHERE job_key = ?", (job_key,))
+        return rows[0][0] if rows else None
+
+    def should_process(self, job_key):
+        """
+        Applies the selectors to a job, and discards its state when it is processed from scratch.
+
+        Returns:
+            bool: Whether the file must be processed.
+        """
+        status = self.file_status(job_key)
+        if self.only_failed and status in (None, "done"):
+            selected = False
+        else:
+            selected = self.force or status != "done"
+
+        if not selected:
+            self.stats["skipped_files"] += 1
+            return False
+        if self.force:
+            self.reset(job_key)
+        elif status is not None:
+            self.stats["resumed_files"] += 1
+        return True
+
+    def reset(self, job_key):
+        """Discards the state of a job."""
+        with self._lock:
+            for table in ("files", "tasks", "pages"):
+                self._connection.execute(f"DELETE FROM {table} WHERE job_key = ?", (job_key,))
+
+    def start_file(self, job_key, file_name, file_hash, processor_names, page_count):
+        """
+        Records the start of a job, with the number of pages sent to the processors.
+
+        Returns:
+            bool: Whether the job is already complete (no page left to write).
+        """
+        self._execute(
+            "INSERT INTO files (job_key, file_name, file_hash, processors, status, page_count, updated_at) "
+            "VALUES (?, ?, ?, ?, 'running', ?, ?) ON CONFLICT(job_key) DO UPDATE SET "
+            "file_name = excluded.file_name, status = 'running', page_count = excluded.page_count, updated_at = excluded.updated_at",
+            (job_key, file_name, file_hash, ','.join(sorted(processor_names)), page_count, time.time()))
+        return self._update_file_status(job_key) == "done"
+
+    def set_page_count(self, job_key, page_count):
+        """
+        Sets the number of pages sent to the processors once the file is fully split (start_file() is
+        called with an upper bound, the pages are sent while the file is split).
+
+        Returns:
+            str: The status of the job.
+        """
+        self._execute("UPDATE files SET page_count = ?, updated_at = ? WHERE job_key = ?", (page_count, time.time(), job_key))
+        return self._update_file_status(job_key)
+
+    def completed_tasks(self, job_key):
+        """
+        Returns the stored outputs of the processors that succeeded on the pages of a job.
+
+        Returns:
+            dict: {page_name: {processor_name: output}}.
+        """
+        completed = {}
+        for page_name, processor, result in self._execute(
+                "SELECT page_name, processor, result FROM tasks WHERE job_key = ? AND status = 'done' AND result IS NOT NULL", (job_key,)):
+            completed.setdefault(page_name, {})[processor] = json.loads(result)
+        return completed
+
+    def complete_pages(self, job_key):
+        """Returns the pages of a job that were written without any failed processor."""
+        rows = self._execute(
+            "SELECT page_name FROM pages WHERE job_key = ? AND page_name NOT IN "
+            "(SELECT page_name FROM tasks WHERE job_key = ? AND status = 'failed')", (job_key, job_key))
+        return {row[0] for row in rows}
+
+    def record_task(self, job_key, page_name, processor_name, result, error=None):
+        """
+        Records the output of a processor on a page; a None output (or an error) is a failure.
+
+        Args:
+            job_key (str): The key of the job.
+            page_name (str): The name of the page.
+            processor_name (str): The name of the processor.
+            result: The analyzed processor output, JSON serializable.
+            error (str, optional): The error message of a failure.
+        """
+        failed = result is None or error is not None
+        self._execute(
+            "INSERT OR REPLACE INTO tasks (job_key, page_name, processor, status, result, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_key, page_name, processor_name, "failed" if failed else "done",
+             None if failed else json.dumps(result), error, time.time()))
+        if failed:
+            self._execute("UPDATE files SET status = 'failed', updated_at = ? WHERE job_key = ?", (time.time(), job_key))
+
+    def record_file_failure(self, job_key, error):
+        """Marks a job as failed, when its pages could not be sent to the processors."""
+        logging.warning(f"Job {job_key[:12]} failed: {error}")
+        self._execute("UPDATE files SET status = 'failed', updated_at = ? WHERE job_key = ?", (time.time(), job_key))
+
+    def record_page_written(self, job_key, page_name):
+        """
+        Records that the output of a page was written, and completes the job after its last page.
+
+        Returns:
+            str: The status of the job.
+        """
+        self._execute("INSERT OR REPLACE INTO pages (job_key, page_name, written_at) VALUES (?, ?, ?)",
+                      (job_key, page_name, time.time()))
+        return self._update_file_status(job_key)
+
+    def _update_file_status(self, job_key):
+        rows = self._execute("SELECT page_count, status FROM files WHERE job_key = ?", (job_key,))
+        if not rows:
+            return None
+        page_count, status = rows[0]
+        if status == "running" and len(self.complete_pages(job_key)) >= page_count:
+            with self._lock:
+                self._connection.execute("UPDATE files SET status = 'done', updated_at = ? WHERE job_key = ?", (time.time(), job_key))
+                # The outputs are only kept to resume the job
+                self._connection.execute("UPDATE tasks SET result = NULL WHERE job_key = ?", (job_key,))
+            return "done"
+        return status
+
+    def acquire_lease(self, processor, holder, lease_seconds):
+        """
+        Takes (or renews) the lease of a process on a processor.
+
+        Args:
+            processor (str): The processor ID.
+            holder (str): The ID of the lease holder (a process, for one of its processor names).
+            lease_seconds (float): The lease duration, the lease must be renewed before it expires.
+        """
+        self._execute("INSERT OR REPLACE INTO processor_leases (processor, holder, expires_at) VALUES (?, ?, ?)",
+                      (processor, holder, time.time() + lease_seconds))
+
+    def renew_leases(self, leases, lease_seconds):
+        """Renews the (processor, holder) leases of a process (heartbeat)."""
+        expires_at = time.time() + lease_seconds
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO processor_leases (processor, holder, expires_at) VALUES (?, ?, ?)",
+                                         [(processor, holder, expires_at) for processor, holder in leases])
+
+    def mark_enabled(self, processor, holder):
+        """Records that a run enabled a processor: it is disabled once its last live lease is released."""
+        self._execute("INSERT OR REPLACE INTO enabled_processors (processor, enabled_by, enabled_at) VALUES (?, ?, ?)",
+                      (processor, holder, time.time()))
+
+    def release_lease(self, processor, holder):
+        """
+        Releases the lease of a process on a processor.
+
+        Returns:
+            bool: Whether the processor must be disabled: it was enabled by a run and no other process
+            holds a live lease on it.
+        """
+        now = time.time()
+        with self._lock:
+            # The check and the deletes are one transaction, so two processes cannot both see the other lease
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("DELETE FROM processor_leases WHERE processor = ? AND (holder = ? OR expires_at <= ?)",
+                                         (processor, holder, now))
+                live = self._connection.execute("SELECT COUNT(*) FROM processor_leases WHERE processor = ?", (processor,)).fetchone()[0]
+                disable = False
+                if not live:
+                    disable = self._connection.execute("DELETE FROM enabled_processors WHERE processor = ?", (processor,)).rowcount > 0
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return disable
+
+    def summary(self):
+        """Returns the number of jobs of each status, with the selector stats of the run."""
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM files GROUP BY status"))
+        return {**counts, **self.stats}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
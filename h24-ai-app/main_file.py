@@ -9,17 +9,40 @@ import sys
 import fitz  
 import logging
 import subprocess
+import argparse
+import tempfile
 import asyncio
+import signal
+import contextvars
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import logging 
 
 from google.cloud import documentai_v1 as documentai
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
-from google.api_core.client_options import ClientOptions
 from google.api_core.exceptions import FailedPrecondition
 from google.cloud import documentai  # type: ignore
 
+from processor_runtime import PROCESSOR_REGISTRY, load_processors, run_fetch, run_analyze, classify_pages
+from pipeline import run_pipeline
+from processor_routing import load_router
+from output_writers import OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, get_writer
+from result_stream import ResultStream
+from job_state import JobStateStore, hash_file
+from folder_watcher import watch_folder
+from processor_lifecycle import ProcessorLifecycle, load_processor_configs, WARM_UP
+from page_preprocessing import PREPROCESS, default_options, preprocess_page, get_stats as get_preprocessing_stats
+from page_dedup import DEDUP, DEDUP_THRESHOLD, PageIndex, page_fingerprint
+from document_assembly import ASSEMBLE, DocumentAssembler
+from page_stream import SPLIT_CHUNK_PAGES, PageStream, extract_page, page_name
+from page_workers import SPLIT_WORKERS, PageWorkerPool
+from docai_clients import get_client, get_stats, close_clients
+import docai_clients
+import response_cache
+import rate_control
+import tracing
+
 '''
 This script is designed to process PDF documents using the Google Cloud Document AI service and additional custom processors. Here's a breakdown of its functionality:
 
@@ -31,13 +54,52 @@ API Enablement/Disabling: Functions are defined to enable and disable Google Clo
 
 PDF File Handling: Functions are provided to check and split PDF files into individual pages.
 
-External Processor Execution: The script asynchronously executes external processor scripts on the first page of each PDF document.
+Processor Execution: The processor scripts are imported once and called in-process on the first page of each PDF document.
+Every page is classified locally first (processors/ml_page_classifier.py): only attendance (presentismo) pages are sent to the
+extractors of ATTENDANCE_ONLY_PROCESSORS, on any page of the document, and the other processors only receive the first page.
+--page-types selects other page types for these extractors (e.g. evol_diaria), or every page ('all').
+The category predicted on the first page (ml_cat_prediction) selects the extractors of the document from the routing table
+(keys/processor_routing.json, see processor_routing.py); the likely extractors start while the classification is in flight.
+Scripts that do not register themselves in the processor runtime are still executed as external processes.
 
 Processor Configuration Loading: It loads processor configurations from JSON files.
 
 Asynchronous Execution: The main function (main()) coordinates the execution of various tasks, including enabling APIs, processing PDF files, and disabling APIs.
-
-Result Processing and Storage: Results from processing are merged and stored in JSON format.
+The PDF files stream through a staged pipeline (discover -> split -> upload -> parse -> write) with bounded queues and a configurable number of workers per stage.
+The split stage streams the pages of each file (see page_stream.py): the file is opened once and its pages are split, classified and
+sent SPLIT_CHUNK_PAGES at a time, held back by the pipeline queues, so a file of thousands of pages is never loaded in memory at once.
+With --split-workers N, the splitting, preprocessing and fingerprinting of the pages run in N worker processes, each chunk sharded
+in page ranges, instead of the threads of the event loop, where PyMuPDF holds the GIL (see page_workers.py).
+
+Result Processing and Storage: Results from processing are merged and stored in JSON format, or in the
+compact output formats of output_writers.py (json-compact, msgpack, parquet, arrow) selected with --output-format.
+Every page of a file is an independent item of the pipeline, the pages of a file are processed in parallel. Once the last page
+of a file is written (or has failed), its page outputs are reassembled in page order into one document per file, with the status
+of each page and the processors that failed on it (see document_assembly.py, --no-assemble turns it off).
+With --stream-results, each processor result is also appended to a rotating NDJSON stream as soon as it is analyzed (see result_stream.py).
+The progress of each file, page and processor is recorded in a SQLite job-state store (see job_state.py): an interrupted run
+is resumed where it stopped, and --force / --only-failed select the files to process again.
+
+Processor lifecycle (see processor_lifecycle.py): each processor is enabled the first time a page is sent to it (the processors
+the routing never needs stay off), after checking its state, with an optional warm-up request (--warm-up). The calls in flight
+are counted, so a processor is only released once no page uses it: at the end of the run, or after --idle-timeout in watch mode.
+Each process also holds a lease on the processors it keeps enabled, in the job-state database: a processor is only disabled
+once no other job holds a live lease on it.
+
+Page preprocessing (--preprocess, see page_preprocessing.py): the pages are re-rendered at a target DPI in grayscale or bilevel,
+optionally cropped, and re-encoded with the smallest encoding before being sent to Document AI.
+
+Page deduplication (--dedup, see page_dedup.py): every page is fingerprinted (byte hash and perceptual hash) against a persistent
+index. A near-duplicate of an indexed page (rescans, concatenated copies) reuses its processor outputs, and its output is linked
+to that page ("duplicate_of"). --dedup-threshold sets the largest perceptual hash distance of near-duplicates.
+
+Tracing (see tracing.py): every step (split, classification, Document AI request, post-processing, output) is a timing span with
+its file, page and processor. At the end of the run (and every METRICS_INTERVAL seconds in watch mode) the latency histograms and the
+request, error and upload counters are written as a Prometheus text file, and the spans as a Chrome trace file, to --trace-dir.
+--no-trace turns it off.
+
+Watch mode (--watch): the script runs as a daemon and processes the files as they land in INPUT_PATH (see folder_watcher.py),
+with the clients kept open and the processors kept enabled until --idle-timeout seconds without work.
 
 Execution: The script is executed when run as the main program, utilizing Python's asyncio module.
 '''
@@ -54,6 +116,18 @@ KEY_FILE_PATH = os.path.join(script_dir, 'keys', 'credentials.json')
 PROJECT_ID = 'your-project-name' 
 # The API you want to enable
 SERVICE_NAME = 'documentai.googleapis.com'
+# Workers of each pipeline stage (upload: pages sent to the processors at the same time)
+PIPELINE_CONCURRENCY = {"split": 2, "upload": 16, "parse": 2, "write": 2}
+# Maximum number of items waiting between two pipeline stages
+PIPELINE_QUEUE_SIZE = 32
+# Processors that only receive the attendance pages, according to the local page classifier
+ATTENDANCE_ONLY_PROCESSORS = ['ml_tabular_ext', 'ml_key_value_pair_ext']
+# Page types sent to ATTENDANCE_ONLY_PROCESSORS ('unknown' pages are sent too, so no attendance page is lost), default of --page-types
+ATTENDANCE_PAGE_TYPES = ['presentismo', 'unknown']
+# --page-types value sending every page to ATTENDANCE_ONLY_PROCESSORS
+ALL_PAGE_TYPES = 'all'
+# Watch mode: idle time in seconds before a processor is disabled
+WATCH_IDLE_TIMEOUT = float(os.environ.get("DOCAI_WATCH_IDLE_TIMEOUT", 600))
 # Setting the GOOGLE_APPLICATION_CREDENTIALS environment variable
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = KEY_FILE_PATH
 
@@ -95,10 +169,8 @@ def disable_api(service_name, project_id, key_file_path):
 
 # Processor ON
 def enable_processor(project_id: str, location: str, processor_id: str) -> None:
-    # You must set the api_endpoint if you use a location other than 'us'.
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    # Shared client of the {location}-documentai.googleapis.com endpoint, also used by the processors
+    client = get_client(location)
 
     # The full resource name of the location
     processor_name = client.processor_path(project_id, location, processor_id)
@@ -118,10 +190,8 @@ def enable_processor(project_id: str, location: str, processor_id: str) -> None:
       
 # Processor OFF
 def disable_processor(project_id: str, location: str, processor_id: str) -> None:
-    # You must set the api_endpoint if you use a location other than 'us'.
-    opts = ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
-
-    client = documentai.DocumentProcessorServiceClient(client_options=opts)
+    # Shared client of the {location}-documentai.googleapis.com endpoint, also used by the processors
+    client = get_client(location)
 
     # The full resource name of the processor
     # e.g.: projects/project_id/locations/location/processors/processor_id
@@ -159,140 +229,778 @@ def files_checker(INPUT_PATH):
     return file_paths
 
 # File Page Sppliter
-def page_splitter(file_paths):#SE MODIFICA COMPORTAMIENTO, SE AGREGA MODELO DE ML PARA DIVIDIR EL ARCHIVO ORIGINAL
+def split_pages(file_name, pdf_bytes):
+    """
+    Splits a PDF document held in memory into single-page PDF documents, also in memory.
+    A single-page document is returned as it is.
+
+    Args:
+        file_name (str): The name of the PDF file.
+        pdf_bytes (bytes): The content of the PDF file.
+
+    Returns:
+        list: A (page_name, page_bytes) tuple for each page, in page order.
+    """
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as pdf:
+        if len(pdf) <= 1:
+            return [(file_name, pdf_bytes)]
+
+        # Same names and bytes as the pages of page_stream.PageStream
+        return [(page_name(file_name, page_number), extract_page(pdf, page_number)) for page_number in range(len(pdf))]
+
+def page_splitter(file_paths, show_progress=True):#SE MODIFICA COMPORTAMIENTO, SE AGREGA MODELO DE ML PARA DIVIDIR EL ARCHIVO ORIGINAL
     """
-    Processes each file splitting it into separate pages. 
+    Processes each file splitting it into separate pages, in memory. Each input file is read once
+    and no page file is written, the input directory is left untouched. Every page of the files is
+    held in memory, the split stage of the pipeline streams the pages instead (see page_stream.py).
     The first page of each file is stored for category prediction,
     and the remaining pages are stored for further processing if necessary.
+    Pages are (page_name, page_bytes) tuples.
     """
-    first_pages = []  # List to store the paths of the first PDF page of each document
-    other_pages = []  # List to store the paths of all other PDF pages
+    first_pages = []  # List to store the first PDF page of each document
+    other_pages = []  # List to store all other PDF pages
 
     # Process each document in the list
-    for file_path in tqdm(file_paths, desc="Splitting documents"):
-        # Open the PDF file
-        with fitz.open(file_path) as pdf:
-            for page_number in range(len(pdf)):
-                # Load the current page
-                page = pdf.load_page(page_number)
-                single_page_pdf = fitz.open()
-                single_page_pdf.insert_pdf(pdf, from_page=page_number, to_page=page_number)
-                
-                # Define a path for the new single-page PDF
-                output_file = f"{file_path[:-4]}-p{page_number + 1}.pdf"
-                single_page_pdf.save(output_file)
-                
-                # Decide where to store the path based on the page number
-                if page_number == 0:
-                    first_pages.append(output_file)  # Store the first page separately
-                else:
-                    other_pages.append(output_file)  # Store other pages
-                
-                # Close the single-page PDF to free resources
-                single_page_pdf.close()
+    for file_path in tqdm(file_paths, desc="Splitting documents", disable=not show_progress):
+        with open(file_path, 'rb') as f:
+            pdf_bytes = f.read()
+
+        pages = split_pages(os.path.basename(file_path), pdf_bytes)
+        first_pages.append(pages[0])  # Store the first page separately
+        other_pages.extend(pages[1:])  # Store other pages
 
     return first_pages, other_pages
 
 # The provided script is designed to asynchronously execute an external script
+# Only used for processor scripts that are not registered in the processor runtime
 async def run_external_processor(pdf_page, processor_script):
-    process = await asyncio.create_subprocess_exec(
-        'python', processor_script, pdf_page,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE)
-
-    stdout, stderr = await process.communicate()
+    page_name, page_bytes = pdf_page
+
+    # External scripts expect a file path: the page is written to a temporary directory, not to input_data
+    with tempfile.TemporaryDirectory() as temp_dir:
+        page_path = os.path.join(temp_dir, page_name)
+        with open(page_path, 'wb') as f:
+            f.write(page_bytes)
+
+        with tracing.span("subprocess_start", processor=get_processor_name(processor_script)):
+            process = await asyncio.create_subprocess_exec(
+                'python', processor_script, page_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+
+        with tracing.span("external_processor", processor=get_processor_name(processor_script)):
+            stdout, stderr = await process.communicate()
     
     stdout_str = stdout.decode('utf-8', 'ignore')
     stderr_str = stderr.decode('utf-8', 'ignore')
 
     if process.returncode != 0:
-        logging.error(f"Error executing processor {processor_script} for {pdf_page}: {stderr_str}")
+        logging.error(f"Error executing processor {processor_script} for {page_name}: {stderr_str}")
         return None  # Indicate an error occurred by returning None
 
-    return stdout  
+    try:
+        return json.loads(stdout_str)
+    except json.JSONDecodeError as e:
+        logging.error(f"Error decoding JSON from processor {processor_script} output: {e}")
+        return None
+
+# Sends a page to a registered processor in the current process, using the executor threads
+# Returns the processed document (post-processed later by run_analyze) or the processor output
+async def run_in_process_processor(pdf_page, processor_name):
+    page_name, page_bytes = pdf_page
+    with tracing.span("fetch", processor=processor_name, page_bytes=len(page_bytes)):
+        return await run_sync_in_executor(run_fetch, processor_name, page_bytes, page_name)
+
+# Sends a page to a registered processor or to an external processor script
+# The lifecycle enables the processor on first use and keeps it enabled during the call
+async def run_page_processor(pdf_page, processor, lifecycle=None):
+    if lifecycle is None:
+        if processor in PROCESSOR_REGISTRY:
+            return await run_in_process_processor(pdf_page, processor)
+        return await run_external_processor(pdf_page, processor)
+    async with lifecycle.use(get_processor_name(processor)):
+        return await run_page_processor(pdf_page, processor)
+
+# The name of a registered processor, or of an external processor script
+def get_processor_name(processor):
+    return os.path.splitext(os.path.basename(processor))[0]
+
+# Generalized function to send a page to multiple processors, routed by the category of its document
+# Returns the processors that ran and their responses, in the order of processors
+async def process_page(pdf_page, processors, document_route, router, lifecycle=None):
+    """
+    Args:
+        pdf_page (tuple): The (page_name, page_bytes) of the page.
+        processors (list): The processors selected for the page by the page classifier.
+        document_route (asyncio.Future): The route of the document of the page, set by its first page.
+        router (ProcessorRouter): The routing table (see processor_routing.py).
+        lifecycle (ProcessorLifecycle, optional): Enables the processors on first use.
+    """
+    tasks = {}
+    classifier = None
+    for processor in processors:
+        processor_name = get_processor_name(processor)
+        if processor_name == router.classifier:
+            classifier = processor
+        elif not document_route.done() and router.is_likely(processor_name):
+            # Start the likely extractors while the category is not known yet
+            if not router.always_allowed(processor_name):
+                router.count("speculative_calls")
+        else:
+            continue
+        tasks[processor] = asyncio.ensure_future(run_page_processor(pdf_page, processor, lifecycle))
 
-# Generalized function to send the first page to multiple processors
-async def process_first_page(first_page, processors): #QUIZA DEBA SER MODIFICADO PARA TRABAJAR CON MUCHAS PAGINAS DE UN MISMO ARCHIVO
-    tasks = []
-    for processor_script in processors:
-        task = run_external_processor(first_page, processor_script)
-        tasks.append(task)
-    
-    results = await asyncio.gather(*tasks)
-    return results
+    try:
+        prediction = None
+        if classifier is not None:
+            try:
+                response = await tasks.pop(classifier)
+                prediction = await run_sync_in_executor(run_analyze, classifier, response, pdf_page[0])
+            finally:
+                # Always set the route, the other pages of the document are waiting for it
+                if not document_route.done():
+                    document_route.set_result(router.route(prediction))
+        route = await document_route
+
+        selected = []
+        for processor in processors:
+            if processor != classifier and not router.allows(route, get_processor_name(processor)):
+                if processor in tasks:
+                    tasks.pop(processor).cancel()
+                    router.count("cancelled_calls")
+                else:
+                    router.count("skipped_calls")
+                continue
+            # The classifier task was already awaited above
+            if processor != classifier and processor not in tasks:
+                tasks[processor] = asyncio.ensure_future(run_page_processor(pdf_page, processor, lifecycle))
+            selected.append(processor)
+
+        extractors = [processor for processor in selected if processor != classifier]
+        results = dict(zip(extractors, await asyncio.gather(*(tasks[processor] for processor in extractors))))
+        # The classifier output is already analyzed, run_analyze passes it on as it is in the parse stage
+        results[classifier] = prediction
+        return selected, [results[processor] for processor in selected]
+    finally:
+        # When the classifier or an extractor fails, the requests still running are cancelled, not left spending quota
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Marks the exceptions of the other failed requests as retrieved
+                task.exception()
+
+# Selects the processors a page is sent to, from its position in the document and its page type
+def select_processors(processors, is_first_page, page_type, page_types=ATTENDANCE_PAGE_TYPES):
+    """
+    Args:
+        processors (list): The registered processor names and external processor scripts.
+        is_first_page (bool): Whether the page is the first page of its document.
+        page_type (dict): The page classification, None when there is no page classifier.
+        page_types (list): The page types sent to ATTENDANCE_ONLY_PROCESSORS, ALL_PAGE_TYPES for every page.
+
+    Returns:
+        list: The processors the page must be sent to, in the order of processors.
+    """
+    if page_type is None:
+        # Without a page classifier, only the first page is processed, by every processor
+        return list(processors) if is_first_page else []
+
+    is_attendance = ALL_PAGE_TYPES in page_types or page_type["page_type"] in page_types
+    selected = []
+    for processor in processors:
+        if get_processor_name(processor) in ATTENDANCE_ONLY_PROCESSORS:
+            if is_attendance:
+                selected.append(processor)
+        elif is_first_page:
+            selected.append(processor)
+    return selected
+
+# Removes the work done by a previous run from the page items of a document (see job_state.py)
+def resume_page_items(page_items, completed, complete_pages):
+    """
+    Args:
+        page_items (list): The page items of the document, built by the split stage.
+        completed (dict): The stored outputs of the processors that succeeded, by page and processor name.
+        complete_pages (set): The pages already written without failure.
+
+    Returns:
+        list: The page items left, with only the processors that have no stored output.
+    """
+    resumed = []
+    for page_item in page_items:
+        page_name = page_item["page"][0]
+        if page_name in complete_pages:
+            continue
+        stored_results = completed.get(page_name, {})
+        remaining = [processor for processor in page_item["processors"] if get_processor_name(processor) not in stored_results]
+        resumed.append({**page_item, "processors": remaining, "stored_results": stored_results})
+    return resumed
+
+# Shrinks the page sent to Document AI (see page_preprocessing.py), its page info is added to the output
+def preprocess_page_item(page_item):
+    page_name, page_bytes = page_item["page"]
+    page_bytes, page_info = preprocess_page(page_bytes)
+    return {**page_item, "page": (page_name, page_bytes), "page_info": page_info}
+
+# Adds the fingerprint of the page to a page item, before preprocessing (see page_dedup.py)
+def fingerprint_page_item(page_item):
+    return {**page_item, "fingerprint": page_fingerprint(page_item["page"][1])}
+
+# Pipeline stages (see pipeline.py): discover -> split -> upload -> parse -> write
+def build_pipeline_stages(processors, router, writer, concurrency, progress, stream=None, job_store=None, lifecycle=None, preprocess=False,
+                          page_index=None, extracted_page_types=ATTENDANCE_PAGE_TYPES, assembler=None, page_workers=None):
+    """
+    Builds the stages that take each PDF file from its path to its JSON output.
+
+    Args:
+        processors (list): The registered processor names and external processor scripts.
+        router (ProcessorRouter): The routing table of the extractors.
+        writer: The output writer of the merged results (see output_writers.py).
+        concurrency (dict): The number of workers of each stage.
+        progress (tqdm): Progress bar updated for each output written.
+        stream (ResultStream, optional): The stream each processor result is appended to once analyzed.
+        job_store (JobStateStore, optional): The job state used to skip the work done by previous runs.
+        lifecycle (ProcessorLifecycle, optional): Enables the processors on first use.
+        preprocess (bool): Re-render the pages with page_preprocessing.py before sending them.
+        page_index (PageIndex, optional): The index of the distinct pages, used to reuse the outputs of near-duplicate pages.
+        extracted_page_types (list): The page types sent to ATTENDANCE_ONLY_PROCESSORS (see select_processors).
+        assembler (DocumentAssembler, optional): Reassembles the page outputs of each file into one document.
+        page_workers (PageWorkerPool, optional): The worker processes splitting, preprocessing and fingerprinting the pages.
+
+    Returns:
+        list: The stages for pipeline.run_pipeline().
+
+    The items between the split and upload stages are page items: dictionaries with the page
+    (page_name, page_bytes), its processors, its classification, the route of its document, the
+    outputs stored by a previous run, the job key, the preprocessing page info, the name of its file, the page
+    fingerprint, the page ID in the dedup index of the pages whose outputs it records, and the indexed page it duplicates.
+    """
+    processor_names = [get_processor_name(processor) for processor in processors]
+    # Other page types are other work: the files done with the default page types are processed again
+    job_processors = processor_names
+    if sorted(extracted_page_types) != sorted(ATTENDANCE_PAGE_TYPES):
+        job_processors = processor_names + [f"page_types={'+'.join(sorted(extracted_page_types))}"]
+    # So are the files done in another output format or with other preprocessing options: their outputs are not written
+    job_settings = {"output_format": getattr(writer, "output_format", None), "preprocess": default_options() if preprocess else None}
+    # Indexed pages being processed by this run, their duplicates wait for their outputs
+    pending_pages = {}
+
+    async def split_stage(pdf_file):
+        file_name = os.path.basename(pdf_file)
+        tracing.annotate(file=file_name)
+        # Files already done by a previous run are skipped before being split
+        job_key = None
+        if job_store is not None:
+            file_hash = await run_sync_in_executor(hash_file, pdf_file)
+            job_key = job_store.job_key(file_hash, job_processors, job_settings)
+            if not await run_sync_in_executor(job_store.should_process, job_key):
+                logging.info(f"{os.path.basename(pdf_file)}: already processed, skipped.")
+                progress.total -= 1
+                progress.refresh()
+                return
+
+        # The file is opened once, its pages are read SPLIT_CHUNK_PAGES at a time (see page_stream.py)
+        stream = await run_sync_in_executor(PageStream, pdf_file)
+        read_pages = stream.read if page_workers is None else partial(page_workers.read, stream)
+        next_chunk = asyncio.ensure_future(run_sync_in_executor(read_pages, SPLIT_CHUNK_PAGES))
+        try:
+            completed = {}
+            complete_pages = set()
+            if job_key is not None:
+                completed = await run_sync_in_executor(job_store.completed_tasks, job_key)
+                complete_pages = await run_sync_in_executor(job_store.complete_pages, job_key)
+                # The page count is set once the pages sent are known, at the end of the file
+                await run_sync_in_executor(job_store.start_file, job_key, file_name, file_hash, job_processors, stream.page_count)
+            if assembler is not None:
+                await run_sync_in_executor(assembler.start_file, file_name)
+
+            # Route of the extractors of the document, set once its first page is categorized
+            document_route = asyncio.get_running_loop().create_future()
+            first_page_number = 0
+            sent_pages = 0
+            while True:
+                with tracing.span("page_splitter"):
+                    pages = await next_chunk
+                if not pages:
+                    break
+                # The next chunk is split while the pages of this one go through the pipeline
+                next_chunk = asyncio.ensure_future(run_sync_in_executor(read_pages, SPLIT_CHUNK_PAGES))
+                page_items, chunk_sent_pages = await split_chunk(file_name, pages, first_page_number, job_key, document_route,
+                                                                 completed, complete_pages)
+                sent_pages += chunk_sent_pages
+
+                # The progress bar counts the page outputs, one per file was expected
+                progress.total += len(page_items) - (first_page_number == 0)
+                progress.refresh()
+                first_page_number += len(pages)
+                for page_item in page_items:
+                    yield page_item
+        finally:
+            # The stream is closed once its last read is over
+            await asyncio.gather(next_chunk, return_exceptions=True)
+            stream.close()
+
+        if job_key is not None:
+            if await run_sync_in_executor(job_store.set_page_count, job_key, sent_pages) == "done":
+                logging.info(f"{file_name}: every page was already written by a previous run.")
+        if assembler is not None:
+            document_path = await run_sync_in_executor(assembler.end_file, file_name)
+            if document_path is not None:
+                logging.info(f"Document of {file_name} saved to {document_path}")
+        if stream.page_count > 1:
+            logging.info(f"{file_name}: {sent_pages} of {stream.page_count} pages sent to the processors.")
+
+    async def split_chunk(file_name, pages, first_page_number, job_key, document_route, completed, complete_pages):
+        # The pages of a chunk are classified locally in one batch, before any Document AI request
+        with tracing.span("classify_pages", pages=len(pages)):
+            classifier_name, page_types = await run_sync_in_executor(classify_pages, pages)
+
+        page_items = []
+        for page_number, page in enumerate(pages):
+            page_type = page_types[page_number] if page_types else None
+            page_processors = select_processors(processors, first_page_number + page_number == 0, page_type, extracted_page_types)
+            if not page_processors:
+                continue
+            classification = None
+            if page_type is not None:
+                classification = {"processor": classifier_name, "file_name": page[0], **page_type}
+            page_items.append({"page": page, "processors": page_processors, "classification": classification,
+                               "route": document_route, "stored_results": {}, "job_key": job_key, "page_info": None, "file": file_name,
+                               "fingerprint": None, "page_id": None, "duplicate_of": None})
+        sent_pages = len(page_items)
+
+        if job_key is not None:
+            page_items = resume_page_items(page_items, completed, complete_pages)
+            job_store.stats["reused_results"] += sum(len(page_item["stored_results"]) for page_item in page_items)
+
+        if first_page_number == 0:
+            # The first page prediction stored by a previous run routes the document
+            first_page_prediction = completed.get(pages[0][0], {}).get(router.classifier)
+            # Without a category prediction on the first page, the document takes the default route
+            categorized = page_items and page_items[0]["page"] is pages[0] and router.classifier in map(get_processor_name, page_items[0]["processors"])
+            if not categorized:
+                document_route.set_result(router.route(first_page_prediction))
+
+        if assembler is not None:
+            # Every page of the file has its place in the document, the pages not sent are skipped
+            pending = {page_item["page"][0] for page_item in page_items}
+            assembly_pages = [{"page_name": page_name, "page_type": page_types[page_number]["page_type"] if page_types else None,
+                               "status": "pending" if page_name in pending else "resumed" if page_name in complete_pages else "skipped"}
+                              for page_number, (page_name, _) in enumerate(pages)]
+            await run_sync_in_executor(assembler.add_pages, file_name, assembly_pages)
+
+        if page_workers is not None and (page_index is not None or preprocess):
+            # The workers fingerprint the original pages, then preprocess them
+            with tracing.span("prepare_pages", pages=len(page_items)):
+                prepared = await run_sync_in_executor(page_workers.prepare, [page_item["page"][1] for page_item in page_items],
+                                                      preprocess, page_index is not None)
+            return [{**page_item, "page": (page_item["page"][0], page_bytes), "page_info": page_info, "fingerprint": fingerprint}
+                    for page_item, (page_bytes, page_info, fingerprint) in zip(page_items, prepared)], sent_pages
+
+        if page_index is not None:
+            # The original pages are fingerprinted, the preprocessing output depends on its options
+            with tracing.span("fingerprint", pages=len(page_items)):
+                page_items = await asyncio.gather(*(run_sync_in_executor(fingerprint_page_item, page_item) for page_item in page_items))
+
+        if preprocess:
+            # The local classification above used the original pages
+            with tracing.span("preprocess", pages=len(page_items)):
+                page_items = await asyncio.gather(*(run_sync_in_executor(preprocess_page_item, page_item) for page_item in page_items))
+        return list(page_items), sent_pages
+
+    async def reuse_duplicate_outputs(page_item):
+        # A near-duplicate of an indexed page only keeps the processors without stored output
+        page_name = page_item["page"][0]
+        match = await run_sync_in_executor(page_index.match_or_add, page_item["fingerprint"], page_name)
+        if match["duplicate_of"] is None:
+            pending_pages[match["page_id"]] = asyncio.get_running_loop().create_future()
+            return {**page_item, "page_id": match["page_id"]}
+
+        page_processors = {get_processor_name(processor) for processor in page_item["processors"]}
+        sets_route = router.classifier in page_processors and not page_item["route"].done()
+        pending = pending_pages.get(match["page_id"])
+        if pending is not None:
+            if sets_route:
+                # The pages of the document wait for this page, it never waits for another page
+                return {**page_item, "duplicate_of": {**match["duplicate_of"], "reused_outputs": []}}
+            await pending
+
+        reused = await run_sync_in_executor(page_index.reuse_results, match["page_id"], page_processors - set(page_item["stored_results"]))
+        if sets_route and router.classifier in reused:
+            page_item["route"].set_result(router.route(reused[router.classifier]))
+        remaining = [processor for processor in page_item["processors"] if get_processor_name(processor) not in reused]
+        duplicate_of = {**match["duplicate_of"], "reused_outputs": sorted(reused)}
+        return {**page_item, "processors": remaining, "stored_results": {**page_item["stored_results"], **reused}, "duplicate_of": duplicate_of}
+
+    async def fail_page(file_name, page_name, error):
+        # The document of the file records the failed page
+        if assembler is not None:
+            document_path = await run_sync_in_executor(assembler.page_failed, file_name, page_name, error)
+            if document_path is not None:
+                logging.info(f"Document of {file_name} saved to {document_path}")
+
+    def release_pending_page(page_item):
+        # The duplicates of the page can read its stored outputs
+        pending = pending_pages.pop(page_item["page_id"], None)
+        if pending is not None and not pending.done():
+            pending.set_result(None)
+
+    async def upload_stage(page_item):
+        tracing.annotate(file=page_item["file"], page=page_item["page"][0])
+        page = page_item["page"]
+        try:
+            if page_index is not None:
+                page_item = await reuse_duplicate_outputs(page_item)
+            page_processors, responses = await process_page(page, page_item["processors"], page_item["route"], router, lifecycle)
+        except Exception as e:
+            sets_route = router.classifier in {get_processor_name(processor) for processor in page_item["processors"]}
+            if sets_route and not page_item["route"].done():
+                # The other pages of the document wait for the route this page sets, it failed before process_page set it
+                page_item["route"].set_result(router.route(None))
+            if page_item["job_key"] is not None:
+                await run_sync_in_executor(job_store.record_file_failure, page_item["job_key"], f"{page[0]}: {e}")
+            release_pending_page(page_item)
+            await fail_page(page_item["file"], page[0], e)
+            raise
+        return [(page_item, page_processors, responses)]
+
+    async def parse_stage(page_responses):
+        tracing.annotate(file=page_responses[0]["file"], page=page_responses[0]["page"][0])
+        try:
+            return await parse_page(*page_responses)
+        except Exception as e:
+            await fail_page(page_responses[0]["file"], page_responses[0]["page"][0], e)
+            raise
+        finally:
+            release_pending_page(page_responses[0])
+
+    async def parse_page(page_item, page_processors, responses):
+        page_name = page_item["page"][0]
+        classification = page_item["classification"]
+        job_key = page_item["job_key"]
+        merged_results = {"processor_outputs": {}}
+        if page_item["page_info"] is not None:
+            merged_results["page_info"] = page_item["page_info"]
+        if page_item["duplicate_of"] is not None:
+            merged_results["duplicate_of"] = page_item["duplicate_of"]
+        if classification is not None:
+            merged_results["processor_outputs"][classification["processor"]] = classification
+            if stream is not None:
+                await run_sync_in_executor(stream.write, page_name, classification["processor"], classification, page_item["file"])
+        # Outputs of the processors that already succeeded on the page in a previous run
+        merged_results["processor_outputs"].update(page_item["stored_results"])
+        failed_processors = []
+        for processor, response in zip(page_processors, responses):
+            processor_name = get_processor_name(processor)
+            if processor in PROCESSOR_REGISTRY:
+                with tracing.span("analyze", processor=processor_name):
+                    result = await run_sync_in_executor(run_analyze, processor, response, page_name)
+            else:
+                result = response
+            if job_key is not None:
+                await run_sync_in_executor(job_store.record_task, job_key, page_name, processor_name, result)
+            if page_item["page_id"] is not None:
+                await run_sync_in_executor(page_index.record_result, page_item["page_id"], processor_name, result)
+            if result is not None:
+                merged_results["processor_outputs"][processor_name] = result
+                if stream is not None:
+                    await run_sync_in_executor(stream.write, page_name, processor_name, result, page_item["file"])
+            else:
+                failed_processors.append(processor_name)
+        if failed_processors:
+            merged_results["failed_processors"] = failed_processors
+        return [(page_name, merged_results, job_key, page_item["file"])]
+
+    async def write_stage(page_results):
+        page_name, merged_results, job_key, file_name = page_results
+        tracing.annotate(file=file_name, page=page_name)
+        try:
+            with tracing.span("write_output", output_format=writer.__class__.__name__):
+                output_filepath = await run_sync_in_executor(writer.write, page_name, merged_results)
+        except Exception as e:
+            await fail_page(file_name, page_name, e)
+            raise
+        if job_key is not None:
+            await run_sync_in_executor(job_store.record_page_written, job_key, page_name)
+        progress.update(1)
+        logging.info(f"Combined processing result for {page_name} saved to {output_filepath}")
+        if assembler is not None:
+            with tracing.span("assemble_document"):
+                document_path = await run_sync_in_executor(assembler.page_written, file_name, page_name, merged_results)
+            if document_path is not None:
+                logging.info(f"Document of {file_name} saved to {document_path}")
+
+    return [
+        {"name": "split", "func": split_stage, "concurrency": concurrency["split"]},
+        {"name": "upload", "func": upload_stage, "concurrency": concurrency["upload"]},
+        {"name": "parse", "func": parse_stage, "concurrency": concurrency["parse"]},
+        {"name": "write", "func": write_stage, "concurrency": concurrency["write"]},
+    ]
 
 # Function to load processor configuration from a JSON file
 def load_processor_config(json_path):
     with open(json_path, 'r') as file:
         return json.load(file)
 
+# The context is copied into the executor thread, so the spans opened there keep the attributes of the caller (see tracing.py)
 async def run_sync_in_executor(func, *args):
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, partial(func, *args))
+    return await loop.run_in_executor(None, partial(contextvars.copy_context().run, func, *args))
+
+async def main(replay=False, concurrency=None, output_format=DEFAULT_OUTPUT_FORMAT, stream_results=False, force=False, only_failed=False,
+               watch=False, idle_timeout=WATCH_IDLE_TIMEOUT, warm_up=WARM_UP, preprocess=PREPROCESS, dedup=DEDUP, dedup_threshold=DEDUP_THRESHOLD,
+               trace=None, trace_dir=None, page_types=None, assemble=ASSEMBLE, split_workers=SPLIT_WORKERS):
+    """
+    Processes every PDF file of INPUT_PATH with the processors.
+
+    Args:
+        replay (bool): Re-run only the local extraction functions of the processors over the
+            Document AI responses stored in the response cache, without calling Google Cloud.
+        concurrency (dict, optional): Number of workers per pipeline stage, overriding PIPELINE_CONCURRENCY.
+        output_format (str): The format of the merged results, one of output_writers.OUTPUT_FORMATS.
+        stream_results (bool): Also append each processor result to the NDJSON stream of OUTPUT_DIR.
+        force (bool): Process every file from scratch, even the files done by a previous run.
+        only_failed (bool): Only process the files whose previous run failed or was interrupted.
+        watch (bool): Run as a daemon: process the files of INPUT_PATH, then the files as they land,
+            until SIGINT / SIGTERM. The processors are disabled after idle_timeout seconds without work.
+        idle_timeout (float): The idle time in seconds before a processor is disabled, in watch mode.
+        warm_up (bool): Send a warm-up request to each processor right after enabling it.
+        preprocess (bool): Re-render the pages with page_preprocessing.py to shrink the uploads.
+        dedup (bool): Reuse the processor outputs of the near-duplicates of the pages already processed (page_dedup.py).
+        dedup_threshold (int): The largest perceptual hash distance between near-duplicate pages.
+        trace (bool, optional): Measure the pipeline steps and export the metrics and the trace (tracing.py), TRACE_ENABLED by default.
+        trace_dir (str, optional): The directory of the metric and trace files, TRACE_DIR by default.
+        page_types (list, optional): The page types sent to ATTENDANCE_ONLY_PROCESSORS, ATTENDANCE_PAGE_TYPES by default
+            (ALL_PAGE_TYPES sends every page).
+        assemble (bool): Reassemble the page outputs of each file into one document, in page order (document_assembly.py).
+        split_workers (int): The worker processes splitting, preprocessing and fingerprinting the pages (page_workers.py),
+            0 to do it in the threads of the event loop.
+    """
+    concurrency = {**PIPELINE_CONCURRENCY, **(concurrency or {})}
+    tracing.configure(enabled=trace, trace_dir=trace_dir)
 
-async def main():
     # Get the absolute path to the directory where the main script is located
     current_dir = os.path.dirname(os.path.abspath(__file__))
     # Construct the path to the configuration file located in the 'keys' folder
     # The 'keys' folder is at the same level as the main script
     keys_dir = os.path.join(current_dir, 'keys')
     
-    # Dynamically load processor configurations from the 'keys' directory
-    processor_configs = [os.path.join(keys_dir, json_keys_file) for json_keys_file in os.listdir(keys_dir) if json_keys_file.endswith('_config.json')]
-    
-    await run_sync_in_executor(enable_api, SERVICE_NAME, PROJECT_ID, KEY_FILE_PATH)
-    logging.info("Document AI API has been enabled.")
+    # A local endpoint (DOCAI_API_ENDPOINT, e.g. benchmarks/fake_docai_server.py) does not need the Google Cloud API
+    local_endpoint = docai_clients.API_ENDPOINT_OVERRIDE is not None
+    if replay:
+        # Responses come from the cache only, Google Cloud is never called
+        response_cache.configure(replay=True)
+        logging.info("Replay mode: processing pages from the cached Document AI responses.")
+    elif local_endpoint:
+        logging.info(f"Sending the requests to the local endpoint {docai_clients.API_ENDPOINT_OVERRIDE}.")
+    else:
+        await run_sync_in_executor(enable_api, SERVICE_NAME, PROJECT_ID, KEY_FILE_PATH)
+        logging.info("Document AI API has been enabled.")
     
-    # Dynamically enable each processor
-    for config_path in processor_configs:
-        processor_config = load_processor_config(config_path)
-        await run_sync_in_executor(enable_processor, processor_config['PROJECT_ID'], processor_config['LOCATION'], processor_config['PROCESSOR_ID'])
-        logging.info(f"Processor {processor_config['PROCESSOR_ID']} has been enabled.")
-
     # Dynamically load processor scripts from the 'processors' directory
+    # Registered processors are imported once and run in-process, the rest as external scripts
     processors_dir = os.path.join(current_dir, 'processors')
-    processors = [os.path.join(processors_dir, f) for f in os.listdir(processors_dir) if f.endswith('.py')]
+    in_process_processors, external_processors = load_processors(processors_dir)
+    processors = in_process_processors + external_processors
+    if replay and external_processors:
+        # External scripts call Document AI on their own, they cannot be replayed
+        logging.warning(f"Replay mode: skipping external processors {external_processors}.")
+        processors = in_process_processors
     
-    file_paths = files_checker(INPUT_PATH)
-    if not file_paths:
-        logging.error("No valid PDF files to process.") 
-        return
-
-    for pdf_file in tqdm(file_paths, desc="Processing files"):
-        # Open the PDF file to check the number of pages
-        with fitz.open(pdf_file) as pdf:
-            num_pages = len(pdf)
-        
-        first_pages, other_pages = ([pdf_file], []) if num_pages <= 1 else page_splitter([pdf_file]) #REVISAR SECCION PARA DETERMINAR EL MANEJO DE UN ARCHIVO DE VARIAS HOJAS Y ANALIZARLAS 
-
-        for first_page in first_pages:
-            results = await process_first_page(first_page, processors)
-            
-            merged_results = {"processor_outputs": {}}
-            for processor, result in zip(processors, results):
-                processor_name = os.path.splitext(os.path.basename(processor))[0]
-                try:
-                    result_data = json.loads(result)
-                    merged_results["processor_outputs"][processor_name] = result_data
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error decoding JSON from processor {processor_name} output: {e}")
-            
-            output_filename = os.path.splitext(os.path.basename(first_page))[0] + '_extraction_output.json'
-            output_filepath = os.path.join(OUTPUT_DIR, output_filename)
-            with open(output_filepath, 'w', encoding='utf-8') as f:
-                json.dump(merged_results, f, indent=4)
-            
-            logging.info(f"Combined processing result for {os.path.basename(first_page)} saved to {output_filepath}")
+    # Dynamically load processor configurations from the 'keys' directory, once
+    # Each processor is enabled the first time a page is sent to it
+    processor_configs = {} if replay else load_processor_configs(keys_dir, PROCESSOR_REGISTRY)
+    # Replay re-runs the local extraction of every page, the job state is not used
+    job_store = None if replay else JobStateStore(force=force, only_failed=only_failed)
+    # The processor leases of the job state keep a processor enabled while another job uses it
+    lifecycle = ProcessorLifecycle(processor_configs, enable_processor, disable_processor, warm_up=warm_up, leases=job_store)
+
+    # Extractors of each document category (keys/processor_routing.json)
+    router = load_router()
+    if not watch:
+        # The processors every document needs are enabled concurrently at once, the others on first use
+        required = [name for name in map(get_processor_name, processors) if name == router.classifier or router.always_allowed(name)]
+        await lifecycle.enable_all(required)
+
+    file_paths = []
+    if not watch:
+        file_paths = files_checker(INPUT_PATH)
+        if not file_paths:
+            logging.error("No valid PDF files to process.") 
+            await lifecycle.close()
+            return
+
+    # Each upload worker blocks one thread per processor on its Document AI request
+    worker_threads = concurrency["upload"] * len(processors) + concurrency["split"] + concurrency["parse"] + concurrency["write"]
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=worker_threads))
+
+    # Created before any request, so a format whose libraries are missing fails at once
+    writer = get_writer(output_format, OUTPUT_DIR)
+    stream = ResultStream(OUTPUT_DIR) if stream_results else None
+    # Replay re-runs the local extraction of every page and --force processes every page again, no output is reused
+    page_index = PageIndex(threshold=dedup_threshold) if dedup and not replay and not force else None
+    if dedup and force:
+        logging.info("Page deduplication is off with --force, every page is sent to the processors.")
+    assembler = DocumentAssembler(writer) if assemble else None
+    page_workers = PageWorkerPool(split_workers) if split_workers > 0 else None
+
+    # Files stream through the stages; concurrent uploads let pages share batched requests (see page_batcher.py)
+    with tqdm(total=len(file_paths), desc="Processing pages") as progress:
+        stages = build_pipeline_stages(processors, router, writer, concurrency, progress, stream, job_store, lifecycle, preprocess, page_index,
+                                       page_types or ATTENDANCE_PAGE_TYPES, assembler, page_workers)
+        if not watch:
+            await run_pipeline(file_paths, stages, queue_size=PIPELINE_QUEUE_SIZE)
+        else:
+            await run_watch_pipeline(stages, lifecycle, idle_timeout, progress, tracing.METRICS_INTERVAL)
+    if page_workers is not None:
+        await run_sync_in_executor(page_workers.close)
+    if assembler is not None:
+        # The files with pages lost by the pipeline get their document too
+        await run_sync_in_executor(assembler.close)
+    await run_sync_in_executor(writer.close)
+    if stream is not None:
+        await run_sync_in_executor(stream.close)
     
-    for config_path in processor_configs:
-        processor_config = load_processor_config(config_path)
-        await run_sync_in_executor(disable_processor, processor_config['PROJECT_ID'], processor_config['LOCATION'], processor_config['PROCESSOR_ID'])
-        logging.info(f"Processor {processor_config['PROCESSOR_ID']} has been disabled.")
+    # The processors enabled by the run are disabled concurrently
+    await lifecycle.close()
     
-    await run_sync_in_executor(disable_api, SERVICE_NAME, PROJECT_ID, KEY_FILE_PATH)
-    logging.info("Document AI API has been disabled.")
+    if not replay and not local_endpoint:
+        await run_sync_in_executor(disable_api, SERVICE_NAME, PROJECT_ID, KEY_FILE_PATH)
+        logging.info("Document AI API has been disabled.")
+
+    logging.info(f"Document AI channel usage: {get_stats()}")
+    logging.info(f"Document AI requests per processor: {rate_control.get_stats()}")
+    logging.info(f"Processor routing: {router.stats}, categories: {router.category_counts}")
+    logging.info(f"Processor lifecycle: {lifecycle.stats}")
+    if preprocess:
+        logging.info(f"Page preprocessing: {get_preprocessing_stats()}")
+    if page_workers is not None:
+        logging.info(f"Page workers: {page_workers.stats}")
+    if assembler is not None:
+        logging.info(f"Documents: {assembler.stats}")
+    if page_index is not None:
+        logging.info(f"Page deduplication: {page_index.summary()}")
+        page_index.close()
+    if job_store is not None:
+        logging.info(f"Job state: {job_store.summary()}")
+        job_store.close()
+    if tracing.TRACE_ENABLED:
+        logging.info(f"Slowest steps: {tracing.summary(top=5)}")
+        metrics_path = await run_sync_in_executor(tracing.write_metrics)
+        trace_path = await run_sync_in_executor(tracing.write_trace)
+        logging.info(f"Pipeline metrics saved to {metrics_path}, trace saved to {trace_path}")
+    close_clients()
+
+# Watch mode: the files of INPUT_PATH go through the pipeline as they land, until SIGINT / SIGTERM
+async def run_watch_pipeline(stages, lifecycle, idle_timeout, progress, metrics_interval=None):
+    """
+    Args:
+        stages (list): The pipeline stages (see build_pipeline_stages).
+        lifecycle (ProcessorLifecycle): Disables the processors unused for idle_timeout seconds.
+        idle_timeout (float): The idle time in seconds before a processor is disabled.
+        progress (tqdm): Progress bar, its total grows with each file.
+        metrics_interval (float, optional): Seconds between two exports of the pipeline metrics (tracing.py).
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            # The files in flight are finished before the daemon stops
+            loop.add_signal_handler(signal_number, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not available on Windows, Ctrl-C stops at once
+
+    async def watched_files():
+        async for file_path in watch_folder(INPUT_PATH, stop_event):
+            progress.total += 1
+            progress.refresh()
+            yield file_path
+
+    logging.info(f"Watching {INPUT_PATH} for PDF files (idle timeout {idle_timeout:.0f}s), stop with Ctrl-C.")
+    monitor = asyncio.ensure_future(lifecycle.monitor(idle_timeout))
+    exporter = asyncio.ensure_future(export_metrics(metrics_interval)) if metrics_interval and tracing.TRACE_ENABLED else None
+    try:
+        await run_pipeline(watched_files(), stages, queue_size=PIPELINE_QUEUE_SIZE)
+    finally:
+        monitor.cancel()
+        if exporter is not None:
+            exporter.cancel()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(signal_number)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+# Watch mode: the metrics file is rewritten periodically, so a scraper follows the daemon while it runs
+async def export_metrics(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_sync_in_executor(tracing.write_metrics)
+        except OSError as e:
+            logging.warning(f"Could not write the pipeline metrics: {e}")
+
+def parse_args():
+    """Command line options of the script."""
+    parser = argparse.ArgumentParser(description="Process the PDF files of input_data with the Document AI processors.")
+    parser.add_argument('--replay', action='store_true',
+                        help="Re-run only the local extraction functions from the cached Document AI responses.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not read or write the Document AI response cache.")
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT,
+                        help="Format of the merged results (default: %(default)s).")
+    parser.add_argument('--stream-results', action='store_true',
+                        help="Also append each processor result to the rotating NDJSON stream of the output directory.")
+    parser.add_argument('--force', action='store_true',
+                        help="Process every file from scratch, even the files done by a previous run.")
+    parser.add_argument('--only-failed', action='store_true',
+                        help="Only process the files whose previous run failed or was interrupted.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Run as a daemon: keep the processors warm and process the PDF files as they land in input_data.")
+    parser.add_argument('--idle-timeout', type=float, default=WATCH_IDLE_TIMEOUT, metavar='SECONDS',
+                        help="In watch mode, disable a processor after this idle time (default: %(default)s).")
+    parser.add_argument('--warm-up', action='store_true', default=WARM_UP,
+                        help="Send a warm-up request to each processor right after enabling it.")
+    parser.add_argument('--preprocess', action='store_true', default=PREPROCESS,
+                        help="Re-render the pages (DPI, grayscale/bilevel, recompression, crop) to shrink the uploads.")
+    parser.add_argument('--split-workers', type=int, default=SPLIT_WORKERS, metavar='N',
+                        help="Split, preprocess and fingerprint the pages in N worker processes, 0 for threads (default: %(default)s).")
+    parser.add_argument('--dedup', action='store_true', default=DEDUP,
+                        help="Reuse the processor outputs of the near-duplicates of the pages already processed (rescans, copies).")
+    parser.add_argument('--dedup-threshold', type=int, default=DEDUP_THRESHOLD, metavar='BITS',
+                        help="Largest perceptual hash distance between near-duplicate pages (default: %(default)s).")
+    parser.add_argument('--page-types', nargs='+', default=ATTENDANCE_PAGE_TYPES, metavar='TYPE',
+                        help=f"Page types sent to the page-level extractors {ATTENDANCE_ONLY_PROCESSORS}, e.g. presentismo evol_diaria unknown, "
+                             f"or '{ALL_PAGE_TYPES}' for every page (default: %(default)s).")
+    parser.add_argument('--no-assemble', action='store_true', default=not ASSEMBLE,
+                        help="Do not reassemble the page outputs of each file into one document.")
+    parser.add_argument('--no-trace', action='store_true', default=not tracing.TRACE_ENABLED,
+                        help="Do not measure the pipeline steps nor write the metric and trace files.")
+    parser.add_argument('--trace-dir', default=tracing.TRACE_DIR, metavar='DIR',
+                        help="Directory of the Prometheus metrics and Chrome trace files (default: %(default)s).")
+    parser.add_argument('--concurrency', action='append', default=[], metavar='STAGE=N',
+                        help="Number of workers of a pipeline stage (split, upload, parse, write). Can be repeated.")
+    return parser.parse_args()
+
+def parse_concurrency(values):
+    """Converts the STAGE=N values of --concurrency into a dictionary."""
+    concurrency = {}
+    for value in values:
+        stage, _, workers = value.partition('=')
+        if stage not in PIPELINE_CONCURRENCY or not workers.isdigit() or int(workers) < 1:
+            raise SystemExit(f"Invalid --concurrency value '{value}', expected STAGE=N with STAGE in {list(PIPELINE_CONCURRENCY)}.")
+        concurrency[stage] = int(workers)
+    return concurrency
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    if args.no_cache:
+        response_cache.configure(enabled=False)
+    asyncio.run(main(replay=args.replay, concurrency=parse_concurrency(args.concurrency), output_format=args.output_format, stream_results=args.stream_results,
+                     force=args.force, only_failed=args.only_failed, watch=args.watch, idle_timeout=args.idle_timeout,
+                     warm_up=args.warm_up, preprocess=args.preprocess, dedup=args.dedup, dedup_threshold=args.dedup_threshold,
+                     trace=not args.no_trace, trace_dir=args.trace_dir, page_types=args.page_types, assemble=not args.no_assemble,
+                     split_workers=args.split_workers))
   
 
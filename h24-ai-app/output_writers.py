@@ -0,0 +1,400 @@
+# output_writers.py
+import os
+import json
+import time
+import logging
+import threading
+
+"""
+Output backends of the merged extraction results written by main_file.py.
+
+The JSON output (one indented <page>_extraction_output.json per page) is large: every cell carries
+nested limit dictionaries, and a one-page form produces a few hundred KB. The backend is selected with
+main_file.py --output-format (or the DOCAI_OUTPUT_FORMAT environment variable):
+
+- json: The original output, one indented JSON file per page (default).
+- json-compact: One JSON file per page without indentation, serialized with orjson when installed.
+- msgpack: One <page>_extraction_output.msgpack.zst file per page, the same nested structure packed
+  with msgpack and compressed with zstd. Requires msgpack and zstandard.
+- parquet / arrow: Columnar tables for the whole run, written in OUTPUT_DIR/extraction_output/<table>/
+  as part files of up to FLUSH_PAGES pages (Parquet with zstd, or Arrow IPC with zstd). The tables are
+  pages, tables, columns, rows, cells, entities and documents (see TABLE_SCHEMAS), one row per item,
+  with the page name in every table. Requires pyarrow.
+
+Every writer has write(page_name, merged_results) (thread-safe), write_document(file_name, document)
+for the per-file documents of document_assembly.py, and close(); get_writer() builds the writer of a
+format. The per-page formats write each document next to the page outputs (<file>_document.json or
+.msgpack.zst), the columnar formats add one row per page of the document to the documents table.
+read_page_output() and read_table() read the outputs back.
+"""
+
+#Configuration
+OUTPUT_FORMATS = ["json", "json-compact", "msgpack", "parquet", "arrow"]
+DEFAULT_OUTPUT_FORMAT = os.environ.get("DOCAI_OUTPUT_FORMAT", "json")
+JSON_INDENT = 4
+ZSTD_LEVEL = int(os.environ.get("DOCAI_OUTPUT_ZSTD_LEVEL", 3))
+FLUSH_PAGES = int(os.environ.get("DOCAI_OUTPUT_FLUSH_PAGES", 256))  # Pages per columnar part file
+COLUMNAR_DIR_NAME = 'extraction_output'
+
+FILE_SUFFIXES = {
+    "json": "_extraction_output.json",
+    "json-compact": "_extraction_output.json",
+    "msgpack": "_extraction_output.msgpack.zst",
+}
+DOCUMENT_SUFFIXES = {
+    "json": "_document.json",
+    "json-compact": "_document.json",
+    "msgpack": "_document.msgpack.zst",
+}
+
+VERTEX_COLUMNS = ["x0", "y0", "x1", "y1", "x2", "y2", "x3", "y3"]
+LIMIT_COLUMNS = ["left", "top", "right", "bottom"]
+TEXT_COLUMNS = ["text", "start_index", "end_index"]
+# The page as sent to Document AI (page_info of page_preprocessing.py): the coordinates of the other tables
+# are relative to the crop box, in pixels at page_dpi, when the page was cropped
+PAGE_INFO_COLUMNS = ["page_encoding", "page_dpi", "crop_left", "crop_top", "crop_right", "crop_bottom"]
+# The indexed page whose outputs a near-duplicate page reused (duplicate_of of page_dedup.py), and the phash distance
+DUPLICATE_COLUMNS = ["duplicate_of_page", "duplicate_distance"]
+
+# Columns of each columnar table, the types are set in _arrow_schemas()
+TABLE_SCHEMAS = {
+    "pages": ["page_name", "category_prediction", "category_confidence", "page_type", "page_type_confidence", "other_outputs"]
+             + PAGE_INFO_COLUMNS + DUPLICATE_COLUMNS,
+    "tables": ["page_name", "table_index", "total_rows", "total_cols"] + VERTEX_COLUMNS,
+    "columns": ["page_name", "col_index"] + TEXT_COLUMNS + LIMIT_COLUMNS,
+    "rows": ["page_name", "row_index"] + TEXT_COLUMNS + LIMIT_COLUMNS,
+    "cells": ["page_name", "row_type", "row_index", "col_index"] + TEXT_COLUMNS + ["confidence"] + VERTEX_COLUMNS,
+    "entities": ["page_name", "entity_type", "entity_text", "entity_confidence"],
+    "documents": ["file_name", "page_number", "page_name", "page_status", "failed_processors", "page_error"],
+}
+STRING_COLUMNS = {"page_name", "category_prediction", "page_type", "other_outputs", "text", "row_type", "entity_type", "entity_text",
+                  "file_name", "page_status", "failed_processors", "page_error", "page_encoding", "duplicate_of_page"}
+INTEGER_COLUMNS = {"table_index", "total_rows", "total_cols", "col_index", "row_index", "start_index", "end_index", "page_number",
+                   "page_dpi", "crop_left", "crop_top", "crop_right", "crop_bottom", "duplicate_distance"}
+
+
+def output_path(output_dir, page_name, output_format):
+    """Returns the path of the output file of a page, for the per-page formats."""
+    return os.path.join(output_dir, os.path.splitext(page_name)[0] + FILE_SUFFIXES[output_format])
+
+
+def document_path(output_dir, file_name, output_format):
+    """Returns the path of the document of an input file, for the per-page formats."""
+    return os.path.join(output_dir, os.path.splitext(file_name)[0] + DOCUMENT_SUFFIXES[output_format])
+
+
+class JsonWriter:
+    """
+    One JSON file per page.
+
+    Args:
+        output_dir (str): The output directory.
+        compact (bool): Write without indentation, with orjson when it is installed.
+    """
+
+    def __init__(self, output_dir, compact=False):
+        self.output_dir = output_dir
+        self.output_format = "json-compact" if compact else "json"
+        self.dumps = None
+        if compact:
+            try:
+                import orjson
+                self.dumps = orjson.dumps
+            except ImportError:
+                self.dumps = lambda data: json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def write(self, page_name, merged_results):
+        return self._write(output_path(self.output_dir, page_name, self.output_format), merged_results)
+
+    def write_document(self, file_name, document):
+        return self._write(document_path(self.output_dir, file_name, self.output_format), document)
+
+    def _write(self, path, data):
+        if self.dumps is None:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=JSON_INDENT)
+        else:
+            with open(path, 'wb') as f:
+                f.write(self.dumps(data))
+        return path
+
+    def close(self):
+        pass
+
+
+class MsgpackWriter:
+    """
+    One msgpack + zstd file per page.
+
+    Args:
+        output_dir (str): The output directory.
+    """
+
+    def __init__(self, output_dir):
+        import msgpack
+        import zstandard
+
+        self.output_dir = output_dir
+        self.output_format = "msgpack"
+        self._packb = msgpack.packb
+        self._zstandard = zstandard
+        # zstd compressors cannot be shared between threads
+        self._local = threading.local()
+
+    def write(self, page_name, merged_results):
+        return self._write(output_path(self.output_dir, page_name, "msgpack"), merged_results)
+
+    def write_document(self, file_name, document):
+        return self._write(document_path(self.output_dir, file_name, "msgpack"), document)
+
+    def _write(self, path, data):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._local.compressor = self._zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        with open(path, 'wb') as f:
+            f.write(compressor.compress(self._packb(data, use_bin_type=True)))
+        return path
+
+    def close(self):
+        pass
+
+
+def _text_values(text_data):
+    """The text, start_index and end_index of a text dictionary of the processor outputs."""
+    text_data = text_data or {}
+    return [text_data.get("text"), text_data.get("start_index"), text_data.get("end_index")]
+
+
+def _vertex_values(limits):
+    """The 8 vertex coordinates of a limits dictionary of ml_tabular_ext (see _limits_dict), None if missing."""
+    if not limits:
+        return [None] * 8
+    left = limits["left_limit"]
+    right = limits["right_limit"]
+    bottom = limits["bottom_limit"]["horizontal_extent"]
+    # Top left, top right, bottom right and bottom left vertices
+    return [left["x_position"], left["vertical_extent"]["top"], right["x_position"], right["vertical_extent"]["top"],
+            bottom["right"], right["vertical_extent"]["bottom"], bottom["left"], left["vertical_extent"]["bottom"]]
+
+
+def _limit_values(limits):
+    """The left, top, right and bottom values of a row or column limits dictionary."""
+    limits = limits or {}
+    return [limits.get("left_limit"), limits.get("top_limit"), limits.get("right_limit"), limits.get("bottom_limit")]
+
+
+def _page_info_values(page_info):
+    """The encoding, DPI and crop box of the page_info of a preprocessed page, None without preprocessing."""
+    page_info = page_info or {}
+    return [page_info.get("encoding"), page_info.get("dpi")] + list(page_info.get("crop_box") or [None] * 4)
+
+
+def _duplicate_values(duplicate_of):
+    """The page name and phash distance of the indexed page a page duplicates, None for a distinct page."""
+    duplicate_of = duplicate_of or {}
+    return [duplicate_of.get("page_name"), duplicate_of.get("distance")]
+
+
+def flatten_results(page_name, merged_results):
+    """
+    Converts the merged results of a page into rows of the columnar tables.
+
+    Args:
+        page_name (str): The name of the page.
+        merged_results (dict): The merged processor outputs of the page.
+
+    Returns:
+        dict: For each table of TABLE_SCHEMAS, the list of its rows (lists of values in column order).
+    """
+    outputs = dict(merged_results.get("processor_outputs", {}))
+    rows = {table_name: [] for table_name in TABLE_SCHEMAS}
+
+    category = outputs.pop("ml_cat_prediction", None) or {}
+    page_type = outputs.pop("ml_page_classifier", None) or {}
+    tabular = outputs.pop("ml_tabular_ext", None)
+    key_value = outputs.pop("ml_key_value_pair_ext", None)
+
+    rows["pages"].append([
+        page_name,
+        category.get("category_prediction"),
+        category.get("confidence"),
+        page_type.get("page_type"),
+        page_type.get("confidence"),
+        json.dumps(outputs) if outputs else None,
+    ] + _page_info_values(merged_results.get("page_info")) + _duplicate_values(merged_results.get("duplicate_of")))
+
+    if tabular:
+        table_entities = tabular.get("table_entities", {})
+        for table_index, table in enumerate(table_entities.get("table_data", [])):
+            rows["tables"].append([page_name, table_index, table["total_rows"], table["total_cols"]] + _vertex_values(table["table_limits"]))
+        for column in table_entities.get("column_data", []):
+            rows["columns"].append([page_name, column["col_index"]] + _text_values(column["col_cell_text"]) + _limit_values(column["col_limits"]))
+        for row in table_entities.get("row_data", []):
+            rows["rows"].append([page_name, row["row_index"]] + _text_values(row["row_first_cell_text"]) + _limit_values(row["row_limits"]))
+        for cell in table_entities.get("content_data", []):
+            cell_data = cell["cell_data"]
+            rows["cells"].append([page_name, cell["row_type"], cell["row_index"], cell["col_index"]]
+                                 + _text_values(cell_data["cell_content"]) + [cell_data["cell_extraction_confidence"]]
+                                 + _vertex_values(cell_data["cell_limits"]))
+
+    if key_value:
+        for entity in key_value.get("document_entities", []):
+            rows["entities"].append([page_name, entity["entity_type"], entity["entity_text"], entity["entity_confidence"]])
+
+    return rows
+
+
+def _arrow_schemas(pa):
+    """The Arrow schema of each columnar table."""
+    def column_type(column):
+        if column in STRING_COLUMNS:
+            return pa.string()
+        if column in INTEGER_COLUMNS:
+            return pa.int64()
+        return pa.float64()
+    return {table_name: pa.schema([(column, column_type(column)) for column in columns])
+            for table_name, columns in TABLE_SCHEMAS.items()}
+
+
+class ColumnarWriter:
+    """
+    Columnar tables for the whole run, written as Parquet or Arrow IPC part files.
+
+    Args:
+        output_dir (str): The output directory; the tables are written in output_dir/extraction_output/<table>/.
+        output_format (str): "parquet" or "arrow".
+        flush_pages (int): The number of pages buffered before a part file is written.
+    """
+
+    def __init__(self, output_dir, output_format="parquet", flush_pages=FLUSH_PAGES):
+        import pyarrow
+
+        self.pa = pyarrow
+        self.output_format = output_format
+        self.flush_pages = flush_pages
+        self.base_dir = os.path.join(output_dir, COLUMNAR_DIR_NAME)
+        self.schemas = _arrow_schemas(pyarrow)
+        # Part files of different runs never overwrite each other
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.part_number = 0
+        self._buffers = {table_name: [] for table_name in TABLE_SCHEMAS}
+        self._buffered_pages = 0
+        self._lock = threading.Lock()
+
+    def write(self, page_name, merged_results):
+        rows = flatten_results(page_name, merged_results)
+        with self._lock:
+            for table_name, table_rows in rows.items():
+                self._buffers[table_name].extend(table_rows)
+            self._buffered_pages += 1
+            if self._buffered_pages >= self.flush_pages:
+                self._flush()
+        return self.base_dir
+
+    def write_document(self, file_name, document):
+        # The page outputs are already in the other tables, the documents table holds the page status
+        rows = [[file_name, page["page_number"], page["page_name"], page["status"],
+                 ','.join(page["failed_processors"]) or None, page["error"]] for page in document["pages"]]
+        with self._lock:
+            self._buffers["documents"].extend(rows)
+        return os.path.join(self.base_dir, "documents")
+
+    def _flush(self):
+        """Writes the buffered rows of every table as new part files (lock held)."""
+        if not any(self._buffers.values()):
+            return
+        extension = "parquet" if self.output_format == "parquet" else "arrow"
+        for table_name, table_rows in self._buffers.items():
+            if not table_rows:
+                continue
+            schema = self.schemas[table_name]
+            # Rows are transposed into columns, so each column is converted to Arrow at once
+            columns = list(zip(*table_rows))
+            table = self.pa.Table.from_arrays([self.pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+            table_dir = os.path.join(self.base_dir, table_name)
+            os.makedirs(table_dir, exist_ok=True)
+            path = os.path.join(table_dir, f"part-{self.run_id}-{self.part_number:05d}.{extension}")
+            if self.output_format == "parquet":
+                import pyarrow.parquet as pq
+                pq.write_table(table, path, compression='zstd', compression_level=ZSTD_LEVEL)
+            else:
+                options = self.pa.ipc.IpcWriteOptions(compression='zstd')
+                with self.pa.OSFile(path, 'wb') as sink, self.pa.ipc.new_file(sink, schema, options=options) as writer:
+                    writer.write_table(table)
+
+        self.part_number += 1
+        self._buffers = {table_name: [] for table_name in TABLE_SCHEMAS}
+        self._buffered_pages = 0
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        logging.info(f"Columnar extraction output written to {self.base_dir} ({self.part_number} parts per table).")
+
+
+def get_writer(output_format, output_dir):
+    """
+    Builds the writer of an output format.
+
+    Args:
+        output_format (str): One of OUTPUT_FORMATS.
+        output_dir (str): The output directory.
+
+    Raises:
+        ValueError: If the format is unknown.
+        ImportError: If the libraries of the format are not installed.
+    """
+    if output_format == "json":
+        return JsonWriter(output_dir)
+    if output_format == "json-compact":
+        return JsonWriter(output_dir, compact=True)
+    if output_format == "msgpack":
+        return MsgpackWriter(output_dir)
+    if output_format in ("parquet", "arrow"):
+        return ColumnarWriter(output_dir, output_format)
+    raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}.")
+
+
+def read_page_output(path):
+    """
+    Reads the output file of a page written by JsonWriter or MsgpackWriter.
+
+    Returns:
+        dict: The merged results of the page.
+    """
+    if path.endswith('.msgpack.zst'):
+        import msgpack
+        import zstandard
+        with open(path, 'rb') as f:
+            return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(f.read()), raw=False)
+    with open(path, 'rb') as f:
+        return json.loads(f.read())
+
+
+def read_table(output_dir, table_name, output_format="parquet"):
+    """
+    Reads a columnar table written by ColumnarWriter, all the part files together.
+
+    Args:
+        output_dir (str): The output directory given to the writer.
+        table_name (str): One of the tables of TABLE_SCHEMAS.
+        output_format (str): "parquet" or "arrow".
+
+    Returns:
+        pyarrow.Table: The table.
+    """
+    import pyarrow
+    import pyarrow.dataset as ds
+
+    table_dir = os.path.join(output_dir, COLUMNAR_DIR_NAME, table_name)
+    schema = _arrow_schemas(pyarrow)[table_name]
+    if not os.path.isdir(table_dir):
+        return schema.empty_table()
+    # Only the part files of the requested format, both formats can share an output directory
+    part_paths = sorted(os.path.join(table_dir, name) for name in os.listdir(table_dir)
+                        if name.endswith(f".{output_format}"))
+    if not part_paths:
+        return schema.empty_table()
+    dataset_format = "parquet" if output_format == "parquet" else "ipc"
+    return ds.dataset(part_paths, format=dataset_format, schema=schema).to_table()
@@ -0,0 +1,294 @@
+# page_batcher.py
+import os
+import logging
+import threading
+import contextvars
+
+import fitz
+from google.cloud import documentai
+
+import tracing
+
+"""
+Micro-batching of the online Document AI requests.
+
+Every first page used to be a separate ProcessRequest per processor. Online processing accepts
+multi-page documents, so the pages sent to the same processor at the same time (usually from
+different input files) are packed into one PDF and sent as a single request:
+
+- A batch is sent when it reaches MAX_PAGES_PER_REQUEST pages or MAX_REQUEST_BYTES, or when
+  BATCH_WINDOW_SECONDS have passed since its first page arrived.
+- The response is split back per source page: document.pages, the entities (through their
+  page anchors) and the text, with every text anchor rebased on the text of the page, so each
+  caller gets the same Document it would have received for its page alone.
+
+Batching is only used by processors whose results do not depend on the other pages of the
+document (e.g. the form parser of ml_tabular_ext). Classifiers and custom extractors look at the
+document as a whole and must keep one request per page.
+
+The values can be set with the DOCAI_BATCH_* environment variables.
+"""
+
+#Configuration
+MAX_PAGES_PER_REQUEST = int(os.environ.get("DOCAI_BATCH_MAX_PAGES", 15))  # Online processing page limit
+MAX_REQUEST_BYTES = int(os.environ.get("DOCAI_BATCH_MAX_MB", 20)) * 1024 * 1024  # Online processing size limit
+BATCH_WINDOW_SECONDS = int(os.environ.get("DOCAI_BATCH_WINDOW_MS", 200)) / 1000
+
+TEXT_ANCHOR_TYPE = "google.cloud.documentai.v1.Document.TextAnchor"
+
+# Batchers keyed by processor resource name
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _is_repeated(field):
+    """Repeated field check compatible with the old and new protobuf runtimes."""
+    if hasattr(field, 'is_repeated'):
+        return field.is_repeated
+    return field.label == field.LABEL_REPEATED
+
+
+def _shift_text_anchors(message, offset):
+    """
+    Subtracts offset from every text anchor found in a raw protobuf message, recursively.
+
+    Args:
+        message: A raw protobuf message (e.g. a Document.Page).
+        offset (int): The position of the page text in the text of the batch document.
+    """
+    for field, value in message.ListFields():
+        message_type = field.message_type
+        if message_type is None or message_type.GetOptions().map_entry:
+            continue
+        values = value if _is_repeated(field) else [value]
+        if message_type.full_name == TEXT_ANCHOR_TYPE:
+            for text_anchor in values:
+                for segment in text_anchor.text_segments:
+                    segment.start_index -= offset
+                    segment.end_index -= offset
+        else:
+            for item in values:
+                _shift_text_anchors(item, offset)
+
+
+def _text_range(pages):
+    """Returns the (start, end) positions covered by the text anchors of the pages, or None."""
+    starts = []
+    ends = []
+    for page in pages:
+        for segment in page.layout.text_anchor.text_segments:
+            starts.append(segment.start_index)
+            ends.append(segment.end_index)
+    if not starts:
+        return None
+    return min(starts), max(ends)
+
+
+def _entity_page(entity, text_ranges):
+    """Returns the index of the first page an entity belongs to, from its page anchor or its text anchor."""
+    if entity.page_anchor.page_refs:
+        return entity.page_anchor.page_refs[0].page
+    if entity.text_anchor.text_segments:
+        start = entity.text_anchor.text_segments[0].start_index
+        for page_index, text_range in enumerate(text_ranges):
+            if text_range and text_range[0] <= start < text_range[1]:
+                return page_index
+    return None
+
+
+def split_document(document, page_counts):
+    """
+    Splits a batch document into one document per source PDF.
+
+    Args:
+        document (documentai.Document): The document returned for the packed PDF.
+        page_counts (List[int]): The number of pages of each source PDF, in packing order.
+
+    Returns:
+        List[documentai.Document]: One document per source PDF, with pages numbered from 1,
+        the entities of its pages and the text anchors rebased on its own text.
+    """
+    batch = documentai.Document.pb(document)
+    text_ranges = [_text_range([page]) for page in batch.pages]
+
+    # Assign each entity to the source PDF of its first page
+    page_owner = []
+    for source_index, page_count in enumerate(page_counts):
+        page_owner.extend([source_index] * page_count)
+    entities_by_source = [[] for _ in page_counts]
+    for entity in batch.entities:
+        page_index = _entity_page(entity, text_ranges)
+        if page_index is not None and page_index < len(page_owner):
+            entities_by_source[page_owner[page_index]].append(entity)
+
+    documents = []
+    first_page = 0
+    for source_index, page_count in enumerate(page_counts):
+        pages = batch.pages[first_page:first_page + page_count]
+        text_range = _text_range(pages) or (0, 0)
+        offset = text_range[0]
+
+        part = type(batch)(mime_type=batch.mime_type, text=batch.text[text_range[0]:text_range[1]])
+        for page_number, page in enumerate(pages, start=1):
+            new_page = part.pages.add()
+            new_page.CopyFrom(page)
+            new_page.page_number = page_number
+            _shift_text_anchors(new_page, offset)
+        for entity in entities_by_source[source_index]:
+            new_entity = part.entities.add()
+            new_entity.CopyFrom(entity)
+            _shift_text_anchors(new_entity, offset)
+            for page_ref in new_entity.page_anchor.page_refs:
+                page_ref.page -= first_page
+            for entity_property in new_entity.properties:
+                for page_ref in entity_property.page_anchor.page_refs:
+                    page_ref.page -= first_page
+
+        documents.append(documentai.Document.wrap(part))
+        first_page += page_count
+
+    return documents
+
+
+def pack_pdfs(pdf_contents):
+    """
+    Packs several PDF documents into a single PDF.
+
+    Args:
+        pdf_contents (List[bytes]): The content of each PDF.
+
+    Returns:
+        tuple: The packed PDF bytes and the number of pages of each source PDF.
+    """
+    page_counts = []
+    with fitz.open() as packed_pdf:
+        for content in pdf_contents:
+            with fitz.open(stream=content, filetype='pdf') as pdf:
+                page_counts.append(len(pdf))
+                packed_pdf.insert_pdf(pdf)
+        return packed_pdf.tobytes(no_new_id=True), page_counts
+
+
+class PageBatcher:
+    """
+    Collects the PDF pages sent by concurrent threads to one processor and sends them as a single request.
+
+    Args:
+        send (callable): Function receiving PDF bytes and returning the processed documentai.Document.
+        max_pages (int): Maximum number of pages per request.
+        max_bytes (int): Maximum size of the sources of a request.
+        window_seconds (float): Maximum time a page waits for other pages before its batch is sent.
+    """
+
+    def __init__(self, send, max_pages=MAX_PAGES_PER_REQUEST, max_bytes=MAX_REQUEST_BYTES, window_seconds=BATCH_WINDOW_SECONDS):
+        self.send = send
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._batch = None
+        self.requests_sent = 0
+        self.pages_sent = 0
+
+    def _new_batch(self):
+        batch = {"contents": [], "size": 0, "page_count": 0, "documents": None, "error": None, "done": threading.Event()}
+        # The timer sends the batch in the tracing context of its first page (see tracing.py)
+        timer = threading.Timer(self.window_seconds, contextvars.copy_context().run, args=(self._flush_expired, batch))
+        timer.daemon = True
+        batch["timer"] = timer
+        return batch
+
+    def _detach(self, batch):
+        """Removes the batch from the batcher (lock held), so no page is added after it is sent."""
+        if self._batch is batch:
+            self._batch = None
+        batch["timer"].cancel()
+
+    def _flush_expired(self, batch):
+        with self._lock:
+            if self._batch is not batch:
+                return
+            self._detach(batch)
+        self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        try:
+            contents = batch["contents"]
+            tracing.annotate(batch_pages=batch["page_count"])
+            if len(contents) == 1:
+                batch["documents"] = [self.send(contents[0])]
+            else:
+                packed_pdf, page_counts = pack_pdfs(contents)
+                batch["documents"] = split_document(self.send(packed_pdf), page_counts)
+            self.requests_sent += 1
+            self.pages_sent += batch["page_count"]
+        except Exception as e:
+            batch["error"] = e
+        finally:
+            batch["done"].set()
+
+    def process(self, content):
+        """
+        Adds a PDF to the current batch and waits for its part of the response.
+
+        Args:
+            content (bytes): The content of the PDF.
+
+        Returns:
+            documentai.Document: The document of this PDF only.
+        """
+        with fitz.open(stream=content, filetype='pdf') as pdf:
+            page_count = len(pdf)
+
+        full_batch = None
+        with self._lock:
+            # Send the current batch first if this page does not fit in it
+            if self._batch and (self._batch["size"] + len(content) > self.max_bytes
+                                or self._batch["page_count"] + page_count > self.max_pages):
+                full_batch = self._batch
+                self._detach(full_batch)
+
+            if self._batch is None:
+                self._batch = self._new_batch()
+                self._batch["timer"].start()
+            batch = self._batch
+            batch["contents"].append(content)
+            batch["size"] += len(content)
+            batch["page_count"] += page_count
+            index = len(batch["contents"]) - 1
+
+            if batch["page_count"] >= self.max_pages:
+                self._detach(batch)
+                ready_batch = batch
+            else:
+                ready_batch = None
+
+        if full_batch:
+            self._send_batch(full_batch)
+        if ready_batch:
+            self._send_batch(ready_batch)
+
+        batch["done"].wait()
+        if batch["error"]:
+            raise batch["error"]
+        return batch["documents"][index]
+
+
+def get_batcher(key, send):
+    """
+    Returns the batcher of a processor, creating it on the first call.
+
+    Args:
+        key (str): The processor resource name (and version).
+        send (callable): Function receiving PDF bytes and returning the processed documentai.Document.
+
+    Returns:
+        PageBatcher: The batcher of the processor.
+    """
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = PageBatcher(send)
+            _batchers[key] = batcher
+            logging.info(f"Batching requests for {key} (up to {batcher.max_pages} pages per request).")
+        return batcher
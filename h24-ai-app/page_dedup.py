@@ -0,0 +1,285 @@
+# page_dedup.py
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import fitz
+import numpy as np
+
+"""
+Deduplication of the pages sent to the processors, used by main_file.py --dedup.
+
+The same form often reaches the pipeline more than once: concatenated forms, rescans, and the
+"Concatenated Forms (Split)" copies of the layer-1 analysis. Every page gets a fingerprint:
+
+- byte_hash: the SHA-256 of the page bytes, for exact copies.
+- text_hash: the SHA-256 of the words of the text layer, None for scans without text layer.
+- phash: a perceptual hash, robust to rescans and recompression. The page is rendered to a
+  THUMBNAIL_SIZE x THUMBNAIL_SIZE grayscale thumbnail, then to a 32 x 32 image. The hash is made of
+  the PHASH_SIZE x PHASH_SIZE lowest frequencies of its 2D DCT, each bit set when the coefficient is
+  above the median (PHASH_SIZE ** 2 bits).
+
+The PageIndex stores in SQLite the fingerprint of every distinct page and the processor outputs of
+that page. A page is a near-duplicate of an indexed page when their byte hashes are equal, or when
+their phashes differ by at most DEDUP_THRESHOLD bits (Hamming distance) and their text layers are the
+same. The text layer keeps apart the sparse born-digital pages, whose thumbnails are almost blank and
+have close phashes. A near-duplicate reuses the outputs of the indexed page and only calls the
+processors that have no stored output; its output is linked to the indexed page ("duplicate_of").
+A page only duplicates the indexed pages of other page names: the same page processed again (a rerun)
+matches its own entry, which then records its new outputs.
+
+The threshold trades savings for safety. On the sample forms (256-bit phash), simulated rescans
+(shifted, 150 DPI, JPEG quality 50) differ by 8 to 10 bits. Two fillings of the same form template
+differ by more than 40 bits, and two different forms by about 70 bits. The default of 20 bits only
+merges rescans of the same filled form.
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEDUP = os.environ.get("DOCAI_DEDUP", "0") == "1"  # Default of main_file.py --dedup
+DEDUP_INDEX_PATH = os.environ.get("DOCAI_DEDUP_INDEX_PATH", os.path.join(script_dir, 'temp', 'page_index.sqlite'))
+DEDUP_THRESHOLD = int(os.environ.get("DOCAI_DEDUP_THRESHOLD", 20))  # Maximum Hamming distance of near-duplicates
+THUMBNAIL_SIZE = 128  # Side of the rendered thumbnail, averaged down to 32 x 32
+PHASH_SIZE = 16  # Side of the block of low DCT frequencies kept in the hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_id INTEGER PRIMARY KEY,
+    page_name TEXT NOT NULL,
+    byte_hash TEXT NOT NULL,
+    phash BLOB NOT NULL,
+    text_hash TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_byte_hash ON pages (byte_hash);
+CREATE TABLE IF NOT EXISTS results (
+    page_id INTEGER NOT NULL,
+    processor TEXT NOT NULL,
+    result TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (page_id, processor)
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    page_name TEXT NOT NULL,
+    page_id INTEGER NOT NULL,
+    distance INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Number of bits set in each byte value, for the Hamming distances
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def _dct_matrix(size):
+    """Returns the orthonormal DCT-II matrix of a given size."""
+    k = np.arange(size)[:, None]
+    i = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+_DCT = _dct_matrix(32)
+
+
+def perceptual_hash(pixmap):
+    """
+    Returns the perceptual hash of a page (PHASH_SIZE ** 2 bits, packed in bytes).
+
+    Args:
+        pixmap (fitz.Pixmap): The grayscale thumbnail of the page, about THUMBNAIL_SIZE pixels square.
+    """
+    image = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+    # Rounding may leave a pixel more or less: the thumbnail is padded or cut to the exact size
+    image = np.pad(image, ((0, max(THUMBNAIL_SIZE - image.shape[0], 0)), (0, max(THUMBNAIL_SIZE - image.shape[1], 0))), mode='edge')
+    image = image[:THUMBNAIL_SIZE, :THUMBNAIL_SIZE].astype(np.float64)
+    block = THUMBNAIL_SIZE // 32
+    small = image.reshape(32, block, 32, block).mean(axis=(1, 3))
+
+    frequencies = (_DCT @ small @ _DCT.T)[:PHASH_SIZE, :PHASH_SIZE].flatten()
+    # The DC coefficient (mean brightness) is left out of the median
+    bits = frequencies > np.median(frequencies[1:])
+    return np.packbits(bits).tobytes()
+
+
+def page_fingerprint(page_bytes):
+    """
+    Returns the fingerprint of a page.
+
+    Args:
+        page_bytes (bytes): The single-page PDF.
+
+    Returns:
+        dict: The byte_hash (SHA-256 hex digest), the text_hash (None without text layer) and the phash
+        (bytes) of the page.
+    """
+    with fitz.open(stream=page_bytes, filetype='pdf') as pdf:
+        page = pdf[0]
+        words = page.get_text().split()
+        # The page is stretched to a square, so the hash does not depend on the page size
+        matrix = fitz.Matrix(THUMBNAIL_SIZE / page.rect.width, THUMBNAIL_SIZE / page.rect.height)
+        pixmap = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+    return {
+        "byte_hash": hashlib.sha256(page_bytes).hexdigest(),
+        "text_hash": hashlib.sha256(' '.join(words).encode('utf-8')).hexdigest() if words else None,
+        "phash": perceptual_hash(pixmap),
+    }
+
+
+def hamming_distances(phash, phashes):
+    """
+    Returns the Hamming distance between a phash and each row of an array of phashes.
+
+    Args:
+        phash (bytes): The packed perceptual hash.
+        phashes (np.ndarray): The (n x hash bytes) uint8 array of the indexed phashes.
+    """
+    return _POPCOUNT[np.bitwise_xor(phashes, np.frombuffer(phash, dtype=np.uint8))].sum(axis=1)
+
+
+class PageIndex:
+    """
+    Persistent SQLite index of the distinct pages and their processor outputs (thread-safe).
+
+    The phashes are also kept in memory, so a lookup compares a page with every indexed page at once.
+
+    Args:
+        db_path (str): The path to the SQLite database, created if missing.
+        threshold (int): The maximum Hamming distance between the phashes of near-duplicates.
+    """
+
+    def __init__(self, db_path=DEDUP_INDEX_PATH, threshold=DEDUP_THRESHOLD):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.threshold = threshold
+        self.stats = {"pages": 0, "exact_duplicates": 0, "near_duplicates": 0, "reprocessed_pages": 0, "reused_results": 0}
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+        rows = self._connection.execute("SELECT page_id, page_name, byte_hash, phash, text_hash FROM pages ORDER BY page_id").fetchall()
+        self._page_ids = []
+        self._page_names = {}
+        self._byte_hashes = {}
+        # Row buffers of the indexed pages, their capacity doubles when full (the first self._count rows are used)
+        self._count = 0
+        self._phashes = np.zeros((max(len(rows), 1024), PHASH_SIZE * PHASH_SIZE // 8), dtype=np.uint8)
+        self._text_hashes = np.empty(len(self._phashes), dtype=object)
+        self._names = np.empty(len(self._phashes), dtype=object)
+        for page_id, page_name, byte_hash, phash, text_hash in rows:
+            self._append(page_id, page_name, byte_hash, phash, text_hash)
+
+    def _append(self, page_id, page_name, byte_hash, phash, text_hash):
+        # Adds an indexed page to the lookup structures, the caller holds the lock (or is __init__)
+        if self._count == len(self._phashes):
+            capacity = 2 * len(self._phashes)
+            self._phashes = np.concatenate([self._phashes, np.zeros_like(self._phashes)])
+            self._text_hashes = np.concatenate([self._text_hashes, np.empty(capacity - self._count, dtype=object)])
+            self._names = np.concatenate([self._names, np.empty(capacity - self._count, dtype=object)])
+        self._phashes[self._count] = np.frombuffer(phash, dtype=np.uint8)
+        self._text_hashes[self._count] = text_hash
+        self._names[self._count] = page_name
+        self._count += 1
+        self._page_ids.append(page_id)
+        self._page_names[page_id] = page_name
+        self._byte_hashes[byte_hash] = page_id
+
+    def match_or_add(self, fingerprint, page_name):
+        """
+        Looks up the indexed page a page duplicates, and indexes the page when it is new.
+
+        Args:
+            fingerprint (dict): The fingerprint of the page (see page_fingerprint).
+            page_name (str): The name of the page.
+
+        Returns:
+            dict: The page_id of the indexed page, and duplicate_of: None for a new page (or the page
+            itself, indexed by a previous run), otherwise the page_name of the indexed page and the
+            Hamming distance between the two phashes.
+        """
+        with self._lock:
+            self.stats["pages"] += 1
+            page_id = self._byte_hashes.get(fingerprint["byte_hash"])
+            if page_id is not None and self._page_names[page_id] == page_name:
+                # The same page processed again: its outputs are refreshed, it duplicates nothing
+                self.stats["reprocessed_pages"] += 1
+                return {"page_id": page_id, "duplicate_of": None}
+            exact = page_id is not None
+            distance = 0
+            if not exact and self._count:
+                distances = hamming_distances(fingerprint["phash"], self._phashes[:self._count])
+                # Only the pages with the same text layer (or without text layer), and another name, can match
+                excluded = (self._text_hashes[:self._count] != fingerprint["text_hash"]) | (self._names[:self._count] == page_name)
+                distances[excluded] = np.iinfo(distances.dtype).max
+                closest = int(np.argmin(distances))
+                if distances[closest] <= self.threshold:
+                    page_id = self._page_ids[closest]
+                    distance = int(distances[closest])
+
+            now = time.time()
+            if page_id is not None:
+                self.stats["exact_duplicates" if exact else "near_duplicates"] += 1
+                self._connection.execute("INSERT INTO duplicates (page_name, page_id, distance, created_at) VALUES (?, ?, ?, ?)",
+                                         (page_name, page_id, distance, now))
+                return {"page_id": page_id, "duplicate_of": {"page_name": self._page_names[page_id], "distance": distance}}
+
+            page_id = self._connection.execute(
+                "INSERT INTO pages (page_name, byte_hash, phash, text_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                (page_name, fingerprint["byte_hash"], fingerprint["phash"], fingerprint["text_hash"], now)).lastrowid
+            self._append(page_id, page_name, fingerprint["byte_hash"], fingerprint["phash"], fingerprint["text_hash"])
+            return {"page_id": page_id, "duplicate_of": None}
+
+    def record_result(self, page_id, processor_name, result):
+        """
+        Stores the output of a processor on an indexed page, for its future duplicates.
+
+        Args:
+            page_id (int): The ID of the indexed page.
+            processor_name (str): The name of the processor.
+            result: The analyzed processor output, JSON serializable (None outputs are not stored).
+        """
+        if result is None:
+            return
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO results (page_id, processor, result, updated_at) VALUES (?, ?, ?, ?)",
+                                     (page_id, processor_name, json.dumps(result), time.time()))
+
+    def results(self, page_id):
+        """Returns the stored processor outputs of an indexed page: {processor_name: output}."""
+        with self._lock:
+            rows = self._connection.execute("SELECT processor, result FROM results WHERE page_id = ?", (page_id,)).fetchall()
+        return {processor: json.loads(result) for processor, result in rows}
+
+    def reuse_results(self, page_id, processor_names):
+        """
+        Returns the stored outputs of some processors on an indexed page, counted as reused by the run.
+
+        Args:
+            page_id (int): The ID of the indexed page.
+            processor_names (set): The processors whose outputs are reused.
+
+        Returns:
+            dict: {processor_name: output}, for the processors with a stored output.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT processor, result FROM results WHERE page_id = ?", (page_id,)).fetchall()
+            reused = {processor: json.loads(result) for processor, result in rows if processor in processor_names}
+            self.stats["reused_results"] += len(reused)
+        return reused
+
+    def summary(self):
+        """Returns the pages indexed, the duplicates found and the dedup rate of the run (duplicates of other pages only)."""
+        with self._lock:
+            indexed = len(self._page_ids)
+            stats = dict(self.stats)
+        duplicates = stats["exact_duplicates"] + stats["near_duplicates"]
+        return {**stats, "indexed_pages": indexed, "dedup_rate": round(duplicates / stats["pages"], 3) if stats["pages"] else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
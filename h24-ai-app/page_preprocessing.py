@@ -0,0 +1,179 @@
+# page_preprocessing.py
+import os
+import zlib
+import struct
+import threading
+
+import fitz
+import numpy as np
+
+"""
+Preprocessing of the pages before they are sent to Document AI, used by main_file.py --preprocess.
+
+The scanned inputs (Samsung-M4580FX, intsig.com scanners, see metadata_3.0.csv) embed color JPEGs of
+600 KB or more per page, uploaded as they are. preprocess_page() re-renders a page with PyMuPDF and
+rebuilds a single-page PDF around the smallest encoding:
+
+- render: the page is rasterized at PREPROCESS_DPI (200 DPI keeps the pixel coordinates returned by
+  Document AI at the scale of most scans), in grayscale unless PREPROCESS_MODE is "color".
+- crop (optional): the blank margins (pixels lighter than MARGIN_THRESHOLD) are removed, keeping
+  MARGIN_PADDING pixels around the content. The pixel coordinates of the processor outputs are then
+  relative to the cropped image: the crop box is returned in the page info.
+- encodings: JPEG at PREPROCESS_JPEG_QUALITY for "gray" and "color", a 1-bit PNG (thresholded at
+  BILEVEL_THRESHOLD) for "bilevel", and lossless PNG. The smallest candidate is kept, and the original
+  page is kept when it is smaller than every candidate (e.g. born-digital pages with a text layer).
+
+The page keeps its size in points, so the normalized coordinates are unchanged without crop.
+The preprocessed bytes are deterministic, so the response cache still works between runs.
+"""
+
+#Configuration
+PREPROCESS = os.environ.get("DOCAI_PREPROCESS", "0") == "1"  # Default of main_file.py --preprocess
+PREPROCESS_DPI = int(os.environ.get("DOCAI_PREPROCESS_DPI", 200))
+PREPROCESS_MODE = os.environ.get("DOCAI_PREPROCESS_MODE", "gray")  # "gray", "bilevel" or "color"
+PREPROCESS_JPEG_QUALITY = int(os.environ.get("DOCAI_PREPROCESS_JPEG_QUALITY", 75))
+PREPROCESS_CROP = os.environ.get("DOCAI_PREPROCESS_CROP", "0") == "1"
+MARGIN_THRESHOLD = 235  # Gray level above which a pixel is blank, for the crop
+MARGIN_PADDING = 16  # Pixels kept around the content when cropping
+BILEVEL_THRESHOLD = 160  # Gray level below which a pixel is black, for the bilevel encoding
+PREPROCESS_MODES = ["gray", "bilevel", "color"]
+
+# Bytes before and after preprocessing, and encodings kept, for the whole run
+_stats = {"pages": 0, "original_bytes": 0, "bytes": 0, "encodings": {}}
+_stats_lock = threading.Lock()
+
+
+def default_options():
+    """Returns the preprocessing options of the configuration."""
+    return {
+        "dpi": PREPROCESS_DPI,
+        "mode": PREPROCESS_MODE,
+        "jpeg_quality": PREPROCESS_JPEG_QUALITY,
+        "crop": PREPROCESS_CROP,
+    }
+
+
+def _content_box(gray):
+    """
+    Returns the (left, top, right, bottom) pixel box of the content of a grayscale image, with
+    MARGIN_PADDING pixels around it, or None for a blank image.
+    """
+    ink = gray < MARGIN_THRESHOLD
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if not len(rows):
+        return None
+    height, width = gray.shape
+    return (max(int(cols[0]) - MARGIN_PADDING, 0), max(int(rows[0]) - MARGIN_PADDING, 0),
+            min(int(cols[-1]) + 1 + MARGIN_PADDING, width), min(int(rows[-1]) + 1 + MARGIN_PADDING, height))
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def bilevel_png(gray, threshold=BILEVEL_THRESHOLD):
+    """
+    Encodes a grayscale image as a 1-bit PNG (PyMuPDF pixmaps have no 1-bit format).
+
+    Args:
+        gray (np.ndarray): The (height x width) uint8 image.
+        threshold (int): Gray level below which a pixel is black.
+
+    Returns:
+        bytes: The PNG file.
+    """
+    height, width = gray.shape
+    # 1 = white, packed 8 pixels per byte, each row starts with the "None" filter byte
+    bits = np.packbits(gray >= threshold, axis=1)
+    rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8), bits], axis=1)
+    header = struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 9)) + _png_chunk(b'IEND', b''))
+
+
+def _encode_candidates(pixmap, options):
+    """Returns the (encoding, image_bytes) candidates of a rendered page."""
+    candidates = [("png", pixmap.tobytes("png"))]
+    if options["mode"] == "bilevel":
+        gray = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width)
+        candidates.append(("png-1bit", bilevel_png(gray)))
+    else:
+        candidates.append(("jpeg", pixmap.tobytes("jpeg", jpg_quality=options["jpeg_quality"])))
+    return candidates
+
+
+def _crop_pixmap(pixmap, box):
+    """Returns the region of a pixmap inside a (left, top, right, bottom) pixel box."""
+    left, top, right, bottom = box
+    samples = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+    region = np.ascontiguousarray(samples[top:bottom, left:right])
+    return fitz.Pixmap(pixmap.colorspace, right - left, bottom - top, region.tobytes(), False)
+
+
+def preprocess_page(page_bytes, options=None):
+    """
+    Re-renders a single-page PDF with the smallest encoding.
+
+    Args:
+        page_bytes (bytes): The single-page PDF.
+        options (dict, optional): dpi, mode, jpeg_quality and crop, the configuration if None.
+
+    Returns:
+        tuple: The bytes to send (a single-page PDF) and the page info: the encoding kept ("original"
+        when no candidate is smaller), the original and final sizes, the DPI and the crop box in pixels
+        of the rendered image (None without crop).
+    """
+    options = {**default_options(), **(options or {})}
+    if options["mode"] not in PREPROCESS_MODES:
+        raise ValueError(f"Unknown preprocessing mode '{options['mode']}', expected one of {PREPROCESS_MODES}.")
+
+    with fitz.open(stream=page_bytes, filetype='pdf') as pdf:
+        page = pdf[0]
+        colorspace = fitz.csRGB if options["mode"] == "color" else fitz.csGRAY
+        pixmap = page.get_pixmap(dpi=options["dpi"], colorspace=colorspace, alpha=False)
+        page_rect = page.rect
+
+    crop_box = None
+    if options["crop"]:
+        gray = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+        crop_box = _content_box(gray.min(axis=2))
+        if crop_box == (0, 0, pixmap.width, pixmap.height):
+            crop_box = None
+        elif crop_box is not None:
+            pixmap = _crop_pixmap(pixmap, crop_box)
+
+    encoding, image_bytes = min(_encode_candidates(pixmap, options), key=lambda candidate: len(candidate[1]))
+
+    # The image fills a page of the original size in points (of the cropped region with crop)
+    scale = 72 / options["dpi"]
+    width, height = (pixmap.width * scale, pixmap.height * scale) if crop_box else (page_rect.width, page_rect.height)
+    with fitz.open() as output:
+        output_page = output.new_page(width=width, height=height)
+        output_page.insert_image(output_page.rect, stream=image_bytes)
+        output_bytes = output.tobytes(garbage=3, deflate=True, no_new_id=True)
+
+    info = {"encoding": encoding, "original_bytes": len(page_bytes), "bytes": len(output_bytes),
+            "dpi": options["dpi"], "mode": options["mode"], "crop_box": list(crop_box) if crop_box else None}
+    if len(output_bytes) >= len(page_bytes):
+        output_bytes = page_bytes
+        info = {**info, "encoding": "original", "bytes": len(page_bytes), "crop_box": None}
+
+    record_page_info(info)
+    return output_bytes, info
+
+
+def record_page_info(info):
+    """Adds a preprocessed page to the statistics (preprocess_page() does, page_workers.py for the pages of its worker processes)."""
+    with _stats_lock:
+        _stats["pages"] += 1
+        _stats["original_bytes"] += info["original_bytes"]
+        _stats["bytes"] += info["bytes"]
+        _stats["encodings"][info["encoding"]] = _stats["encodings"].get(info["encoding"], 0) + 1
+
+
+def get_stats():
+    """Returns the number of pages preprocessed, their size before and after, and the encodings kept."""
+    with _stats_lock:
+        return {**_stats, "encodings": dict(_stats["encodings"])}
+
@@ -0,0 +1,107 @@
+# page_stream.py
+import os
+
+import fitz
+
+"""
+Streaming splitter of the input PDF files, used by the split stage of main_file.py.
+
+The split stage used to read a whole file into memory, then build the single-page PDF of every page
+before the first page was sent: a file of thousands of scanned pages (see pdf_details.csv) held the
+file bytes plus every page in memory at once. A PageStream opens the file once and returns its pages
+in order, a chunk at a time:
+
+- The file is opened by path: MuPDF reads the objects of a page from the file when the page is
+  extracted, so neither the file nor the other pages are loaded. (PyMuPDF does not accept an mmap
+  object as stream, and opening by path gives the same on-demand reads.)
+- read(max_pages) builds the single-page PDFs of the next pages only. main_file.py reads the next
+  chunk of SPLIT_CHUNK_PAGES pages while the pages of the current chunk go through the pipeline, whose
+  bounded queues hold the stream back: the memory in use does not depend on the page count.
+
+The page names and bytes are the same as those of main_file.split_pages(), so the response cache, the
+job state and the dedup index still match between runs. A single-page file is returned as it is.
+"""
+
+#Configuration
+SPLIT_CHUNK_PAGES = int(os.environ.get("DOCAI_SPLIT_CHUNK_PAGES", 32))  # Pages read ahead, and classified together
+
+
+def page_name(file_name, page_number):
+    """Returns the name of a page of a file (page_number from 0): <file>-p<page_number + 1>.pdf."""
+    return f"{file_name[:-4]}-p{page_number + 1}.pdf"
+
+
+def extract_page(pdf, page_number):
+    """
+    Builds the single-page PDF of a page.
+
+    Args:
+        pdf (fitz.Document): The open PDF document.
+        page_number (int): The page number, from 0.
+
+    Returns:
+        bytes: The single-page PDF.
+    """
+    with fitz.open() as single_page_pdf:
+        single_page_pdf.insert_pdf(pdf, from_page=page_number, to_page=page_number)
+        # Keep the same file ID so the page bytes (and the response cache key) are stable between runs
+        return single_page_pdf.tobytes(no_new_id=True)
+
+
+class PageStream:
+    """
+    The pages of a PDF file, read lazily and in order, as (page_name, page_bytes) tuples.
+
+    Not thread-safe: the reads of a stream must not overlap (they can run in different threads one after the other).
+
+    Args:
+        file_path (str): The path to the PDF file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self._pdf = fitz.open(file_path)
+        self.page_count = len(self._pdf)
+        self.next_page = 0
+
+    def read(self, max_pages=SPLIT_CHUNK_PAGES):
+        """
+        Returns the next pages of the file.
+
+        Args:
+            max_pages (int): The maximum number of pages returned.
+
+        Returns:
+            list: The (page_name, page_bytes) tuples of the next pages, empty at the end of the file.
+        """
+        if self.page_count <= 1:
+            if self.next_page:
+                return []
+            self.next_page = 1
+            # Single-page files are passed as they are
+            with open(self.file_path, 'rb') as f:
+                return [(self.file_name, f.read())]
+
+        pages = []
+        while self.next_page < self.page_count and len(pages) < max_pages:
+            pages.append((page_name(self.file_name, self.next_page), extract_page(self._pdf, self.next_page)))
+            self.next_page += 1
+        return pages
+
+    def __iter__(self):
+        while True:
+            pages = self.read()
+            if not pages:
+                return
+            yield from pages
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
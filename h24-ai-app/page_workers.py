@@ -0,0 +1,236 @@
+# page_workers.py
+import os
+import mmap
+import time
+import multiprocessing
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import fitz
+
+from page_stream import extract_page, page_name
+from page_preprocessing import default_options, preprocess_page, record_page_info
+from page_dedup import page_fingerprint
+
+"""
+Process pool of the CPU-bound page work of the split stage of main_file.py (--split-workers).
+
+Splitting the pages with PyMuPDF, rendering them for the preprocessing (page_preprocessing.py) and
+fingerprinting them (page_dedup.py) holds the GIL: in the threads of the event loop executor, the
+pages of every file are processed on one core. A PageWorkerPool runs this work in SPLIT_WORKERS
+processes instead:
+
+- read(stream, max_pages) splits the next pages of a page_stream.PageStream. The pages are sharded
+  in page ranges, one per worker; each worker opens the file by path (the last files opened are kept
+  open) and extracts its range.
+- prepare(pages, preprocess, fingerprint) preprocesses and fingerprints pages, sharded the same way.
+
+The page bytes do not go through the pipes of the pool (pickled, then copied by chunks): the worker
+writes the pages of its range one after the other in a temporary file of BUFFER_DIR (/dev/shm, kept
+in memory, where it exists) and returns the offset and size of each page. The caller maps the file,
+copies each page out and deletes the file. prepare() sends its input pages the same way. The caller
+creates every buffer file of a call, so when a call fails (a range failed, or a worker died) it
+removes the files left, and a crashed worker does not leak memory in /dev/shm.
+
+The calls block until every range is done, main_file.py runs them in the threads of the event loop
+executor. The pages come back in order, with the same names and bytes as PageStream.read().
+"""
+
+#Configuration
+SPLIT_WORKERS = int(os.environ.get("DOCAI_SPLIT_WORKERS", 0))  # Default of main_file.py --split-workers, 0 splits in threads
+BUFFER_DIR = os.environ.get("DOCAI_PAGE_BUFFER_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)  # None: the temporary directory
+OPEN_DOCUMENTS = 4  # Files kept open by each worker
+MIN_SHARD_PAGES = 4  # Smallest page range sent to a worker, the split of a page takes about a millisecond
+
+# Files opened by the worker process, by path, modification time and size
+_documents = OrderedDict()
+
+
+def _buffer_path():
+    """Creates an empty temporary file for a buffer and returns its path."""
+    fd, path = tempfile.mkstemp(prefix='docai-pages-', dir=BUFFER_DIR)
+    os.close(fd)
+    return path
+
+
+def _write_buffer(path, buffers):
+    """
+    Writes buffers one after the other in a file created by _buffer_path().
+
+    Returns:
+        list: The (offset, size) of each buffer.
+    """
+    spans = []
+    with open(path, 'wb') as f:
+        offset = 0
+        for buffer in buffers:
+            f.write(buffer)
+            spans.append((offset, len(buffer)))
+            offset += len(buffer)
+    return spans
+
+
+def _read_buffer(path, spans):
+    """Copies the buffers out of a file written by _write_buffer(), then deletes the file."""
+    try:
+        if not any(size for _, size in spans):
+            return [b''] * len(spans)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return [buffer[offset:offset + size] for offset, size in spans]
+    finally:
+        os.remove(path)
+
+
+def _open_document(file_path):
+    """Returns the open document of a file, opening it on first use (in the worker process)."""
+    file_stat = os.stat(file_path)
+    # A file replaced at the same path (watch mode) is opened again
+    key = (file_path, file_stat.st_mtime_ns, file_stat.st_size)
+    pdf = _documents.pop(key, None)
+    if pdf is None:
+        pdf = fitz.open(file_path)
+        if len(_documents) >= OPEN_DOCUMENTS:
+            _documents.popitem(last=False)[1].close()
+    _documents[key] = pdf
+    return pdf
+
+
+def _split_range(file_path, first_page, last_page, output_path):
+    """Extracts the pages first_page to last_page (excluded) of a file into a buffer file. Runs in a worker process."""
+    file_name = os.path.basename(file_path)
+    pdf = _open_document(file_path)
+    spans = _write_buffer(output_path, (extract_page(pdf, page_number) for page_number in range(first_page, last_page)))
+    return spans, [page_name(file_name, page_number) for page_number in range(first_page, last_page)]
+
+
+def _prepare_range(input_path, spans, preprocess, options, fingerprint, output_path):
+    """Fingerprints and preprocesses the pages of a buffer file into another one. Runs in a worker process."""
+    pages = _read_buffer(input_path, spans)
+    fingerprints = [page_fingerprint(page_bytes) if fingerprint else None for page_bytes in pages]
+    page_infos = [None] * len(pages)
+    if preprocess:
+        pages, page_infos = zip(*(preprocess_page(page_bytes, options) for page_bytes in pages))
+    spans = _write_buffer(output_path, pages)
+    return spans, list(page_infos), fingerprints
+
+
+def _shards(count, workers):
+    """Returns the (start, end) ranges of count items split between workers, in order."""
+    size = max(MIN_SHARD_PAGES, -(-count // workers))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _discard(futures, paths):
+    """Waits for the ranges of a failed call (a range failed, or a worker died), then removes the buffer files of the call left."""
+    wait(futures)
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class PageWorkerPool:
+    """
+    The worker processes of the page splitting, preprocessing and fingerprinting (thread-safe).
+
+    Args:
+        workers (int): The number of worker processes.
+    """
+
+    def __init__(self, workers=SPLIT_WORKERS):
+        self.workers = max(1, workers)
+        # Spawned, not forked: the parent process runs the gRPC threads of the Document AI clients
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.stats = {"split_pages": 0, "prepared_pages": 0, "bytes": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def read(self, stream, max_pages):
+        """
+        Returns the next pages of a page stream, split by the workers.
+
+        Args:
+            stream (PageStream): The stream of the file, its position is moved past the pages returned.
+            max_pages (int): The maximum number of pages returned.
+
+        Returns:
+            list: The (page_name, page_bytes) tuples of the next pages, empty at the end of the file.
+        """
+        if stream.page_count <= 1:
+            # Single-page files are passed as they are
+            return stream.read(max_pages)
+        first_page = stream.next_page
+        count = min(max_pages, stream.page_count - first_page)
+        if count <= 0:
+            return []
+        stream.next_page += count
+
+        start = time.perf_counter()
+        futures = []
+        paths = []
+        try:
+            for shard_start, shard_end in _shards(count, self.workers):
+                paths.append(_buffer_path())
+                futures.append(self._executor.submit(_split_range, stream.file_path, first_page + shard_start,
+                                                     first_page + shard_end, paths[-1]))
+            results = [future.result() for future in futures]
+        except BaseException:
+            _discard(futures, paths)
+            raise
+        pages = []
+        for path, (spans, names) in zip(paths, results):
+            pages.extend(zip(names, _read_buffer(path, spans)))
+        self._record("split_pages", len(pages), sum(len(page_bytes) for _, page_bytes in pages), start)
+        return pages
+
+    def prepare(self, pages, preprocess, fingerprint, options=None):
+        """
+        Preprocesses and fingerprints pages in the workers.
+
+        Args:
+            pages (list): The single-page PDFs (bytes).
+            preprocess (bool): Re-render the pages with page_preprocessing.preprocess_page().
+            fingerprint (bool): Compute the page_dedup.page_fingerprint() of the original pages.
+            options (dict, optional): The preprocessing options, the configuration of this process if None.
+
+        Returns:
+            list: A (page_bytes, page_info, fingerprint) tuple per page, in order. page_bytes are the
+            original bytes without preprocessing, page_info and fingerprint are None when not computed.
+        """
+        if not pages:
+            return []
+        # The workers get the options of this process, not their own configuration
+        options = options or default_options()
+        start = time.perf_counter()
+        futures = []
+        # The input and output buffer files of each range
+        paths = []
+        try:
+            for shard_start, shard_end in _shards(len(pages), self.workers):
+                input_path, output_path = _buffer_path(), _buffer_path()
+                paths += [input_path, output_path]
+                spans = _write_buffer(input_path, pages[shard_start:shard_end])
+                futures.append(self._executor.submit(_prepare_range, input_path, spans, preprocess, options, fingerprint, output_path))
+            shard_results = [future.result() for future in futures]
+        except BaseException:
+            _discard(futures, paths)
+            raise
+
+        results = []
+        for output_path, (spans, page_infos, fingerprints) in zip(paths[1::2], shard_results):
+            results.extend(zip(_read_buffer(output_path, spans), page_infos, fingerprints))
+        for _, page_info, _ in results:
+            if page_info is not None:
+                # The statistics of page_preprocessing.py are kept by this process
+                record_page_info(page_info)
+        self._record("prepared_pages", len(results), sum(len(page_bytes) for page_bytes, _, _ in results), start)
+        return results
+
+    def _record(self, counter, pages, page_bytes, start):
+        with self._lock:
+            self.stats[counter] += pages
+            self.stats["bytes"] += page_bytes
+            self.stats["seconds"] += time.perf_counter() - start
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,114 @@
+# pipeline.py
+import time
+import asyncio
+import logging
+
+import tracing
+
+"""
+Staged, bounded-concurrency pipeline used by main_file.py.
+
+The files go through a chain of stages (discover -> split -> upload -> parse -> write in
+main_file.py). Each stage has its own number of workers and is connected to the next one by a
+bounded asyncio queue, so CPU work (splitting, post-processing), disk I/O and the Document AI
+latency of different files overlap, and the memory in use is bounded by the queue depths: when a
+stage is slower than the previous one, its queue fills up and the previous stage waits.
+
+A stage is a dictionary:
+- name (str): The name used in the logs.
+- func (async callable): Receives an item and returns an iterable with the items for the next stage
+  (one item, several items, or none to drop it). An async generator function can be used instead:
+  its items are put in the next queue as they are yielded, so a stage can stream the pages of a
+  large file, held back by the queue when the next stage is slower.
+- concurrency (int): The number of workers of the stage.
+
+Errors raised by a stage are logged and only drop the item being processed.
+
+Each item of a stage is a <name>_stage span (see tracing.py), the parent of the spans the stage opens.
+"""
+
+#Configuration
+QUEUE_SIZE = 32  # Maximum number of items waiting between two stages
+
+# Marks the end of the items of a queue
+_DONE = object()
+
+
+async def _feed(items, queue, consumers):
+    """Puts the source items (discover stage) in the first queue."""
+    if hasattr(items, '__aiter__'):
+        # Asynchronous source, e.g. the files landing in a watched folder (main_file.py --watch)
+        async for item in items:
+            await queue.put(item)
+    else:
+        for item in items:
+            await queue.put(item)
+    for _ in range(consumers):
+        await queue.put(_DONE)
+
+
+async def _worker(stage, queue_in, queue_out, stats):
+    """Processes the items of a stage until the end mark of its queue."""
+    while True:
+        item = await queue_in.get()
+        if item is _DONE:
+            return
+
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"{stage['name']}_stage"):
+                outputs = stage["func"](item)
+                if hasattr(outputs, '__aiter__'):
+                    async for output in outputs:
+                        if queue_out is not None:
+                            await queue_out.put(output)
+                    outputs = None
+                else:
+                    outputs = await outputs
+        except Exception as e:
+            logging.error(f"Pipeline stage {stage['name']} failed: {e}")
+            stats["errors"] += 1
+            outputs = None
+        stats["items"] += 1
+        stats["seconds"] += time.perf_counter() - start
+
+        if queue_out is not None:
+            for output in outputs or ():
+                await queue_out.put(output)
+
+
+async def _run_stage(stage, queue_in, queue_out, next_consumers, stats):
+    """Runs the workers of a stage and tells the next stage when there are no more items."""
+    await asyncio.gather(*(_worker(stage, queue_in, queue_out, stats) for _ in range(stage["concurrency"])))
+    if queue_out is not None:
+        for _ in range(next_consumers):
+            await queue_out.put(_DONE)
+
+
+async def run_pipeline(items, stages, queue_size=QUEUE_SIZE):
+    """
+    Streams the items through the stages.
+
+    Args:
+        items (iterable): The source items, consumed lazily (a regular or an asynchronous iterable).
+        stages (list): The stages, in order (see the module docstring).
+        queue_size (int): The depth of the queues between stages.
+
+    Returns:
+        dict: For each stage, the number of items processed, the number of errors and the time spent.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    stats = {stage["name"]: {"items": 0, "errors": 0, "seconds": 0.0} for stage in stages}
+
+    runners = [_feed(items, queues[0], stages[0]["concurrency"])]
+    for index, stage in enumerate(stages):
+        is_last = index == len(stages) - 1
+        queue_out = None if is_last else queues[index + 1]
+        next_consumers = 0 if is_last else stages[index + 1]["concurrency"]
+        runners.append(_run_stage(stage, queues[index], queue_out, next_consumers, stats[stage["name"]]))
+
+    await asyncio.gather(*runners)
+
+    for name, stage_stats in stats.items():
+        logging.info(f"Pipeline stage {name}: {stage_stats['items']} items, {stage_stats['errors']} errors, {stage_stats['seconds']:.1f}s")
+    return stats
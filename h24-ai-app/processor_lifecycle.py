@@ -0,0 +1,263 @@
+# processor_lifecycle.py
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from functools import partial
+from contextlib import asynccontextmanager
+
+import fitz
+from google.cloud import documentai
+
+from docai_clients import get_client
+from rate_control import get_controller
+
+"""
+Lifecycle of the Document AI processors used by main_file.py: enabling, reference counting and disabling.
+
+Before this module, main_file.main() enabled every processor one by one at start-up (blocking on each
+enable operation) and disabled them one by one at the end. The ProcessorLifecycle:
+
+- loads the processor configuration files (keys/<...>_config.json) once, each one for the processor
+  that registered it (see processor_runtime.register_processor);
+- enables a processor lazily, the first time a page is sent to it, so the processors the routing never
+  needs stay off. The current state is checked first (GetProcessor), an enabled processor is not
+  enabled again, and processors needed at the same time are enabled concurrently (enable_all()
+  enables several processors at once);
+- counts the calls in flight of each processor (use()), so a processor is never disabled while a page
+  of the run is still using it;
+- holds a lease on each processor it keeps enabled, in the job-state database (job_state.py) shared
+  by every main_file.py process, renewed every LEASE_SECONDS / 3 while the run lasts. The counts above
+  only see the pages of one process: the leases are what keeps a processor enabled while another job
+  (a watch-mode daemon and a batch run, two batch runs) is still sending pages to it;
+- optionally sends a warm-up request (a blank page, outside the response cache) right after enabling a
+  processor, so the cold start is not paid by the first real pages. It goes through the rate
+  controller of the processor (counted against its quota) with a WARM_UP_TIMEOUT_SECONDS deadline;
+- releases its lease at the end of the run (close()) or, in watch mode, once the processor has not been
+  used for the idle timeout (monitor()). A processor enabled by a run is disabled by the process that
+  releases its last live lease. Processors that were already enabled before any run are left enabled.
+  Without lease store, only the processors enabled by this process are disabled, when it releases them.
+"""
+
+#Configuration
+WARM_UP = os.environ.get("DOCAI_WARM_UP", "0") == "1"
+WARM_UP_TIMEOUT_SECONDS = float(os.environ.get("DOCAI_WARM_UP_TIMEOUT", 60))  # Deadline of the warm-up request
+IDLE_CHECK_SECONDS = 5  # Interval of the idle check of monitor()
+LEASE_SECONDS = float(os.environ.get("DOCAI_PROCESSOR_LEASE_SECONDS", 300))  # Lease of a process on a processor, renewed every third
+
+
+def load_processor_configs(keys_dir, registry=None):
+    """
+    Loads the processor configuration files of the keys directory, once.
+
+    Args:
+        keys_dir (str): The path to the 'keys' directory.
+        registry (dict, optional): The registered processors (processor_runtime.PROCESSOR_REGISTRY), whose
+            config_path names their configuration file.
+
+    Returns:
+        dict: The configuration of each processor, keyed by processor name. The configuration files that no
+        registered processor claims are keyed by their name without _config.json (external processors).
+    """
+    names = {}
+    for name, entry in (registry or {}).items():
+        if entry.get("config_path"):
+            names[os.path.abspath(entry["config_path"])] = name
+
+    configs = {}
+    for file in sorted(os.listdir(keys_dir)):
+        if file.endswith('_config.json'):
+            config_path = os.path.abspath(os.path.join(keys_dir, file))
+            with open(config_path, 'r') as config_file:
+                configs[names.get(config_path, file[:-len('_config.json')])] = json.load(config_file)
+    return configs
+
+
+def get_processor_state(config):
+    """
+    Returns the state of a processor (e.g. "ENABLED", "DISABLED"), None if it cannot be read.
+
+    Args:
+        config (dict): The processor configuration (PROJECT_ID, LOCATION, PROCESSOR_ID).
+    """
+    client = get_client(config['LOCATION'])
+    name = client.processor_path(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'])
+    try:
+        return client.get_processor(name=name).state.name
+    except Exception as e:
+        logging.warning(f"Could not read the state of processor {config['PROCESSOR_ID']}: {e}")
+        return None
+
+
+def blank_page_pdf():
+    """Returns a blank single-page PDF, used as warm-up request."""
+    with fitz.open() as pdf:
+        pdf.new_page()
+        return pdf.tobytes()
+
+
+def warm_up_processor(config):
+    """
+    Sends a blank page to a processor, so its cold start is not paid by the first real request.
+    The request is counted against the processor quota (single attempt, WARM_UP_TIMEOUT_SECONDS deadline).
+    The response is not cached and errors are only logged.
+
+    Args:
+        config (dict): The processor configuration.
+    """
+    client = get_client(config['LOCATION'])
+    if config.get('PROCESSOR_VERSION'):
+        name = client.processor_version_path(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], config['PROCESSOR_VERSION'])
+    else:
+        name = client.processor_path(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'])
+    request = documentai.ProcessRequest(name=name, raw_document=documentai.RawDocument(content=blank_page_pdf(), mime_type='application/pdf'))
+    controller = get_controller(config['PROCESSOR_ID'], config)
+    start = time.perf_counter()
+    try:
+        controller.call(lambda: client.process_document(request=request, retry=None, timeout=WARM_UP_TIMEOUT_SECONDS), max_attempts=1)
+        logging.info(f"Processor {config['PROCESSOR_ID']} warmed up in {time.perf_counter() - start:.1f}s.")
+    except Exception as e:
+        logging.warning(f"Warm-up request of processor {config['PROCESSOR_ID']} failed: {e}")
+
+
+class ProcessorLifecycle:
+    """
+    Lazy, reference-counted enabling and disabling of the processors.
+
+    Args:
+        processor_configs (dict): The configuration of each processor (see load_processor_configs).
+        enable (callable): Enables a processor, receives (project_id, location, processor_id) and blocks until done.
+        disable (callable): Disables a processor, receives (project_id, location, processor_id) and blocks until done.
+        warm_up (bool): Send a warm-up request to each processor after enabling it.
+        leases (JobStateStore, optional): The store of the processor leases shared with the other processes.
+    """
+
+    def __init__(self, processor_configs, enable, disable, warm_up=WARM_UP, leases=None):
+        self.enable = enable
+        self.disable = disable
+        self.warm_up = warm_up
+        self.leases = leases
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processors = {
+            name: {"config": config, "enabled": False, "owned": False, "references": 0, "last_used": 0.0, "lock": asyncio.Lock()}
+            for name, config in processor_configs.items()
+        }
+        self.stats = {"enabled": 0, "already_enabled": 0, "disabled": 0, "left_enabled": 0, "warm_ups": 0}
+        self._heartbeat = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+    @staticmethod
+    def _lease_name(config):
+        return f"{config['PROJECT_ID']}/{config['LOCATION']}/{config['PROCESSOR_ID']}"
+
+    async def _renew_leases(self):
+        # Heartbeat of the leases of the enabled processors, until close()
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            leases = [(self._lease_name(processor["config"]), f"{self.holder}/{name}")
+                      for name, processor in self.processors.items() if processor["enabled"]]
+            if leases:
+                await self._run(self.leases.renew_leases, leases, LEASE_SECONDS)
+
+    async def _ensure_enabled(self, name):
+        processor = self.processors[name]
+        async with processor["lock"]:
+            if processor["enabled"]:
+                return
+            config = processor["config"]
+            if self.leases is not None:
+                # The lease is taken before the state is read, so a job releasing its own lease meanwhile sees it
+                await self._run(self.leases.acquire_lease, self._lease_name(config), f"{self.holder}/{name}", LEASE_SECONDS)
+                if self._heartbeat is None:
+                    self._heartbeat = asyncio.ensure_future(self._renew_leases())
+            if await self._run(get_processor_state, config) == "ENABLED":
+                # Enabled before the run (or by another job): without lease store, it is left enabled at the end
+                self.stats["already_enabled"] += 1
+                logging.info(f"Processor {config['PROCESSOR_ID']} ({name}) is already enabled.")
+            else:
+                await self._run(self.enable, config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'])
+                processor["owned"] = True
+                if self.leases is not None:
+                    await self._run(self.leases.mark_enabled, self._lease_name(config), self.holder)
+                self.stats["enabled"] += 1
+                logging.info(f"Processor {config['PROCESSOR_ID']} ({name}) has been enabled.")
+                if self.warm_up:
+                    await self._run(warm_up_processor, config)
+                    self.stats["warm_ups"] += 1
+            processor["enabled"] = True
+
+    async def enable_all(self, names=None):
+        """
+        Enables several processors concurrently.
+
+        Args:
+            names (list, optional): The processor names, every configured processor if None.
+        """
+        names = [name for name in (names or self.processors) if name in self.processors]
+        await asyncio.gather(*(self._ensure_enabled(name) for name in names))
+
+    @asynccontextmanager
+    async def use(self, name):
+        """
+        Holds a processor enabled while a page is sent to it; the processor is enabled on first use.
+        Processors without configuration file (local or external processors) are passed through.
+
+        Args:
+            name (str): The name of the processor.
+        """
+        processor = self.processors.get(name)
+        if processor is None:
+            yield
+            return
+
+        processor["references"] += 1
+        try:
+            await self._ensure_enabled(name)
+            yield
+        finally:
+            processor["references"] -= 1
+            processor["last_used"] = time.monotonic()
+
+    async def _disable(self, name, idle_timeout=None):
+        processor = self.processors[name]
+        async with processor["lock"]:
+            if not processor["enabled"] or processor["references"]:
+                return
+            if idle_timeout is not None and time.monotonic() - processor["last_used"] < idle_timeout:
+                return
+            processor["enabled"] = False
+            config = processor["config"]
+            disable = processor["owned"]
+            processor["owned"] = False
+            if self.leases is not None:
+                # Disabled by the last process releasing its lease, whichever process enabled it
+                disable = await self._run(self.leases.release_lease, self._lease_name(config), f"{self.holder}/{name}")
+                if not disable:
+                    self.stats["left_enabled"] += 1
+                    logging.info(f"Processor {config['PROCESSOR_ID']} ({name}) released, left enabled for the other jobs.")
+            if disable:
+                await self._run(self.disable, config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'])
+                self.stats["disabled"] += 1
+                logging.info(f"Processor {config['PROCESSOR_ID']} ({name}) has been disabled.")
+
+    async def disable_idle(self, idle_timeout):
+        """Disables the processors that are not in use and were not used for idle_timeout seconds."""
+        await asyncio.gather(*(self._disable(name, idle_timeout) for name in self.processors))
+
+    async def monitor(self, idle_timeout):
+        """Disables the idle processors every IDLE_CHECK_SECONDS (runs until cancelled)."""
+        while True:
+            await asyncio.sleep(min(idle_timeout, IDLE_CHECK_SECONDS))
+            await self.disable_idle(idle_timeout)
+
+    async def close(self):
+        """Releases, concurrently, the processors that are not in use, and disables those no other job holds."""
+        await asyncio.gather(*(self._disable(name) for name in self.processors))
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
@@ -0,0 +1,143 @@
+# processor_routing.py
+import os
+import json
+import logging
+import threading
+
+"""
+Category-driven routing of the pages to the extractors, used by main_file.py.
+
+The category predicted by the classifier processor (ml_cat_prediction, e.g. terapiaOcupacional) on
+the first page of a document decides which extractors are worth calling on the pages of that
+document. The routing table is stored in keys/processor_routing.json:
+
+    {
+        "classifier": "ml_cat_prediction",
+        "min_confidence": 0.5,
+        "speculative": true,
+        "default": {"processors": ["ml_key_value_pair_ext", "ml_tabular_ext"]},
+        "categories": {
+            "terapiaOcupacional": {"processors": ["ml_key_value_pair_ext", "ml_tabular_ext"], "min_confidence": 0.8}
+        }
+    }
+
+- categories: the processors of each category, and optionally its own min_confidence.
+- default: the route of the categories missing from the table, of the predictions below min_confidence
+  and of the documents whose classification failed. A route without "processors" allows every processor.
+- speculative: the likely extractors are started while the classification is in flight, instead of
+  waiting for it. A processor is likely when the categories seen so far in the run route to it at least
+  SPECULATION_THRESHOLD of the time (before the first prediction, when the default route allows it).
+  When the category rules it out, the call is cancelled: it never starts if it is still waiting for a
+  thread, otherwise its response is discarded.
+
+Processors allowed by every route are always started at once. Without a routing file every page is sent
+to every processor, as before. ProcessorRouter.stats counts the speculative, cancelled and skipped calls.
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+ROUTING_PATH = os.environ.get("DOCAI_ROUTING_PATH", os.path.join(script_dir, 'keys', 'processor_routing.json'))
+DEFAULT_CLASSIFIER = "ml_cat_prediction"
+SPECULATION_THRESHOLD = 0.5  # Minimum share of the documents routed to a processor to start it speculatively
+
+
+class ProcessorRouter:
+    """
+    Routing table of the extractors, with the category history used to decide the speculative calls.
+
+    Args:
+        table (dict): The routing table (see the module docstring).
+    """
+
+    def __init__(self, table):
+        self.classifier = table.get("classifier", DEFAULT_CLASSIFIER)
+        self.min_confidence = float(table.get("min_confidence", 0))
+        self.speculative = bool(table.get("speculative", True))
+        self.default = table.get("default", {})
+        self.categories = table.get("categories", {})
+        self.category_counts = {}
+        self.stats = {"routed_documents": 0, "speculative_calls": 0, "cancelled_calls": 0, "skipped_calls": 0}
+        self._lock = threading.Lock()
+
+    def route(self, prediction):
+        """
+        Returns the route of a document.
+
+        Args:
+            prediction (dict): The classifier output (category_prediction and confidence), None if the
+                classification failed or did not run.
+
+        Returns:
+            dict: The category used ("default" when the default route applies) and its route.
+        """
+        category = "default"
+        route = self.default
+        if prediction:
+            predicted = prediction.get("category_prediction")
+            confidence = prediction.get("confidence") or 0
+            candidate = self.categories.get(predicted)
+            if candidate is not None and confidence >= float(candidate.get("min_confidence", self.min_confidence)):
+                category = predicted
+                route = candidate
+
+        with self._lock:
+            self.category_counts[category] = self.category_counts.get(category, 0) + 1
+            self.stats["routed_documents"] += 1
+        return {"category": category, "route": route}
+
+    @staticmethod
+    def allows(route, processor_name):
+        """Returns whether a route (a value returned by route()) sends the pages to a processor."""
+        processors = route["route"].get("processors")
+        return processors is None or processor_name in processors
+
+    def always_allowed(self, processor_name):
+        """Returns whether every route of the table sends the pages to a processor."""
+        routes = [self.default] + list(self.categories.values())
+        return all(route.get("processors") is None or processor_name in route["processors"] for route in routes)
+
+    def is_likely(self, processor_name):
+        """
+        Returns whether a processor should be started before the category is known.
+
+        Args:
+            processor_name (str): The name of the extractor.
+        """
+        if self.always_allowed(processor_name):
+            return True
+        if not self.speculative:
+            return False
+
+        with self._lock:
+            counts = dict(self.category_counts)
+        total = sum(counts.values())
+        if not total:
+            return self.allows({"route": self.default}, processor_name)
+
+        routed = sum(count for category, count in counts.items()
+                     if self.allows({"route": self.categories.get(category, self.default)}, processor_name))
+        return routed / total >= SPECULATION_THRESHOLD
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+
+def load_router(routing_path=ROUTING_PATH):
+    """
+    Loads the routing table.
+
+    Args:
+        routing_path (str): The path to the routing JSON file.
+
+    Returns:
+        ProcessorRouter: The router; without a routing file, every page is sent to every processor.
+    """
+    if not os.path.exists(routing_path):
+        logging.info(f"No routing table found in {routing_path}, pages are sent to every processor.")
+        return ProcessorRouter({})
+
+    with open(routing_path, 'r') as routing_file:
+        table = json.load(routing_file)
+    logging.info(f"Routing table loaded from {routing_path} ({len(table.get('categories', {}))} categories).")
+    return ProcessorRouter(table)
@@ -0,0 +1,235 @@
+# processor_runtime.py
+import os
+import sys
+import logging
+import importlib.util
+
+"""
+In-process runtime for the scripts stored in the 'processors' directory.
+
+Before this module, main_file.py started a new Python interpreter for every processor and every page
+(`python processors/<name>.py <page>`), paying the interpreter start-up, the `google.cloud.documentai`
+import and the configuration loading each time, and reading the result back as JSON from stdout.
+
+Each processor script now registers itself when it is imported:
+
+    register_processor("ml_cat_prediction", process=process_page, analyze=build_output, fetch=fetch_document, config_path=CONFIG_PATH)
+
+- process(page_bytes, file_name) -> dict: sends the page to Document AI and returns the processor output.
+- analyze(document, file_name) -> dict: builds the processor output from an already processed document.
+- fetch(page_bytes) -> documentai.Document: only sends the page to Document AI. With fetch and analyze,
+  main_file.py runs the network round trip and the local post-processing in separate pipeline stages.
+- config_path: the processor configuration file (keys/<...>_config.json), used to enable and disable
+  the Document AI processor (see processor_lifecycle.py).
+
+A script can also register a local page classifier, which is not sent any page to process but tells
+main_file.py the type of every page (see processors/ml_page_classifier.py):
+
+    register_page_classifier("ml_page_classifier", classify=classify_pages)
+
+- classify(pdf_contents) -> list: receives the bytes of the single-page PDFs and returns one
+  {"page_type", "confidence"} dict per page.
+
+The processor modules are imported only once by load_processors(), so their imports, configuration
+files and clients stay loaded for the whole run and every call returns a Python dict directly.
+The scripts keep their command line entry point (python processors/<name>.py <path_to_pdf_document>).
+"""
+
+# Registered processors, keyed by processor name
+PROCESSOR_REGISTRY = {}
+# Registered page classifiers, keyed by classifier name
+PAGE_CLASSIFIERS = {}
+
+
+def register_processor(name, process, analyze=None, fetch=None, config_path=None):
+    """
+    Registers a processor callable in the runtime.
+
+    Args:
+        name (str): The name of the processor, used as key in the merged output.
+        process (callable): Function receiving (page_bytes, file_name) and returning a dict.
+        analyze (callable, optional): Function receiving (document, file_name) and returning a dict.
+        fetch (callable, optional): Function receiving page_bytes and returning the processed document.
+        config_path (str, optional): The path to the processor configuration file.
+    """
+    PROCESSOR_REGISTRY[name] = {
+        "name": name,
+        "process": process,
+        "analyze": analyze,
+        "fetch": fetch,
+        "config_path": config_path,
+    }
+
+
+def register_page_classifier(name, classify):
+    """
+    Registers a local page classifier in the runtime.
+
+    Args:
+        name (str): The name of the classifier, used as key in the merged output.
+        classify (callable): Function receiving a list of PDF bytes and returning a dict per page.
+    """
+    PAGE_CLASSIFIERS[name] = {
+        "name": name,
+        "classify": classify,
+    }
+
+
+def load_processor_module(script_path):
+    """
+    Imports a processor script once and returns the module object.
+
+    Args:
+        script_path (str): The path to the processor script.
+
+    Returns:
+        module: The imported module.
+    """
+    module_name = os.path.splitext(os.path.basename(script_path))[0]
+    # Keep a single instance of each processor module, whoever imports it first
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def load_processors(processors_dir):
+    """
+    Imports every processor script of the directory and splits them between registered
+    (in-process) processors and scripts that must still be executed as external processes.
+
+    Empty scripts (processors not implemented yet) and page classifiers are not returned.
+
+    Args:
+        processors_dir (str): The path to the 'processors' directory.
+
+    Returns:
+        tuple: A list with the registered processor names and a list with the paths of the
+        scripts that did not register any processor.
+    """
+    # The processor scripts import the shared modules stored next to main_file.py
+    app_dir = os.path.dirname(os.path.abspath(processors_dir))
+    if app_dir not in sys.path:
+        sys.path.insert(0, app_dir)
+
+    in_process = []
+    external = []
+
+    for file in sorted(os.listdir(processors_dir)):
+        if not file.endswith('.py'):
+            continue
+        script_path = os.path.join(processors_dir, file)
+        if os.path.getsize(script_path) == 0:
+            logging.info(f"Skipping empty processor script {file}.")
+            continue
+
+        registered_before = set(PROCESSOR_REGISTRY)
+        classifiers_before = set(PAGE_CLASSIFIERS)
+        try:
+            load_processor_module(script_path)
+        except Exception as e:
+            logging.error(f"Error loading processor {file}, it will run as an external process: {e}")
+            external.append(script_path)
+            continue
+
+        registered = [name for name in PROCESSOR_REGISTRY if name not in registered_before]
+        if registered:
+            in_process.extend(registered)
+        elif set(PAGE_CLASSIFIERS) - classifiers_before:
+            logging.info(f"Page classifier {file} loaded.")
+        else:
+            external.append(script_path)
+
+    return in_process, external
+
+
+def run_processor(name, page_bytes, file_name):
+    """
+    Calls a registered processor with the bytes of a page.
+
+    Args:
+        name (str): The name of the registered processor.
+        page_bytes (bytes): The content of the PDF page.
+        file_name (str): The name reported in the processor output.
+
+    Returns:
+        dict: The processor output, or None if the processor failed.
+    """
+    try:
+        return PROCESSOR_REGISTRY[name]["process"](page_bytes, file_name)
+    except Exception as e:
+        logging.error(f"Error executing processor {name} for {file_name}: {e}")
+        return None
+
+
+def run_fetch(name, page_bytes, file_name):
+    """
+    Sends a page to the processor and returns the processed document, without post-processing it.
+    Processors registered without fetch/analyze callables return their full output instead.
+
+    Args:
+        name (str): The name of the registered processor.
+        page_bytes (bytes): The content of the PDF page.
+        file_name (str): The name reported in the processor output.
+
+    Returns:
+        documentai.Document or dict: The processed document (or processor output), None if the processor failed.
+    """
+    entry = PROCESSOR_REGISTRY[name]
+    if entry["fetch"] is None or entry["analyze"] is None:
+        return run_processor(name, page_bytes, file_name)
+    try:
+        return entry["fetch"](page_bytes)
+    except Exception as e:
+        logging.error(f"Error executing processor {name} for {file_name}: {e}")
+        return None
+
+
+def run_analyze(name, response, file_name):
+    """
+    Builds the processor output from the response returned by run_fetch().
+
+    Args:
+        name (str): The name of the registered processor.
+        response (documentai.Document or dict): The value returned by run_fetch().
+        file_name (str): The name reported in the processor output.
+
+    Returns:
+        dict: The processor output, or None if the processor failed.
+    """
+    if response is None or isinstance(response, dict):
+        return response
+    try:
+        return PROCESSOR_REGISTRY[name]["analyze"](response, file_name)
+    except Exception as e:
+        logging.error(f"Error analyzing the {name} response for {file_name}: {e}")
+        return None
+
+
+def classify_pages(pages):
+    """
+    Classifies pages with the registered page classifier.
+
+    Args:
+        pages (list): The (page_name, page_bytes) tuples of a file.
+
+    Returns:
+        tuple: The name of the classifier and the classification of each page, in order. Both are
+        None when no classifier is registered or the classifier failed.
+    """
+    if not PAGE_CLASSIFIERS or not pages:
+        return None, None
+    classifier = next(iter(PAGE_CLASSIFIERS.values()))
+    try:
+        return classifier["name"], classifier["classify"]([page_bytes for _, page_bytes in pages])
+    except Exception as e:
+        logging.error(f"Error classifying the pages of {pages[0][0]} with {classifier['name']}: {e}")
+        return None, None
@@ -6,6 +6,13 @@ import os
 import logging
 from google.api_core.exceptions import GoogleAPICallError, RetryError
 
+# The shared runtime modules are stored next to main_file.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from processor_runtime import register_processor
+from docai_clients import get_client
+from response_cache import cached_process
+from rate_control import get_controller
+
 """
 A script for processing PDF documents using Google Cloud Document AI to predict categories.
 
@@ -44,7 +51,10 @@ parent_dir = os.path.dirname(script_dir)
 TEMP_FOLDER = os.path.join(parent_dir, 'temp') 
 KEYS_FILE_PATH = os.path.join(parent_dir, 'keys', 'credentials.json')
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = KEYS_FILE_PATH 
+CONFIG_PATH = os.path.join(parent_dir, 'keys', 'ml_cat_prediction_config.json')
 
+# Configuration loaded once per process, see get_config()
+_config = None
 
 def load_config(file_path):
     """
@@ -59,7 +69,16 @@ def load_config(file_path):
     with open(file_path, 'r') as config_file:
         return json.load(config_file)
 
-def online_process(project_id, location, processor_id, file_path, mime_type):
+def get_config():
+    """
+    Returns the processor configuration, loading it from CONFIG_PATH only on the first call.
+    """
+    global _config
+    if _config is None:
+        _config = load_config(CONFIG_PATH)
+    return _config
+
+def online_process(project_id, location, processor_id, file_content, mime_type, processor_version=None):
     """
     Sends the document to Google Cloud Document AI for processing.
     
@@ -67,24 +86,32 @@ def online_process(project_id, location, processor_id, file_path, mime_type):
         project_id (str): The Google Cloud project ID.
         location (str): The location of the Document AI processor.
         processor_id (str): The ID of the Document AI processor.
-        file_path (str): The path to the PDF file to be processed.
+        file_content (bytes): The content of the PDF file to be processed.
         mime_type (str): The MIME type of the document.
+        processor_version (str, optional): The processor version to use, the default version if None.
         
     Returns:
         documentai.Document: The processed document object.
     """
-    client_options = {"api_endpoint": f"{location}-documentai.googleapis.com"}
-    client = documentai.DocumentProcessorServiceClient(client_options=client_options)
-    resource_name = client.processor_path(project_id, location, processor_id)
-    
-    with open(file_path, "rb") as f:
-        file_content = f.read()
-    
-    raw_document = documentai.RawDocument(content=file_content, mime_type=mime_type)
-    request = documentai.ProcessRequest(name=resource_name, raw_document=raw_document)
+    def send_request():
+        # Shared client of the endpoint, the gRPC channel is reused between requests
+        client = get_client(location)
+        if processor_version:
+            resource_name = client.processor_version_path(project_id, location, processor_id, processor_version)
+        else:
+            resource_name = client.processor_path(project_id, location, processor_id)
+        
+        raw_document = documentai.RawDocument(content=file_content, mime_type=mime_type)
+        request = documentai.ProcessRequest(name=resource_name, raw_document=raw_document)
+        
+        # Quota, concurrency and retries of the processor (see rate_control.py),
+        # the client retries are disabled so failed requests are not retried twice
+        controller = get_controller(processor_id, get_config())
+        result = controller.call(lambda: client.process_document(request=request, retry=None), request_bytes=len(file_content))
+        return result.document
     
-    result = client.process_document(request=request)
-    return result.document
+    # Responses are cached by page content, processor ID and version (see response_cache.py)
+    return cached_process(file_content, processor_id, processor_version, send_request)
 
 def analyze_result(document):
     """
@@ -108,6 +135,49 @@ def analyze_result(document):
     
     return category, confidence
 
+def build_output(document, file_name):
+    """
+    Builds the processor output from the processed document.
+
+    Args:
+        document (documentai.Document): The document object returned by Document AI.
+        file_name (str): The name of the processed file.
+
+    Returns:
+        dict: The category prediction and its confidence.
+    """
+    category, confidence = analyze_result(document)
+
+    return {
+        "processor": "ml_cat_prediction",
+        "file_name": file_name,
+        "category_prediction": category,
+        "confidence": confidence
+    }
+
+def fetch_document(page_bytes):
+    """
+    Sends a PDF page to the processor configured in CONFIG_PATH and returns the processed document.
+    """
+    config = get_config()
+    return online_process(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], page_bytes, MIME_TYPE, config.get('PROCESSOR_VERSION'))
+
+def process_page(page_bytes, file_name):
+    """
+    Sends a PDF page to the processor and returns the category prediction.
+    Used by the processor runtime when the page is processed in a single step.
+
+    Args:
+        page_bytes (bytes): The content of the PDF page.
+        file_name (str): The name of the processed file.
+
+    Returns:
+        dict: The category prediction and its confidence.
+    """
+    return build_output(fetch_document(page_bytes), file_name)
+
+register_processor("ml_cat_prediction", process=process_page, analyze=build_output, fetch=fetch_document, config_path=CONFIG_PATH)
+
 if __name__ == "__main__":
     """ 
     Main function to run the script.
@@ -115,20 +185,11 @@ if __name__ == "__main__":
     
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-
-    # Navigate to the parent directory of the current directory to then access the 'keys' folder
-    parent_dir = os.path.dirname(current_dir)
-    keys_dir = os.path.join(parent_dir, 'keys') # This now correctly points to h24_ai_app/keys
-
-    # Constructs the path to the configuration file located inside the 'keys' folder
-    config_path = os.path.join(keys_dir, 'ml_cat_prediction_config.json')
-    
     # Load the configuration
     try:
-        config = load_config(config_path)
+        config = get_config()
     except FileNotFoundError:
-        logging.error(f"Configuration file not found in {config_path}")
+        logging.error(f"Configuration file not found in {CONFIG_PATH}")
         sys.exit(1)
     
     if len(sys.argv) < 2:
@@ -138,8 +199,11 @@ if __name__ == "__main__":
     file_path = sys.argv[1]
     file_name = os.path.basename(file_path)
     
+    with open(file_path, "rb") as f:
+        file_content = f.read()
+    
     try:
-        document = online_process(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], file_path, MIME_TYPE)
+        document = online_process(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], file_content, MIME_TYPE, config.get('PROCESSOR_VERSION'))
     except GoogleAPICallError as e:
         logging.error(f"API call failed: {e.message}")
         sys.exit(1)
@@ -150,14 +214,7 @@ if __name__ == "__main__":
         logging.error(f"An unexpected error occurred: {e}")
         sys.exit(1)
     
-    category, confidence = analyze_result(document)
-    
-    category_data = {
-        "processor": "ml_cat_prediction",
-        "file_name": os.path.basename(file_path),
-        "category_prediction": category,
-        "confidence": confidence
-    }   
+    category_data = build_output(document, file_name)
     
     # Write the results to a JSON format
     # Convert document_data to a JSON string
@@ -167,5 +224,3 @@ if __name__ == "__main__":
     print(json_category_data)
     
     logging.info("Category prediction results processed.")
-
-
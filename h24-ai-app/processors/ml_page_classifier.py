@@ -0,0 +1,352 @@
+# ml_page_classifier.py
+import sys
+import os
+import re
+import csv
+import json
+import logging
+import unicodedata
+
+import fitz
+import numpy as np
+
+# The shared runtime modules are stored next to main_file.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from processor_runtime import register_page_classifier
+
+"""
+A local, CPU-only page classifier used to decide which pages are sent to the cloud extractors.
+
+Only attendance pages (presentismo) are worth sending to ml_tabular_ext and ml_key_value_pair_ext; the
+daily evolution (evol_diaria) and vital signs (signos_vitales) pages of a file are not. This script
+classifies every page locally, without any Document AI call:
+
+1. Features: a low-resolution grayscale thumbnail of the page (THUMBNAIL_SHAPE) and the counts of
+   the keywords of each page type found in the PDF text layer, when the page has one.
+2. Model: a nearest-centroid classifier over the standardized features, trained from the labeled pages
+   listed in h24_ml_model/ml_model - page_classifier/segmented_data and stored in MODEL_PATH.
+   The pages of a file are classified together with a single matrix product (batched inference).
+3. Without a trained model, the keyword counts of the text layer decide: the page type with the most
+   keywords, when it has strictly more than every other type (a single keyword is enough), with the
+   share of the keywords found as confidence. Pages that cannot be classified (no keyword, a tie, or a
+   model confidence below MIN_CONFIDENCE) are labeled "unknown", and main_file.py sends them to every
+   processor, so no attendance page is lost.
+
+Usage:
+    python ml_page_classifier.py <path_to_pdf_document>
+    python ml_page_classifier.py train <path_to_labeled_pdf_folder>
+    python ml_page_classifier.py check
+
+The labeled folder contains one subfolder per page type (presentismo, evol_diaria, signos_vitales)
+with the PDF files listed in the segmented_data CSV files.
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+
+MODEL_PATH = os.path.join(parent_dir, 'models', 'ml_page_classifier.npz')
+TRAINING_LISTS_DIR = os.path.join(os.path.dirname(parent_dir), 'h24_ml_model', 'ml_model - page_classifier', 'segmented_data')
+
+ATTENDANCE_LABEL = "presentismo"
+UNKNOWN_LABEL = "unknown"
+MIN_CONFIDENCE = 0.6  # Below this confidence the page is labeled UNKNOWN_LABEL
+THUMBNAIL_SHAPE = (32, 24)  # Height x width of the page thumbnails, in pixels
+TEXT_FEATURE_WEIGHT = 4.0  # Weight of the keyword features against the thumbnail pixels
+MIN_FEATURE_SCALE = 0.05  # Lower bound of the standard deviation used to standardize each feature
+
+# Keywords of each page type, compared without accents and in lowercase
+PAGE_KEYWORDS = {
+    "presentismo": ["presentismo", "p r e s e n t i s m o", "asistencia", "firma del paciente", "conformidad"],
+    "evol_diaria": ["evolucion", "evolucion diaria", "evol. diaria", "observaciones"],
+    "signos_vitales": ["signos vitales", "tension arterial", "frecuencia cardiaca", "temperatura", "saturacion"],
+}
+
+# Model loaded once per process, see get_model()
+_model = None
+
+
+def normalize_text(text):
+    """Lowercases the text and removes accents and repeated whitespace."""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'\s+', ' ', text.lower())
+
+
+def keyword_counts(text):
+    """
+    Counts the keywords of each page type in the text layer of a page.
+
+    Returns:
+        np.ndarray: One count per page type of PAGE_KEYWORDS.
+    """
+    text = normalize_text(text)
+    return np.array([sum(text.count(keyword) for keyword in keywords) for keywords in PAGE_KEYWORDS.values()], dtype=np.float32)
+
+
+def page_thumbnail(page):
+    """
+    Renders a page as a small grayscale thumbnail.
+
+    Args:
+        page (fitz.Page): The page to render.
+
+    Returns:
+        np.ndarray: The THUMBNAIL_SHAPE pixels, flattened and scaled to [0, 1].
+    """
+    height, width = THUMBNAIL_SHAPE
+    matrix = fitz.Matrix(width / page.rect.width, height / page.rect.height)
+    pixmap = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+    pixels = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+
+    # Rounding may give one pixel more or less than requested: pad with white or crop
+    thumbnail = np.full(THUMBNAIL_SHAPE, 255, dtype=np.uint8)
+    rows = min(height, pixels.shape[0])
+    cols = min(width, pixels.shape[1])
+    thumbnail[:rows, :cols] = pixels[:rows, :cols]
+    return thumbnail.reshape(-1).astype(np.float32) / 255
+
+
+def extract_features(pdf_contents):
+    """
+    Builds the feature matrix of a list of PDF pages.
+
+    Args:
+        pdf_contents (List[bytes]): The content of each PDF; every page of each PDF is a row.
+
+    Returns:
+        tuple: The feature matrix (pages x features) and the keyword counts (pages x page types).
+    """
+    thumbnails = []
+    counts = []
+    for content in pdf_contents:
+        with fitz.open(stream=content, filetype='pdf') as pdf:
+            for page in pdf:
+                thumbnails.append(page_thumbnail(page))
+                counts.append(keyword_counts(page.get_text()))
+
+    if not thumbnails:
+        return np.empty((0, 0), dtype=np.float32), np.empty((0, len(PAGE_KEYWORDS)), dtype=np.float32)
+
+    counts = np.vstack(counts)
+    features = np.hstack([np.vstack(thumbnails), np.log1p(counts) * TEXT_FEATURE_WEIGHT])
+    return features, counts
+
+
+def train_model(features, labels):
+    """
+    Fits the nearest-centroid classifier.
+
+    Args:
+        features (np.ndarray): The feature matrix of the labeled pages.
+        labels (List[str]): The page type of each row.
+
+    Returns:
+        dict: The classes, their centroids and the feature scale.
+    """
+    labels = np.asarray(labels)
+    classes = np.unique(labels)
+    # Features that barely vary in the training pages must not dominate the distances
+    scale = np.maximum(features.std(axis=0), MIN_FEATURE_SCALE)
+    centroids = np.vstack([(features[labels == label] / scale).mean(axis=0) for label in classes])
+    return {"classes": classes, "centroids": centroids.astype(np.float32), "scale": scale.astype(np.float32)}
+
+
+def get_model():
+    """Returns the trained model, loading it from MODEL_PATH only on the first call (None if not trained)."""
+    global _model
+    if _model is None and os.path.exists(MODEL_PATH):
+        with np.load(MODEL_PATH) as data:
+            _model = {key: data[key] for key in data.files}
+        logging.info(f"Page classifier model loaded from {MODEL_PATH}.")
+    return _model
+
+
+def predict(features, counts, model):
+    """
+    Classifies the rows of a feature matrix.
+
+    Args:
+        features (np.ndarray): The feature matrix (pages x features).
+        counts (np.ndarray): The keyword counts (pages x page types).
+        model (dict): The trained model, or None to use only the keyword counts.
+
+    Returns:
+        tuple: The label and the confidence of each page.
+    """
+    if model is None:
+        return predict_keywords(counts)
+
+    scaled = features.astype(np.float64) / model["scale"]
+    centroids = model["centroids"].astype(np.float64)
+    # Squared distances of every page to every centroid, in a single matrix product
+    distances = (scaled ** 2).sum(axis=1)[:, None] - 2 * scaled @ centroids.T + (centroids ** 2).sum(axis=1)[None, :]
+    # Log-likelihood of a unit-variance Gaussian around each centroid
+    scores = -0.5 * distances
+    scores = scores - scores.max(axis=1, keepdims=True)
+    probabilities = np.exp(scores)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    best = probabilities.argmax(axis=1)
+    confidences = probabilities[np.arange(len(best)), best]
+
+    labels = np.where(confidences >= MIN_CONFIDENCE, model["classes"][best], UNKNOWN_LABEL)
+    return labels.tolist(), confidences.tolist()
+
+
+def predict_keywords(counts):
+    """
+    Classifies pages by the keywords of their text layer, without a trained model.
+
+    A softmax over the raw counts would put a page with a single keyword below MIN_CONFIDENCE, so the
+    rules decide on their own: the page type with the most keywords wins when no other type has as many.
+
+    Args:
+        counts (np.ndarray): The keyword counts (pages x page types).
+
+    Returns:
+        tuple: The label and the confidence (the share of the keywords found) of each page.
+    """
+    classes = np.array(list(PAGE_KEYWORDS))
+    best = counts.argmax(axis=1)
+    best_counts = counts[np.arange(len(best)), best]
+    totals = counts.sum(axis=1)
+    confidences = np.divide(best_counts, totals, out=np.zeros(len(best)), where=totals > 0)
+
+    # Pages without any keyword (e.g. scans without a text layer) or with a tie cannot be classified by the rules
+    strict = (counts == best_counts[:, None]).sum(axis=1) == 1
+    labels = np.where((best_counts > 0) & strict, classes[best], UNKNOWN_LABEL)
+    return labels.tolist(), confidences.tolist()
+
+
+def check_keyword_rules():
+    """
+    Checks that the rules label the pages of a single keyword with its page type, and the pages
+    without keyword or with a tie as unknown.
+
+    Returns:
+        List[str]: The failed cases, empty when the rules are right.
+    """
+    cases = [(keyword, page_type) for page_type, keywords in PAGE_KEYWORDS.items() for keyword in keywords]
+    cases += [("", UNKNOWN_LABEL), ("presentismo evolucion", UNKNOWN_LABEL), ("asistencia asistencia temperatura", ATTENDANCE_LABEL)]
+    failed = []
+    for text, expected in cases:
+        with fitz.open() as pdf:
+            page = pdf.new_page()
+            if text:
+                page.insert_text((72, 72), text.upper())
+            _, counts = extract_features([pdf.tobytes()])
+        (label,), _ = predict_keywords(counts)
+        if label != expected:
+            failed.append(f"'{text}': {label}, expected {expected}")
+    return failed
+
+
+def classify_pages(pdf_contents):
+    """
+    Classifies PDF pages locally. This is the callable used by main_file.py through the processor runtime.
+
+    Args:
+        pdf_contents (List[bytes]): The content of each single-page PDF.
+
+    Returns:
+        List[dict]: The page type and the confidence of each page, in order.
+    """
+    features, counts = extract_features(pdf_contents)
+    if not len(features):
+        return []
+    labels, confidences = predict(features, counts, get_model())
+    return [{"page_type": label, "confidence": confidence} for label, confidence in zip(labels, confidences)]
+
+
+def load_training_lists(lists_dir):
+    """
+    Reads the labeled page lists of the segmented_data folder.
+
+    Returns:
+        List[Tuple[str, str]]: The file name and the page type of each labeled page.
+    """
+    labeled_pages = []
+    for root, _, files in os.walk(lists_dir):
+        for file in files:
+            if not file.endswith('.csv'):
+                continue
+            with open(os.path.join(root, file), newline='', encoding='utf-8') as csv_file:
+                for row in csv.DictReader(csv_file):
+                    labeled_pages.append((row['File Name'], row['Folder Name']))
+    return labeled_pages
+
+
+def train(pdf_root):
+    """
+    Trains the classifier with the labeled pages found in pdf_root and saves it in MODEL_PATH.
+
+    Args:
+        pdf_root (str): Folder with one subfolder per page type containing the labeled PDF files.
+    """
+    contents = []
+    labels = []
+    for file_name, label in load_training_lists(TRAINING_LISTS_DIR):
+        for path in (os.path.join(pdf_root, label, file_name), os.path.join(pdf_root, file_name)):
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    contents.append(f.read())
+                labels.append(label)
+                break
+        else:
+            logging.warning(f"Labeled page {file_name} not found in {pdf_root}.")
+
+    if not contents:
+        logging.error("No labeled pages found, the model was not trained.")
+        sys.exit(1)
+
+    # Only the first page of each labeled file is used, the files are single pages
+    features = []
+    for content in contents:
+        page_features, _ = extract_features([content])
+        features.append(page_features[0])
+    model = train_model(np.vstack(features), labels)
+
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    np.savez(MODEL_PATH, **model)
+    logging.info(f"Page classifier trained with {len(labels)} pages ({', '.join(model['classes'])}) and saved to {MODEL_PATH}.")
+
+
+register_page_classifier("ml_page_classifier", classify=classify_pages)
+
+if __name__ == "__main__":
+    """
+    Main function to run the script.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if len(sys.argv) == 3 and sys.argv[1] == 'train':
+        train(sys.argv[2])
+        sys.exit(0)
+
+    if len(sys.argv) == 2 and sys.argv[1] == 'check':
+        failed = check_keyword_rules()
+        for case in failed:
+            logging.error(f"Keyword rules: {case}")
+        logging.info("Keyword rules checked." if not failed else f"{len(failed)} keyword rule cases failed.")
+        sys.exit(1 if failed else 0)
+
+    if len(sys.argv) < 2:
+        logging.error("Error: Expects to receive a PDF file as an argument. Usage: python ml_page_classifier.py path_to_pdf_document")
+        sys.exit(1)
+
+    file_path = sys.argv[1]
+    with open(file_path, 'rb') as f:
+        file_content = f.read()
+
+    page_types = classify_pages([file_content])
+
+    page_data = {
+        "processor": "ml_page_classifier",
+        "file_name": os.path.basename(file_path),
+        "pages": [dict(page_number=page_number, **page_type) for page_number, page_type in enumerate(page_types, start=1)]
+    }
+
+    # Print the JSON string to standard output
+    print(json.dumps(page_data, indent=4))
+
+    logging.info("Page classification results processed.")
@@ -9,6 +9,15 @@ import logging
 from google.api_core.exceptions import GoogleAPICallError, RetryError
 import itertools
 
+# The shared runtime modules are stored next to main_file.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from processor_runtime import register_processor
+from docai_clients import get_client
+from response_cache import cached_process
+from rate_control import get_controller
+from page_batcher import get_batcher
+from table_geometry import CellGeometry, polygon_vertices
+
 """
 A script for processing PDF documents using Google Cloud Document AI to extract tabular data.
 
@@ -18,7 +27,9 @@ This script performs the following steps:
 2. Document Processing: Utilizes the online_process function to send PDF documents to 
    Google Cloud Document AI for analysis and processing. The function requires the document's file path and 
    leverages the MIME type 'application/pdf' for processing.
-3.  
+3. Table Extraction: extract_tables walks the pages, tables, rows and cells of the processed document once
+   and builds a compact structure per table (cell texts and offsets, bounding boxes and confidences), from
+   which the table, column, row and cell data are derived.
 4. JSON Output: Generates and prints a JSON object that includes the processor used, the name of the 
    processed file, the predicted category, and the confidence in that prediction.
 
@@ -44,13 +55,24 @@ parent_dir = os.path.dirname(script_dir)
 TEMP_FOLDER = os.path.join(parent_dir, 'temp') #CAMBIO REALIZADO POR "h24_ai_app/temp"
 KEYS_FILE_PATH = os.path.join(parent_dir, 'keys', 'credentials.json')
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = KEYS_FILE_PATH 
+CONFIG_PATH = os.path.join(parent_dir, 'keys', 'ml_tabular_config.json')
+
+# Configuration loaded once per process, see get_config()
+_config = None
 
 def load_config(file_path):
     """Loads configuration details from a JSON file."""
     with open(file_path, 'r') as config_file:
         return json.load(config_file)
 
-def online_process(project_id, location, processor_id, file_path, mime_type):
+def get_config():
+    """Returns the processor configuration, loading it from CONFIG_PATH only on the first call."""
+    global _config
+    if _config is None:
+        _config = load_config(CONFIG_PATH)
+    return _config
+
+def online_process(project_id, location, processor_id, file_content, mime_type, processor_version=None):
     """
     Sends the document to Google Cloud Document AI for processing.
     
@@ -58,24 +80,40 @@ def online_process(project_id, location, processor_id, file_path, mime_type):
         project_id (str): The Google Cloud project ID.
         location (str): The location of the Document AI processor.
         processor_id (str): The ID of the Document AI processor.
-        file_path (str): The path to the PDF file to be processed.
+        file_content (bytes): The content of the PDF file to be processed.
         mime_type (str): The MIME type of the document.
+        processor_version (str, optional): The processor version to use, the default version if None.
         
     Returns:
         documentai.Document: The processed document object.
     """
-    client_options = {"api_endpoint": f"{location}-documentai.googleapis.com"}
-    client = documentai.DocumentProcessorServiceClient(client_options=client_options)
-    resource_name = client.processor_path(project_id, location, processor_id)
-    
-    with open(file_path, "rb") as f:
-        file_content = f.read()
+    def send_request(content):
+        # Shared client of the endpoint, the gRPC channel is reused between requests
+        client = get_client(location)
+        if processor_version:
+            resource_name = client.processor_version_path(project_id, location, processor_id, processor_version)
+        else:
+            resource_name = client.processor_path(project_id, location, processor_id)
+        
+        raw_document = documentai.RawDocument(content=content, mime_type=mime_type)
+        request = documentai.ProcessRequest(name=resource_name, raw_document=raw_document)
+        
+        # Quota, concurrency and retries of the processor (see rate_control.py),
+        # the client retries are disabled so failed requests are not retried twice
+        controller = get_controller(processor_id, get_config())
+        result = controller.call(lambda: client.process_document(request=request, retry=None), request_bytes=len(content))
+        return result.document
     
-    raw_document = documentai.RawDocument(content=file_content, mime_type=mime_type)
-    request = documentai.ProcessRequest(name=resource_name, raw_document=raw_document)
+    if mime_type == "application/pdf":
+        # Table extraction is page independent: the pages sent at the same time by other files are packed
+        # in a single request and the response is split back per page (see page_batcher.py)
+        batcher = get_batcher(f"{project_id}/{location}/{processor_id}/{processor_version or 'default'}", send_request)
+        fetch_document = lambda: batcher.process(file_content)
+    else:
+        fetch_document = lambda: send_request(file_content)
     
-    result = client.process_document(request=request)
-    return result.document
+    # Responses are cached by page content, processor ID and version (see response_cache.py)
+    return cached_process(file_content, processor_id, processor_version, fetch_document)
 
 def text_anchor_data_table(text_anchor: documentai.Document.TextAnchor, text: str) -> dict:
     """
@@ -88,27 +126,31 @@ def text_anchor_data_table(text_anchor: documentai.Document.TextAnchor, text: st
     Returns:
     A dictionary with the extracted text and its start and end indices in the document.
     """
-    extracted_text = ""
-    start_indices = []
-    end_indices = []
+    text_content, start_index, end_index = _anchor_text(text_anchor.text_segments, text)
+    return _text_dict(text_content, start_index, end_index)
 
-    for segment in text_anchor.text_segments:              
-        # Convert indices from string to int, assuming they're in int64 format but represented as strings
-        start_index = int(segment.start_index)
-        end_index = int(segment.end_index)
+def _anchor_text(text_segments, text):
+    """
+    Returns the cleaned text of the segments of a text anchor and its start and end indices.
+    Works with the proto-plus and the raw protobuf segments.
+    """
+    if not text_segments:
+        return "", None, None
 
-        extracted_text += text[start_index:end_index]
-        start_indices.append(start_index)
-        end_indices.append(end_index)
+    # Convert indices from string to int, assuming they're in int64 format but represented as strings
+    bounds = [(int(segment.start_index), int(segment.end_index)) for segment in text_segments]
+    extracted_text = "".join([text[start_index:end_index] for start_index, end_index in bounds])
 
     # Optionally, clean up the extracted text
     clean_text = extracted_text.strip().replace("\n", " ")
+    return clean_text, min(start for start, _ in bounds), max(end for _, end in bounds)
 
-    # Return a dictionary containing the text and its boundary indices
+def _text_dict(text_content, start_index, end_index):
+    """Builds the text dictionary of the processor output: the text and its boundary indices."""
     return {
-        "text": clean_text,
-        "start_index": min(start_indices) if start_indices else None,
-        "end_index": max(end_indices) if end_indices else None
+        "text": text_content,
+        "start_index": start_index,
+        "end_index": end_index
     }
 
 def get_token_check(tokens: List[Document.Page.Token]) -> bool:
@@ -118,13 +160,32 @@ def get_token_check(tokens: List[Document.Page.Token]) -> bool:
     # If the list of tokens is not empty, then the cell has at least one token
     return bool(tokens)  # Returns True if tokens list is not empty, False otherwise
 
+def _limits_dict(vertices):
+    """Builds the boundary limits dictionary of get_boundaries_limits() from a flat vertex tuple (see polygon_vertices)."""
+    if vertices is None:
+        return None
+    top_left_x, top_left_y, top_right_x, top_right_y, bottom_right_x, bottom_right_y, bottom_left_x, bottom_left_y = vertices
+
+    # Define boundary limits with more descriptive key naming
+    left_limit = {"x_position": top_left_x, "vertical_extent": {"top": top_left_y, "bottom": bottom_left_y}}
+    right_limit = {"x_position": top_right_x, "vertical_extent": {"top": top_right_y, "bottom": bottom_right_y}}
+    top_limit = {"y_position": top_left_y, "horizontal_extent": {"left": top_left_x, "right": top_right_x}}
+    bottom_limit = {"y_position": bottom_left_y, "horizontal_extent": {"left": bottom_left_x, "right": bottom_right_x}}
+
+    return {
+        "left_limit": left_limit,
+        "right_limit": right_limit,
+        "top_limit": top_limit,
+        "bottom_limit": bottom_limit
+    }
+
 def get_boundaries_limits(bounding_poly): 
     """
     Extracts the boundary limits from a bounding_poly, assuming the polygon represents an axis-aligned rectangle.
     This function returns the coordinates for the left, right, top, and bottom limits of a layout element.
     
-    Note: This function assumes the layout element is not rotated. For rotated or skewed elements, a more
-    complex approach that considers the orientation would be needed.
+    Note: This function reports the vertices as they are. The row and column envelopes of the tables are
+    computed by table_geometry.CellGeometry, which also handles rotated or skewed elements.
 
     Parameters:
     - bounding_poly: A polygon defining the boundaries of a layout element, expected to have at least 4 vertices.
@@ -138,220 +199,256 @@ def get_boundaries_limits(bounding_poly):
     """
 
     # Validate the input
-    if not bounding_poly or not bounding_poly.vertices or len(bounding_poly.vertices) < 4:
+    if not bounding_poly:
         return None
-    
-    # Extract vertices
-    top_left = bounding_poly.vertices[0]
-    top_right = bounding_poly.vertices[1]
-    bottom_right = bounding_poly.vertices[2]
-    bottom_left = bounding_poly.vertices[3]
-
-    # Define boundary limits with more descriptive key naming
-    left_limit = {"x_position": top_left.x, "vertical_extent": {"top": top_left.y, "bottom": bottom_left.y}}
-    right_limit = {"x_position": top_right.x, "vertical_extent": {"top": top_right.y, "bottom": bottom_right.y}}
-    top_limit = {"y_position": top_left.y, "horizontal_extent": {"left": top_left.x, "right": top_right.x}}
-    bottom_limit = {"y_position": bottom_left.y, "horizontal_extent": {"left": bottom_left.x, "right": bottom_right.x}}
+    return _limits_dict(polygon_vertices(bounding_poly))
 
+def _envelope_limits(envelope):
+    """
+    Converts a left, top, right, bottom envelope computed by CellGeometry into the limits of the output.
+    Pixel coordinates are reported as integers, missing limits (no cell with a polygon) as None.
+    """
+    limits = []
+    for value in envelope.tolist():
+        if value != value:  # NaN
+            limits.append(None)
+        else:
+            limits.append(int(value) if value.is_integer() else value)
+    left_limit, top_limit, right_limit, bottom_limit = limits
     return {
         "left_limit": left_limit,
         "right_limit": right_limit,
-        "top_limit": top_limit,
-        "bottom_limit": bottom_limit
-    } 
-
-def get_table_data(document): 
-    """Extracts table data from the document, focusing on total rows, total columns, and table boundaries."""
-    tables_data = []  # List to hold all tables' data extracted from the document
-
-    # Iterate through each page in the document
-    for page in document.pages:
-        # Check if the page has tables
-        if page.tables:
-            # Iterate through each table on the page
-            for table in page.tables:
-                # Initialize structure to hold data for the current table
-                table_dict = {
-                    "total_rows": len(table.body_rows) + len(table.header_rows),
-                    "total_cols": 0,  # Will be updated based on the number of columns
-                    "table_limits": None,  # To store the table boundaries
-                }
-
-                # Extract table boundaries
-                if table.layout.bounding_poly:
-                    table_dict["table_limits"] = get_boundaries_limits(table.layout.bounding_poly)
-
-                # Determine the maximum number of columns in any row to estimate total columns
-                # This involves checking both header and body rows
-                max_cols = 0
-                # Using itertools.chain to iterate over both header and body rows without explicit conversion
-                for row in itertools.chain(table.header_rows, table.body_rows):
-                    max_cols = max(max_cols, len(row.cells))
-                table_dict["total_cols"] = max_cols
-
-                # Append the table's information to the tables_data list
-                tables_data.append(table_dict)
-
-    return tables_data
-
-def get_row_data(document): 
-    """Extracts row data from each table in the document, including row limits."""
-    row_data = []
+        "top_limit": top_limit,  # The minimum y gives the top boundary.
+        "bottom_limit": bottom_limit  # The maximum y gives the bottom boundary.
+    }
 
-    # Iterate over all pages in the document
-    for page in document.pages:
-        # Check if the page has tables
-        if page.tables:
-            # Iterate over each table on the page
-            for table in page.tables:
-                # Iterate over each body row in the table
-                for row_index, row in enumerate(table.body_rows):
-                    # Initialize a dictionary to store data for the current row
-                    row_dict = {
-                        "row_index": row_index,  # The index of the row within its table
-                        "row_first_cell_text": None,  # Will store text from the row's first cell, if available
-                        "row_limits": None  # Will store spatial limits of the row, calculated below
-                    }
+def extract_tables(document):
+    """
+    Walks the pages, tables, rows and cells of the document once and builds a compact structure,
+    from which get_table_data, get_col_data, get_row_data and get_cell_data derive their output.
+    The raw protobuf of the document is read directly, without the proto-plus wrappers.
+
+    Args:
+        document (documentai.Document): The document object returned by Document AI.
+
+    Returns:
+        dict: The table structure of the document:
+        - tables: One dictionary per table, in page order, with page_index (the index of the page of the
+          table), header_row_count, first_row_id (the document-wide id of its first row), table_vertices
+          and rows: the header rows followed by the body rows, each a list of cells. A cell is a
+          (text, start_index, end_index, cell_id, confidence) tuple.
+        - cell_vertices: The flat vertex tuple of each cell, indexed by cell_id (see polygon_vertices).
+        - geometry: The CellGeometry of every cell of the document, indexed by cell_id.
+        - row_count: The number of rows of the document.
+    """
+    document_pb = documentai.Document.pb(document) if isinstance(document, documentai.Document) else document
+    text = document_pb.text
+
+    tables = []
+    cell_vertices = []
+    table_ids = []
+    row_ids = []
+    col_ids = []
+    row_id = 0
+    for page_index, page in enumerate(document_pb.pages):
+        # Polygons with only normalized vertices are scaled by the page dimension
+        page_width = page.dimension.width
+        page_height = page.dimension.height
+        for table in page.tables:
+            table_id = len(tables)
+            first_row_id = row_id
+            rows = []
+            for row in itertools.chain(table.header_rows, table.body_rows):
+                cells = []
+                for col_index, cell in enumerate(row.cells):
+                    layout = cell.layout
+                    text_content, start_index, end_index = _anchor_text(layout.text_anchor.text_segments, text)
+                    cells.append((text_content, start_index, end_index, len(cell_vertices), layout.confidence))
+                    cell_vertices.append(polygon_vertices(layout.bounding_poly, page_width, page_height))
+                    table_ids.append(table_id)
+                    row_ids.append(row_id)
+                    col_ids.append(col_index)
+                rows.append(cells)
+                row_id += 1
+
+            tables.append({
+                "page_index": page_index,
+                "header_row_count": len(table.header_rows),
+                "first_row_id": first_row_id,
+                "table_vertices": polygon_vertices(table.layout.bounding_poly, page_width, page_height),
+                "rows": rows,
+            })
+
+    return {
+        "tables": tables,
+        "cell_vertices": cell_vertices,
+        "geometry": CellGeometry.from_cells(cell_vertices, table_ids, row_ids, col_ids),
+        "row_count": row_id,
+    }
+
+def get_table_data(document, structure=None): 
+    """
+    Extracts table data from the document, focusing on total rows, total columns, and table boundaries.
+
+    Args:
+        document (documentai.Document): The document object returned by Document AI.
+        structure (dict, optional): The structure returned by extract_tables(), built from the document if None.
+    """
+    if structure is None:
+        structure = extract_tables(document)
+
+    # Determine the maximum number of columns in any row (header or body) to estimate total columns
+    return [
+        {
+            "total_rows": len(table["rows"]),
+            "total_cols": max((len(cells) for cells in table["rows"]), default=0),
+            "table_limits": _limits_dict(table["table_vertices"]),
+        }
+        for table in structure["tables"]
+    ]
+
+def get_row_data(document, structure=None): 
+    """
+    Extracts row data from each table in the document, including row limits.
+
+    Args:
+        document (documentai.Document): The document object returned by Document AI.
+        structure (dict, optional): The structure returned by extract_tables(), built from the document if None.
+    """
+    if structure is None:
+        structure = extract_tables(document)
+
+    # Limits of every row of the document, computed at once from the cells' bounding polygons
+    row_envelopes = structure["geometry"].row_envelopes(structure["row_count"])
 
-                    # Check if the row contains any cells and extract text from the first one
-                    if row.cells:
-                        first_cell = row.cells[0]  # Assuming the first cell is representative for the row
-                        row_dict["row_first_cell_text"] = text_anchor_data_table(first_cell.layout.text_anchor, document.text)
-
-                    # Calculate row limits based on cells' bounding polygons
-                    x_mins, x_maxs, y_mins, y_maxs = [], [], [], []
-                    for cell in row.cells:
-                        if cell.layout.bounding_poly:
-                            bounds = get_boundaries_limits(cell.layout.bounding_poly)
-                            x_mins.append(bounds["left_limit"]["x_position"])
-                            x_maxs.append(bounds["right_limit"]["x_position"])
-                            y_mins.append(bounds["top_limit"]["y_position"])
-                            y_maxs.append(bounds["bottom_limit"]["y_position"])
-                    
-                    # Update row limits if there are any cells in the row
-                    if x_mins and x_maxs and y_mins and y_maxs:
-                        row_dict["row_limits"] = {
-                            "left_limit": min(x_mins),
-                            "right_limit": max(x_maxs),
-                            "top_limit": min(y_mins),  # The minimum y_min gives the top boundary of the row.
-                            "bottom_limit": max(y_maxs)  # The maximum y_max gives the bottom boundary of the row.
-                        }
-                    else:
-                        # Consider explicitly handling rows without any cells or without bounding polygons
-                        row_dict["row_limits"] = {"left_limit": None, "right_limit": None, "top_limit": None, "bottom_limit": None}
-
-                    # Append the row's data to the row_data list
-                    row_data.append(row_dict)
+    row_data = []
+    for table in structure["tables"]:
+        header_row_count = table["header_row_count"]
+        # Only the body rows are reported, indexed within their table
+        for row_index, cells in enumerate(table["rows"][header_row_count:]):
+            row_data.append({
+                "row_index": row_index,
+                # The first cell is assumed to be representative for the row
+                "row_first_cell_text": _text_dict(*cells[0][:3]) if cells else None,
+                "row_limits": _envelope_limits(row_envelopes[table["first_row_id"] + header_row_count + row_index])
+            })
 
     return row_data
 
-def get_col_data(document): 
-    """Extracts column data from the single table in the document, including column texts and limits."""
-    col_data = []
+def get_col_data(document, structure=None): 
+    """
+    Extracts column data from the first table of the first page, including column texts and limits.
 
-    # Check if the first page has tables
-    if not document.pages[0].tables:
-        return col_data  # Return empty list if no tables found
-    
-    table = document.pages[0].tables[0] # Assuming there is exactly one table in the document
-    num_cols = len(table.body_rows[0].cells) # Number of columns determined from the body row
+    Args:
+        document (documentai.Document): The document object returned by Document AI.
+        structure (dict, optional): The structure returned by extract_tables(), built from the document if None.
+    """
+    if structure is None:
+        structure = extract_tables(document)
+
+    # Check if the first page has tables; assuming there is exactly one table in the document
+    tables = structure["tables"]
+    if not tables or tables[0]["page_index"] != 0:
+        return []
+    table = tables[0]
+    header_row_count = table["header_row_count"]
+    if not header_row_count or len(table["rows"]) == header_row_count:
+        return []
+    header_cells = table["rows"][0]
+
+    # Column limits from the first header row and the body rows
+    first_row_id = table["first_row_id"]
+    column_rows = [first_row_id] + list(range(first_row_id + header_row_count, first_row_id + len(table["rows"])))
+    column_envelopes = structure["geometry"].column_envelopes(0, column_rows)
 
+    col_data = []
+    num_cols = len(table["rows"][header_row_count])  # Number of columns determined from the body row
     for col_index in range(num_cols):
-        # Initialize col_dict for the current column
-        col_dict = {
+        # Column text from the header row cell
+        header_cell = header_cells[col_index] if col_index < len(header_cells) else None
+        col_data.append({
             "col_index": col_index,
-            "col_cell_text": None,
-            "col_limits": {
-                "left_limit": None,
-                "right_limit": None,
-                "top_limit": None,
-                "bottom_limit": None
-            }
-        }
-
-        # Extract column text from the header row cell
-        header_cell = table.header_rows[0].cells[col_index]
-        col_dict["col_cell_text"] = text_anchor_data_table(header_cell.layout.text_anchor, document.text)
-        
-        # Initialize variables to track column limits
-        x_mins, x_maxs, y_mins, y_maxs = [], [], [], []
-
-        # Add header cell boundaries to lists
-        if header_cell.layout.bounding_poly:
-            bounds = get_boundaries_limits(header_cell.layout.bounding_poly)
-            x_mins.append(bounds["left_limit"]["x_position"])
-            x_maxs.append(bounds["right_limit"]["x_position"])
-            y_mins.append(bounds["top_limit"]["y_position"])
-            y_maxs.append(bounds["bottom_limit"]["y_position"])
-            
-        # Iterate over body rows to update column limits
-        for row in table.body_rows:
-            if col_index < len(row.cells):
-                cell = row.cells[col_index]
-                if cell.layout.bounding_poly:
-                    bounds = get_boundaries_limits(cell.layout.bounding_poly)
-                    x_mins.append(bounds["left_limit"]["x_position"])
-                    x_maxs.append(bounds["right_limit"]["x_position"])
-                    y_mins.append(bounds["top_limit"]["y_position"])
-                    y_maxs.append(bounds["bottom_limit"]["y_position"])
-
-        # Update column limits in col_dict
-        col_dict["col_limits"]["left_limit"] = min(x_mins) if x_mins else None
-        col_dict["col_limits"]["right_limit"] = max(x_maxs) if x_maxs else None
-        col_dict["col_limits"]["top_limit"] = min(y_mins) if y_mins else None
-        col_dict["col_limits"]["bottom_limit"] = max(y_maxs) if y_maxs else None
-
-        # Append the column's data to col_data list
-        col_data.append(col_dict)
+            "col_cell_text": _text_dict(*header_cell[:3]) if header_cell else None,
+            "col_limits": _envelope_limits(column_envelopes[col_index])
+        })
 
     return col_data
 
-def get_cell_data(document):
+def get_cell_data(document, structure=None):
     """
-    Extracts detailed cell data from each table in the document, using attribute access for a cleaner approach.
+    Extracts detailed cell data from each table in the document.
+
+    Args:
+        document (documentai.Document): The document object returned by Document AI.
+        structure (dict, optional): The structure returned by extract_tables(), built from the document if None.
     """
-    all_cell_data = []
+    if structure is None:
+        structure = extract_tables(document)
+    cell_vertices = structure["cell_vertices"]
 
-    for page in document.pages:
-        if page.tables:
-            for table in page.tables:
-                total_header_rows = len(table.header_rows)
-                # Unified processing for both header and body rows for consistency
-                for is_header, rows in ((True, table.header_rows), (False, table.body_rows)):
-                    for row_index, row in enumerate(rows, start=(0 if is_header else total_header_rows)):
-                        for col_index, cell in enumerate(row.cells):
-                            # Assuming text_anchor_data_table and get_boundaries_limits are correctly defined
-                            cell_text_data = text_anchor_data_table(cell.layout.text_anchor, document.text)
-                            cell_boundaries = get_boundaries_limits(cell.layout.bounding_poly) if cell.layout.bounding_poly else None
-                                               
-                            # Create and append cell data within the correct scope
-                            cell_data = {
-                                "row_type": "header" if is_header else "body",
-                                "row_index": row_index,
-                                "col_index": col_index,
-                                "cell_data": {
-                                    "cell_content": cell_text_data,
-                                    "cell_extraction_confidence": cell.layout.confidence if hasattr(cell.layout, 'confidence') else None,
-                                    "cell_limits": cell_boundaries
-                                }
-                            }
-                            all_cell_data.append(cell_data)
+    all_cell_data = []
+    for table in structure["tables"]:
+        header_row_count = table["header_row_count"]
+        # Header rows come first, the body rows are indexed after them
+        for row_index, cells in enumerate(table["rows"]):
+            row_type = "header" if row_index < header_row_count else "body"
+            for col_index, (text_content, start_index, end_index, cell_id, confidence) in enumerate(cells):
+                all_cell_data.append({
+                    "row_type": row_type,
+                    "row_index": row_index,
+                    "col_index": col_index,
+                    "cell_data": {
+                        "cell_content": _text_dict(text_content, start_index, end_index),
+                        "cell_extraction_confidence": confidence,
+                        "cell_limits": _limits_dict(cell_vertices[cell_id])
+                    }
+                })
 
     return all_cell_data
 
+def build_output(document, file_name):
+    """Builds the processor output (table, column, row and cell data) from the processed document."""
+    # Walk the document once, the four views are derived from the same table structure
+    structure = extract_tables(document)
+    table_data = get_table_data(document, structure)
+    col_data = get_col_data(document, structure)
+    row_data = get_row_data(document, structure)
+    cell_data = get_cell_data(document, structure)
+
+    # Assemble JSON response
+    return {
+        "processor": 'ml_tabular_ext',
+        "file_name": file_name,
+        "table_entities": {
+            "table_data": table_data,
+            "column_data": col_data,
+            "row_data": row_data,
+            "content_data": cell_data
+        }
+    }
+
+def fetch_document(page_bytes):
+    """
+    Sends a PDF page to the processor configured in CONFIG_PATH and returns the processed document.
+    """
+    config = get_config()
+    return online_process(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], page_bytes, MIME_TYPE, config.get('PROCESSOR_VERSION'))
+
+def process_page(page_bytes, file_name):
+    """
+    Sends a PDF page to the processor and returns the tabular data.
+    Used by the processor runtime when the page is processed in a single step.
+    """
+    return build_output(fetch_document(page_bytes), file_name)
+
+register_processor("ml_tabular_ext", process=process_page, analyze=build_output, fetch=fetch_document, config_path=CONFIG_PATH)
+
 if __name__ == "__main__":
     # Load processor configuration
-    # Assuming this script is located in h24_ai_app, directly find the keys directory
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    # Navigate to the parent directory of the current directory to then access the 'keys' folder
-    parent_dir = os.path.dirname(current_dir)
-    keys_dir = os.path.join(parent_dir, 'keys') # This now correctly points to h24_ai_app/keys
-        
-    config_path = os.path.join(keys_dir, 'ml_tabular_config.json')
     try:
-        config = load_config(config_path)
+        config = get_config()
     except FileNotFoundError:
-        logging.error(f"Configuration file not found in {config_path}")
+        logging.error(f"Configuration file not found in {CONFIG_PATH}")
         sys.exit(1)
     
     if len(sys.argv) < 2:
@@ -360,11 +457,14 @@ if __name__ == "__main__":
         
     file_path = sys.argv[1]
     file_name = os.path.basename(file_path)      
+    
+    with open(file_path, "rb") as f:
+        file_content = f.read()
           
     # Process document
     
     try:
-        document = online_process(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], file_path, MIME_TYPE)
+        document = online_process(config['PROJECT_ID'], config['LOCATION'], config['PROCESSOR_ID'], file_content, MIME_TYPE, config.get('PROCESSOR_VERSION'))
     except GoogleAPICallError as e:
         logging.error(f"API call failed: {e.message}")
         sys.exit(1)
@@ -375,24 +475,7 @@ if __name__ == "__main__":
         logging.error(f"An unexpected error occurred: {e}")
         sys.exit(1)
     
-    
-    # Extract data
-    table_data = get_table_data(document)
-    col_data = get_col_data(document)
-    row_data = get_row_data(document) 
-    cell_data = get_cell_data(document)
-
-    # Assemble JSON response
-    table_data = {
-        "processor": 'ml_tabular_ext',
-        "file_name": file_name,
-        "table_entities": {
-            "table_data": table_data,
-            "column_data": col_data,
-            "row_data": row_data,
-            "content_data": cell_data
-        }
-    }
+    table_data = build_output(document, file_name)
     
     # Write the results to a JSON format
     # Convert document_data to a JSON string
@@ -402,4 +485,3 @@ if __name__ == "__main__":
     print(json_table_data)
     
     logging.info("Table results processed.")
-
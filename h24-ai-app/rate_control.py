@@ -0,0 +1,283 @@
+# rate_control.py
+import time
+import random
+import logging
+import threading
+
+from google.api_core import exceptions as core_exceptions
+
+import tracing
+
+"""
+Adaptive rate limiting and retries of the Document AI requests, one controller per processor.
+
+When the volume goes up, online processing answers RESOURCE_EXHAUSTED (429) or UNAVAILABLE. Before
+this module the processor logged the error and main() got no result for that processor. Each
+request now goes through the controller of its processor:
+
+1. Token bucket: requests are spaced to stay under the processor quota. The rate is seeded from the
+   QUOTA_REQUESTS_PER_MINUTE key of keys/*_config.json (DEFAULT_REQUESTS_PER_MINUTE otherwise).
+2. AIMD concurrency: the number of requests in flight grows by one for each window of successful
+   requests (additive increase) and is halved on a 429 or when the latency goes well above the recent
+   average latency (multiplicative decrease). MAX_CONCURRENT_REQUESTS in the config sets the ceiling.
+   Until the first overload signal, the limit grows by one per successful request instead (slow
+   start), so the pages of a large file fan out in a few round trips; the token bucket still holds
+   the requests under the quota.
+3. Retries: throttling and transient errors are retried with jittered exponential backoff; the
+   retry delay sent by the server (google.rpc.RetryInfo) is honored when it is longer.
+
+Non-transient errors (invalid argument, permission denied...) are raised at once.
+
+Each attempt is a docai_request span (see tracing.py), and the requests, errors and bytes uploaded
+are counted per processor in the exported metrics.
+"""
+
+#Configuration
+DEFAULT_REQUESTS_PER_MINUTE = 120  # Document AI online processing quota per processor
+DEFAULT_MAX_CONCURRENT_REQUESTS = 16
+INITIAL_CONCURRENT_REQUESTS = 4
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+DECREASE_FACTOR = 0.5  # Concurrency multiplier after an overload signal
+LATENCY_TOLERANCE = 3.0  # Latency above LATENCY_TOLERANCE x average latency counts as overload
+LATENCY_SMOOTHING = 0.2  # Weight of the last request in the average latency
+
+# Errors worth retrying: throttling and transient server errors
+RETRYABLE_ERRORS = (
+    core_exceptions.ResourceExhausted,
+    core_exceptions.TooManyRequests,
+    core_exceptions.ServiceUnavailable,
+    core_exceptions.DeadlineExceeded,
+    core_exceptions.InternalServerError,
+)
+# Errors meaning the processor quota or capacity is exceeded
+OVERLOAD_ERRORS = (
+    core_exceptions.ResourceExhausted,
+    core_exceptions.TooManyRequests,
+)
+
+# Controllers keyed by processor ID
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens (burst size).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Empties the bucket, so the next requests wait for new tokens (used after a 429)."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0)
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit adjusted with additive increase / multiplicative decrease.
+
+    Args:
+        initial (int): Initial number of requests allowed in flight.
+        maximum (int): Maximum number of requests allowed in flight.
+    """
+
+    def __init__(self, initial, maximum):
+        self.maximum = maximum
+        self.limit = float(min(initial, maximum))
+        self.slow_start = True
+        self.in_flight = 0
+        self.average_latency = None
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        """
+        Frees a slot and adapts the limit.
+
+        Args:
+            latency (float, optional): Duration of the successful request, in seconds.
+            overloaded (bool): The request was throttled by the server.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                if self.average_latency is not None and latency > LATENCY_TOLERANCE * self.average_latency:
+                    overloaded = True
+                if self.average_latency is None:
+                    self.average_latency = latency
+                else:
+                    self.average_latency += LATENCY_SMOOTHING * (latency - self.average_latency)
+
+            if overloaded:
+                self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+                self.slow_start = False
+            elif latency is not None:
+                # +1 per successful request in slow start, +1 after a full window of successful requests afterwards
+                self.limit = min(float(self.maximum), self.limit + (1 if self.slow_start else 1 / self.limit))
+            self._condition.notify_all()
+
+
+def retry_delay_hint(error):
+    """
+    Returns the retry delay requested by the server (google.rpc.RetryInfo), in seconds, or None.
+
+    Args:
+        error (GoogleAPICallError): The error returned by Document AI.
+    """
+    for detail in getattr(error, 'details', None) or ():
+        retry_delay = getattr(detail, 'retry_delay', None)
+        if retry_delay is not None and (retry_delay.seconds or retry_delay.nanos):
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    return None
+
+
+def backoff_delay(attempt, hint=None):
+    """
+    Jittered exponential backoff ("full jitter"), never shorter than the server hint.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0.
+        hint (float, optional): The retry delay requested by the server.
+
+    Returns:
+        float: The seconds to wait before the next attempt.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    if hint is not None:
+        delay = max(delay, hint)
+    return delay
+
+
+class RateController:
+    """
+    Token bucket, AIMD concurrency limiter and retry policy of a processor.
+
+    Args:
+        name (str): The processor ID, used in the logs.
+        requests_per_minute (float): The processor quota.
+        max_concurrency (int): The maximum number of requests in flight.
+    """
+
+    def __init__(self, name, requests_per_minute, max_concurrency):
+        self.name = name
+        rate = requests_per_minute / 60
+        self.bucket = TokenBucket(rate, capacity=max(1.0, min(max_concurrency, rate * 5)))
+        self.limiter = AIMDLimiter(min(INITIAL_CONCURRENT_REQUESTS, max_concurrency), max_concurrency)
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def call(self, func, request_bytes=0, max_attempts=MAX_ATTEMPTS):
+        """
+        Runs a request under the rate limit, retrying throttling and transient errors.
+
+        Args:
+            func (callable): Function without arguments sending the request.
+            request_bytes (int): The size of the document sent, counted in the metrics at each attempt.
+            max_attempts (int): The number of attempts before the error is raised.
+
+        Returns:
+            The value returned by func.
+        """
+        for attempt in range(max_attempts):
+            self.bucket.acquire()
+            self.limiter.acquire()
+            self._count("requests")
+            # The processor name comes from the span of the page (main_file.py), the ID otherwise
+            processor = tracing.current_attribute("processor", self.name)
+            tracing.count("requests", processor=processor)
+            tracing.count("uploaded_bytes", request_bytes, processor=processor)
+            start = time.monotonic()
+            try:
+                with tracing.span("docai_request", processor_id=self.name, attempt=attempt + 1):
+                    result = func()
+            except RETRYABLE_ERRORS as e:
+                tracing.count("request_errors", processor=processor, error=e.__class__.__name__)
+                overloaded = isinstance(e, OVERLOAD_ERRORS)
+                self.limiter.release(overloaded=overloaded)
+                if overloaded:
+                    self._count("throttled")
+                    self.bucket.drain()
+                if attempt == max_attempts - 1:
+                    self._count("failures")
+                    raise
+                delay = backoff_delay(attempt, retry_delay_hint(e))
+                self._count("retries")
+                logging.warning(f"Processor {self.name}: {e.__class__.__name__}, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_attempts}).")
+                time.sleep(delay)
+            except Exception as e:
+                tracing.count("request_errors", processor=processor, error=e.__class__.__name__)
+                self.limiter.release()
+                self._count("failures")
+                raise
+            else:
+                self.limiter.release(latency=time.monotonic() - start)
+                return result
+
+
+def get_controller(processor_id, config=None):
+    """
+    Returns the controller of a processor, creating it on the first call.
+
+    Args:
+        processor_id (str): The ID of the Document AI processor.
+        config (dict, optional): The processor configuration, read for QUOTA_REQUESTS_PER_MINUTE
+            and MAX_CONCURRENT_REQUESTS when the controller is created.
+
+    Returns:
+        RateController: The controller of the processor.
+    """
+    with _controllers_lock:
+        controller = _controllers.get(processor_id)
+        if controller is None:
+            config = config or {}
+            controller = RateController(
+                processor_id,
+                float(config.get('QUOTA_REQUESTS_PER_MINUTE', DEFAULT_REQUESTS_PER_MINUTE)),
+                int(config.get('MAX_CONCURRENT_REQUESTS', DEFAULT_MAX_CONCURRENT_REQUESTS)),
+            )
+            _controllers[processor_id] = controller
+        return controller
+
+
+def get_stats():
+    """Returns the request, retry, throttling and failure counters of each processor."""
+    with _controllers_lock:
+        return {processor_id: dict(controller.stats, concurrency_limit=int(controller.limiter.limit))
+                for processor_id, controller in _controllers.items()}
@@ -0,0 +1,245 @@
+# response_cache.py
+import os
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+from google.cloud import documentai
+
+import tracing
+
+"""
+Content-addressed on-disk cache of the Document AI responses.
+
+Every processed page is stored as the raw documentai.Document protobuf, under a key built from the
+SHA-256 of the page bytes, the processor ID and the processor version. When main_file.main() is run
+again (after a crash, or after changing the post-processing of a processor such as get_cell_data or
+extract_all_data), the pages already processed are read from the cache instead of being sent again.
+
+- The cache size is bounded by MAX_CACHE_BYTES; the least recently used responses are evicted first
+  (the modification time of a cache file is refreshed every time it is read).
+- Identical requests running at the same time (same key) are coalesced: only the first one reaches
+  Document AI and the others wait for its response.
+- Replay mode (main_file.py --replay) never calls Document AI: the processors only run their local
+  extraction functions over the cached protos, and pages without a cached response fail.
+
+The values can be set with the DOCAI_CACHE_* environment variables or with configure().
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("DOCAI_CACHE_DIR", os.path.join(script_dir, 'temp', 'docai_cache'))
+MAX_CACHE_BYTES = int(os.environ.get("DOCAI_CACHE_MAX_MB", 2048)) * 1024 * 1024
+CACHE_ENABLED = os.environ.get("DOCAI_CACHE", "1") != "0"
+REPLAY_MODE = False
+
+# In-memory view of the cache directory: key -> [size, last access], loaded on first use
+_index = None
+_index_bytes = 0
+_index_lock = threading.Lock()
+
+# Requests currently sent to Document AI, keyed by cache key
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a page has no cached response."""
+
+
+def configure(cache_dir=None, max_cache_bytes=None, enabled=None, replay=None):
+    """
+    Changes the cache configuration.
+
+    Args:
+        cache_dir (str, optional): Directory where the responses are stored.
+        max_cache_bytes (int, optional): Maximum size of the cache directory.
+        enabled (bool, optional): Whether responses are read from and written to the cache.
+        replay (bool, optional): Serve every request from the cache, without calling Document AI.
+    """
+    global CACHE_DIR, MAX_CACHE_BYTES, CACHE_ENABLED, REPLAY_MODE, _index
+
+    if cache_dir is not None:
+        CACHE_DIR = cache_dir
+        _index = None
+    if max_cache_bytes is not None:
+        MAX_CACHE_BYTES = int(max_cache_bytes)
+    if enabled is not None:
+        CACHE_ENABLED = bool(enabled)
+    if replay is not None:
+        REPLAY_MODE = bool(replay)
+
+
+def cache_key(page_bytes, processor_id, processor_version=None):
+    """
+    Builds the cache key of a request.
+
+    Args:
+        page_bytes (bytes): The content sent to Document AI.
+        processor_id (str): The ID of the Document AI processor.
+        processor_version (str, optional): The processor version, None for the default version.
+
+    Returns:
+        str: The hexadecimal SHA-256 key.
+    """
+    digest = hashlib.sha256(page_bytes)
+    digest.update(f"\0{processor_id}\0{processor_version or 'default'}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _cache_path(key):
+    """Cache files are sharded in subdirectories by the first two characters of the key."""
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.pb")
+
+
+def _load_index():
+    """Scans the cache directory once to know the size and last access of every entry."""
+    global _index, _index_bytes
+
+    _index = {}
+    _index_bytes = 0
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for root, _, files in os.walk(CACHE_DIR):
+        for file in files:
+            if not file.endswith('.pb'):
+                continue
+            stat = os.stat(os.path.join(root, file))
+            _index[file[:-3]] = [stat.st_size, stat.st_mtime]
+            _index_bytes += stat.st_size
+
+
+def _evict():
+    """Deletes the least recently used entries until the cache fits in MAX_CACHE_BYTES."""
+    global _index_bytes
+
+    if _index_bytes <= MAX_CACHE_BYTES:
+        return
+    for key, (size, _) in sorted(_index.items(), key=lambda item: item[1][1]):
+        try:
+            os.remove(_cache_path(key))
+        except FileNotFoundError:
+            pass
+        del _index[key]
+        _index_bytes -= size
+        if _index_bytes <= MAX_CACHE_BYTES:
+            break
+
+
+def get_cached_document(key):
+    """
+    Reads a cached response.
+
+    Args:
+        key (str): The cache key of the request.
+
+    Returns:
+        documentai.Document: The cached document, or None if the key is not cached.
+    """
+    path = _cache_path(key)
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+
+    # Refresh the last access of the entry for the LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    with _index_lock:
+        if _index is not None and key in _index:
+            _index[key][1] = os.path.getmtime(path)
+
+    return documentai.Document.deserialize(content)
+
+
+def store_document(key, document):
+    """
+    Stores a response in the cache and evicts the oldest entries if the cache is full.
+
+    Args:
+        key (str): The cache key of the request.
+        document (documentai.Document): The document returned by Document AI.
+    """
+    global _index_bytes
+
+    content = documentai.Document.serialize(document)
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write to a temporary file first, so a crash never leaves a truncated entry
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+    with _index_lock:
+        if _index is None:
+            _load_index()
+        else:
+            previous = _index.get(key)
+            if previous:
+                _index_bytes -= previous[0]
+            _index[key] = [len(content), os.path.getmtime(path)]
+            _index_bytes += len(content)
+        _evict()
+
+
+def cached_process(page_bytes, processor_id, processor_version, process):
+    """
+    Returns the Document AI response of a page, from the cache when possible.
+
+    Concurrent calls with the same key share a single call to process().
+
+    Args:
+        page_bytes (bytes): The content sent to Document AI.
+        processor_id (str): The ID of the Document AI processor.
+        processor_version (str): The processor version, None for the default version.
+        process (callable): Function without arguments sending the request and returning the document.
+
+    Returns:
+        documentai.Document: The processed document.
+
+    Raises:
+        CacheMissError: In replay mode, when the page has no cached response.
+    """
+    if not CACHE_ENABLED and not REPLAY_MODE:
+        return process()
+
+    key = cache_key(page_bytes, processor_id, processor_version)
+
+    document = get_cached_document(key)
+    if document is not None:
+        tracing.annotate(cache="hit")
+        return document
+    if REPLAY_MODE:
+        raise CacheMissError(f"No cached response for processor {processor_id} (key {key[:12]}).")
+
+    # Coalesce identical requests already in flight
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+
+    if not owner:
+        return future.result()
+
+    try:
+        document = process()
+        try:
+            store_document(key, document)
+        except OSError as e:
+            logging.warning(f"Could not store the Document AI response in the cache: {e}")
+        future.set_result(document)
+        return document
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
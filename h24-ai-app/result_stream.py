@@ -0,0 +1,304 @@
+# result_stream.py
+import os
+import json
+import time
+import logging
+import threading
+
+"""
+Append-only stream of the processor results, written by main_file.py --stream-results.
+
+Each processor result of a page is appended as one JSON line as soon as it is analyzed, instead of
+waiting for the merged output of the page:
+
+    {"offset": 1234, "file_name": "doc.pdf", "page_name": "doc-p2.pdf", "processor": "ml_tabular_ext", "written_at": 1718000000.1, "result": {...}}
+
+- offset: the position of the record in the whole stream, it keeps growing between runs.
+- One process writes the stream of an output directory at a time: the writer holds an exclusive lock
+  on extraction_stream/.lock while it is open, and a second writer (a watch-mode daemon and a batch
+  run on the same OUTPUT_DIR) fails at once instead of overwriting the manifest and reusing offsets.
+- The records are written in segment files OUTPUT_DIR/extraction_stream/results-<run_id>-<n>.ndjson.
+  A segment is closed and a new one opened when it reaches STREAM_MAX_BYTES, or when it is older than
+  STREAM_MAX_SECONDS at the next record.
+- manifest.json lists the segments in order with their first offset, number of records, size and
+  status ("open" or "closed"). It is replaced atomically each time a segment is opened or closed, so a
+  consumer can read it at any time, skip the segments before the offset it has reached, and tail the
+  open segment (every record is written as a whole line and flushed).
+- Each closed segment has a side index, <segment>.index.json: the first and last offset of each file
+  and page it holds, and the byte position of its first record, so read_stream(file_name=...,
+  page_name=...) only opens the segments of that file or page (and the open segment), from there.
+
+Segments left open by an interrupted run (the lock is free again) are counted again, indexed and
+closed when the next stream is opened. read_manifest() and read_stream() read the stream back.
+"""
+
+#Configuration
+STREAM_DIR_NAME = 'extraction_stream'
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+INDEX_SUFFIX = '.index.json'
+STREAM_MAX_BYTES = int(os.environ.get("DOCAI_STREAM_MAX_BYTES", 64 * 1024 * 1024))  # Size of a segment before rotation
+STREAM_MAX_SECONDS = float(os.environ.get("DOCAI_STREAM_MAX_SECONDS", 15 * 60))  # Age of a segment before rotation
+
+
+def _compact_dumps():
+    """Returns a function serializing a value to compact JSON bytes, with orjson when it is installed."""
+    try:
+        import orjson
+        return orjson.dumps
+    except ImportError:
+        return lambda data: json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def stream_dir(output_dir):
+    """Returns the directory of the stream of an output directory."""
+    return os.path.join(output_dir, STREAM_DIR_NAME)
+
+
+def read_manifest(output_dir):
+    """
+    Reads the manifest of a stream.
+
+    Args:
+        output_dir (str): The output directory given to ResultStream.
+
+    Returns:
+        dict: The manifest, {"segments": []} if no stream was written yet.
+    """
+    manifest_path = os.path.join(stream_dir(output_dir), MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"segments": []}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _lock_file(lock_file):
+    """Takes an exclusive lock on an open file without waiting, returns False when another process holds it."""
+    try:
+        import fcntl
+    except ImportError:
+        # Windows
+        import msvcrt
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _index_add(index, record, position):
+    """Adds a record, at a byte position of its segment, to the [first offset, last offset, first position] of its file and page."""
+    for key, name in (("files", record.get("file_name")), ("pages", record["page_name"])):
+        if name is None:
+            continue
+        span = index[key].get(name)
+        if span is None:
+            index[key][name] = [record["offset"], record["offset"], position]
+        else:
+            span[1] = record["offset"]
+
+
+def _write_json(path, data):
+    # Written to a temporary file and renamed, readers always see a complete file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def _recover_segment(path):
+    """The number of complete records, their size in bytes and the index, for a segment left open by an interrupted run."""
+    records = 0
+    size = 0
+    index = {"files": {}, "pages": {}}
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # Partial last line of an interrupted write
+            _index_add(index, json.loads(line), size)
+            records += 1
+            size += len(line)
+    return records, size, index
+
+
+class ResultStream:
+    """
+    Writer of the result stream of an output directory.
+
+    Args:
+        output_dir (str): The output directory; the stream is written in output_dir/extraction_stream/.
+        max_bytes (int): The size of a segment before rotation.
+        max_seconds (float): The age of a segment before rotation.
+    """
+
+    def __init__(self, output_dir, max_bytes=STREAM_MAX_BYTES, max_seconds=STREAM_MAX_SECONDS):
+        self.base_dir = stream_dir(output_dir)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.segment_number = 0
+        self._dumps = _compact_dumps()
+        self._file = None
+        self._segment = None
+        self._index = None
+        self._lock = threading.Lock()
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        # Held until close(): the segments found open below are not written by a live process
+        self._lock_file = open(os.path.join(self.base_dir, LOCK_NAME), 'a+')
+        if not _lock_file(self._lock_file):
+            self._lock_file.seek(0)
+            holder = self._lock_file.read().strip() or "another process"
+            self._lock_file.close()
+            raise RuntimeError(f"The result stream of {output_dir} is already written by {holder}, use another output directory.")
+        self._lock_file.seek(0)
+        self._lock_file.truncate()
+        self._lock_file.write(f"process {os.getpid()} (run {self.run_id})")
+        self._lock_file.flush()
+
+        self.manifest = read_manifest(output_dir)
+        for segment in self.manifest["segments"]:
+            if segment["status"] == "open":
+                path = os.path.join(self.base_dir, segment["file"])
+                segment["records"], segment["bytes"], index = _recover_segment(path)
+                _write_json(path + INDEX_SUFFIX, index)
+                segment["status"] = "closed"
+                logging.warning(f"Result stream segment {segment['file']} was left open, closed with {segment['records']} records.")
+        last = self.manifest["segments"][-1] if self.manifest["segments"] else None
+        self.next_offset = last["first_offset"] + last["records"] if last else 0
+
+    def write(self, page_name, processor_name, result, file_name=None):
+        """
+        Appends a processor result to the stream (thread-safe).
+
+        Args:
+            page_name (str): The name of the page.
+            processor_name (str): The name of the processor.
+            result: The analyzed processor output, JSON serializable.
+            file_name (str, optional): The name of the input file of the page.
+
+        Returns:
+            int: The offset of the record.
+        """
+        with self._lock:
+            if self._segment is not None and (self._segment["bytes"] >= self.max_bytes
+                                              or time.time() - self._segment["created"] >= self.max_seconds):
+                self._close_segment()
+            if self._segment is None:
+                self._open_segment()
+
+            offset = self.next_offset
+            record = {"offset": offset, "file_name": file_name, "page_name": page_name, "processor": processor_name,
+                      "written_at": round(time.time(), 3), "result": result}
+            # One write call per line, flushed, so a consumer tailing the segment never reads half a record
+            line = self._dumps(record) + b'\n'
+            self._file.write(line)
+            self._file.flush()
+
+            _index_add(self._index, record, self._segment["bytes"])
+            self._segment["records"] += 1
+            self._segment["bytes"] += len(line)
+            self.next_offset += 1
+            return offset
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._close_segment()
+            if not self._lock_file.closed:
+                # Closing the file releases the lock
+                self._lock_file.close()
+
+    def _open_segment(self):
+        # A run of the same second and process ID (a stream reopened by the same process) must not append to a previous segment
+        file_name = f"results-{self.run_id}-{self.segment_number:05d}.ndjson"
+        while os.path.exists(os.path.join(self.base_dir, file_name)):
+            self.segment_number += 1
+            file_name = f"results-{self.run_id}-{self.segment_number:05d}.ndjson"
+        self.segment_number += 1
+        self._file = open(os.path.join(self.base_dir, file_name), 'ab')
+        self._segment = {"file": file_name, "status": "open", "first_offset": self.next_offset,
+                         "records": 0, "bytes": 0, "created": round(time.time(), 3), "closed": None}
+        self._index = {"files": {}, "pages": {}}
+        self.manifest["segments"].append(self._segment)
+        self._save_manifest()
+
+    def _close_segment(self):
+        self._file.close()
+        # The index is written before the manifest marks the segment closed, readers of a closed segment find it
+        _write_json(os.path.join(self.base_dir, self._segment["file"] + INDEX_SUFFIX), self._index)
+        self._segment["status"] = "closed"
+        self._segment["closed"] = round(time.time(), 3)
+        logging.info(f"Result stream segment {self._segment['file']} closed with {self._segment['records']} records.")
+        self._file = None
+        self._segment = None
+        self._index = None
+        self._save_manifest()
+
+    def _save_manifest(self):
+        _write_json(os.path.join(self.base_dir, MANIFEST_NAME), self.manifest)
+
+
+def read_segment_index(output_dir, segment):
+    """
+    Reads the index of a closed segment.
+
+    Returns:
+        dict: The first offset, last offset and byte position of the first record of each file ("files")
+        and page ("pages") of the segment, None
+        for an open segment or a segment written before the indexes.
+    """
+    index_path = os.path.join(stream_dir(output_dir), segment["file"] + INDEX_SUFFIX)
+    if segment["status"] != "closed" or not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_stream(output_dir, from_offset=0, file_name=None, page_name=None):
+    """
+    Reads the records of a stream, starting at an offset, optionally only those of a file or a page.
+
+    Only the segments containing records from from_offset are opened, and with file_name or page_name
+    only those whose index lists the file or page (and the segments without index); the open segment
+    is read up to its last complete line.
+
+    Args:
+        output_dir (str): The output directory given to ResultStream.
+        from_offset (int): The offset of the first record to return.
+        file_name (str, optional): Only return the records of this input file.
+        page_name (str, optional): Only return the records of this page.
+
+    Yields:
+        dict: The records, in offset order.
+    """
+    base_dir = stream_dir(output_dir)
+    for segment in read_manifest(output_dir)["segments"]:
+        if segment["status"] == "closed" and segment["first_offset"] + segment["records"] <= from_offset:
+            continue
+        position = 0
+        if file_name is not None or page_name is not None:
+            index = read_segment_index(output_dir, segment)
+            if index is not None:
+                spans = [index[key].get(name) for key, name in (("files", file_name), ("pages", page_name)) if name is not None]
+                if any(span is None or span[1] < from_offset for span in spans):
+                    continue
+                position = max(span[2] for span in spans)
+        with open(os.path.join(base_dir, segment["file"]), 'rb') as f:
+            f.seek(position)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                record = json.loads(line)
+                if record["offset"] < from_offset:
+                    continue
+                if file_name is not None and record.get("file_name") != file_name:
+                    continue
+                if page_name is not None and record["page_name"] != page_name:
+                    continue
+                yield record
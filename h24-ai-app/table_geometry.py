@@ -0,0 +1,186 @@
+# table_geometry.py
+import numpy as np
+
+"""
+Vectorized geometry of the table cells of a document, used by ml_tabular_ext.
+
+All the cell quadrilaterals of a document are stored in a single contiguous (cells x 4 x 2) float array
+(top left, top right, bottom right, bottom left vertices, in pixels), with the table, row and column of
+each cell in parallel integer arrays. Row and column envelopes, skew angles and point queries are
+computed with NumPy over the whole array instead of building Python lists per cell:
+
+- Envelopes use every vertex of the cells (min / max of x and y), so they stay correct on skewed or
+  rotated scans; on axis-aligned boxes they are the left, right, top and bottom limits of the cells.
+- Polygons that only have normalized_vertices (values between 0 and 1) are scaled by the page
+  dimension by polygon_vertices().
+- Cells without a polygon are stored as NaN and ignored by the envelopes and the point queries.
+"""
+
+#Configuration
+POINT_QUERY_CHUNK = 1024  # Points tested at once by locate_points(), bounds the temporary arrays
+
+
+def polygon_vertices(bounding_poly, page_width=None, page_height=None):
+    """
+    Returns the first four vertices of a bounding polygon in pixels.
+
+    Args:
+        bounding_poly: A Document AI BoundingPoly (proto-plus or raw protobuf).
+        page_width (float, optional): The page width in pixels, used for normalized_vertices.
+        page_height (float, optional): The page height in pixels, used for normalized_vertices.
+
+    Returns:
+        tuple: The (x, y) coordinates of the top left, top right, bottom right and bottom left vertices
+        as a flat tuple of 8 values, or None if the polygon has less than 4 vertices.
+    """
+    vertices = bounding_poly.vertices
+    if len(vertices) >= 4:
+        return (vertices[0].x, vertices[0].y, vertices[1].x, vertices[1].y,
+                vertices[2].x, vertices[2].y, vertices[3].x, vertices[3].y)
+
+    normalized_vertices = bounding_poly.normalized_vertices
+    if len(normalized_vertices) >= 4 and page_width and page_height:
+        # Rounded to whole pixels, like the vertices returned by Document AI
+        return tuple(round(value * scale)
+                     for vertex in normalized_vertices[:4]
+                     for value, scale in ((vertex.x, page_width), (vertex.y, page_height)))
+    return None
+
+
+class CellGeometry:
+    """
+    The quadrilaterals of the table cells of a document.
+
+    Args:
+        vertices (np.ndarray): The (cells x 4 x 2) vertices, NaN for cells without a polygon.
+        table_ids (np.ndarray): The index of the table of each cell.
+        row_ids (np.ndarray): The index of the row of each cell, unique in the document.
+        col_ids (np.ndarray): The index of the column of each cell in its row.
+    """
+
+    def __init__(self, vertices, table_ids, row_ids, col_ids):
+        self.vertices = vertices
+        self.table_ids = table_ids
+        self.row_ids = row_ids
+        self.col_ids = col_ids
+
+    @classmethod
+    def from_cells(cls, cell_vertices, table_ids, row_ids, col_ids):
+        """
+        Builds the geometry from the per-cell values collected while walking the document.
+
+        Args:
+            cell_vertices (list): The flat 8-value vertex tuple of each cell (see polygon_vertices), or None.
+            table_ids (list): The index of the table of each cell.
+            row_ids (list): The index of the row of each cell, unique in the document.
+            col_ids (list): The index of the column of each cell in its row.
+        """
+        vertices = np.full((len(cell_vertices), 8), np.nan)
+        present = [index for index, values in enumerate(cell_vertices) if values is not None]
+        if present:
+            vertices[present] = [cell_vertices[index] for index in present]
+        return cls(vertices.reshape(-1, 4, 2), np.asarray(table_ids, dtype=np.intp),
+                   np.asarray(row_ids, dtype=np.intp), np.asarray(col_ids, dtype=np.intp))
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def cell_envelopes(self):
+        """
+        Returns the axis-aligned envelope of every cell.
+
+        Returns:
+            np.ndarray: A (cells x 4) array of left, top, right and bottom limits (NaN for cells without polygon).
+        """
+        return np.concatenate([self.vertices.min(axis=1), self.vertices.max(axis=1)], axis=1)
+
+    def envelopes_by(self, group_ids, group_count, mask=None):
+        """
+        Returns the envelope of groups of cells (rows, columns...), ignoring the cells without polygon.
+
+        Args:
+            group_ids (np.ndarray): The group of each cell.
+            group_count (int): The number of groups.
+            mask (np.ndarray, optional): Boolean mask of the cells to take into account.
+
+        Returns:
+            np.ndarray: A (groups x 4) array of left, top, right and bottom limits (NaN for empty groups).
+        """
+        envelopes = self.cell_envelopes()
+        if mask is not None:
+            envelopes = envelopes[mask]
+            group_ids = group_ids[mask]
+
+        # fmin / fmax ignore the NaN of the cells without polygon
+        lower = np.full((group_count, 2), np.nan)
+        upper = np.full((group_count, 2), np.nan)
+        np.fmin.at(lower, group_ids, envelopes[:, :2])
+        np.fmax.at(upper, group_ids, envelopes[:, 2:])
+        return np.concatenate([lower, upper], axis=1)
+
+    def row_envelopes(self, row_count):
+        """Returns the (rows x 4) left, top, right and bottom limits of every row of the document."""
+        return self.envelopes_by(self.row_ids, row_count)
+
+    def column_envelopes(self, table_id, row_ids=None):
+        """
+        Returns the envelopes of the columns of a table.
+
+        Args:
+            table_id (int): The index of the table.
+            row_ids (array-like, optional): The rows taken into account, every row of the table if None.
+
+        Returns:
+            np.ndarray: A (columns x 4) array of left, top, right and bottom limits.
+        """
+        mask = self.table_ids == table_id
+        if row_ids is not None:
+            mask &= np.isin(self.row_ids, row_ids)
+        column_count = int(self.col_ids[mask].max()) + 1 if mask.any() else 0
+        return self.envelopes_by(self.col_ids, column_count, mask)
+
+    def skew_angles(self):
+        """
+        Returns the angle of the top edge of every cell, in degrees (0 on an unrotated scan,
+        positive when the edge goes down to the right). NaN for cells without polygon.
+        """
+        top_edges = self.vertices[:, 1] - self.vertices[:, 0]
+        return np.degrees(np.arctan2(top_edges[:, 1], top_edges[:, 0]))
+
+    def locate_points(self, points):
+        """
+        Finds the cell containing each point, for any convex cell (rotated or skewed included).
+
+        Args:
+            points (array-like): A (points x 2) array of x, y coordinates in pixels.
+
+        Returns:
+            np.ndarray: The index of the first cell containing each point, -1 when no cell contains it.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        result = np.full(len(points), -1, dtype=np.intp)
+        if not len(self.vertices) or not len(points):
+            return result
+
+        # Edges of every cell: vertex i -> vertex i+1
+        starts = self.vertices
+        edges = np.roll(self.vertices, -1, axis=1) - starts
+        envelopes = self.cell_envelopes()
+
+        for chunk_start in range(0, len(points), POINT_QUERY_CHUNK):
+            chunk = points[chunk_start:chunk_start + POINT_QUERY_CHUNK]
+            # Quick rejection with the envelopes, only the candidate (point, cell) pairs are tested further
+            candidates = ((chunk[:, None, 0] >= envelopes[None, :, 0]) & (chunk[:, None, 0] <= envelopes[None, :, 2])
+                          & (chunk[:, None, 1] >= envelopes[None, :, 1]) & (chunk[:, None, 1] <= envelopes[None, :, 3]))
+            point_ids, cell_ids = np.nonzero(candidates)
+
+            # The point is inside a convex cell when it is on the same side of its four edges
+            offsets = chunk[point_ids, None, :] - starts[cell_ids]
+            cross = edges[cell_ids, :, 0] * offsets[..., 1] - edges[cell_ids, :, 1] * offsets[..., 0]
+            inside = (cross >= 0).all(axis=1) | (cross <= 0).all(axis=1)
+            point_ids, cell_ids = point_ids[inside], cell_ids[inside]
+
+            # np.nonzero is ordered by point then cell: keep the first cell of each point
+            found_points, first = np.unique(point_ids, return_index=True)
+            result[chunk_start + found_points] = cell_ids[first]
+        return result
@@ -0,0 +1,355 @@
+# tracing.py
+import os
+import json
+import time
+import bisect
+import asyncio
+import threading
+import contextvars
+
+"""
+Timing spans and metrics of the extraction pipeline, exported as a Prometheus text file and a JSON trace.
+
+The tqdm bars and the logs do not tell where the time of a page goes. The pipeline code opens a span
+around each step, with the file, page and processor it works on:
+
+    with tracing.span("analyze", page=page_name, processor=processor_name):
+        ...
+
+A span is a context manager usable in plain code, in executor threads and in coroutines. The spans
+opened inside a span inherit its attributes: the Document AI request span opened in rate_control.py
+gets the page and processor of the fetch span of main_file.py. main_file.run_sync_in_executor()
+copies the context into the executor threads for that. annotate() adds attributes to the current span,
+e.g. the page once a pipeline stage knows its item.
+
+Each span adds its duration to a latency histogram keyed by span name and processor, and, while there
+are fewer than MAX_TRACE_EVENTS, a complete event ("ph": "X") to the trace. count() adds to a counter
+keyed by name and labels (Document AI requests, errors and bytes uploaded per processor).
+
+- write_metrics(): the Prometheus text exposition format (histograms docai_span_seconds, counters
+  docai_<name>_total), for the node_exporter textfile collector or any scraper reading the file.
+- write_trace(): the Chrome trace event format, to load in chrome://tracing or https://ui.perfetto.dev.
+  The spans of a thread, or of an asyncio task, are drawn on their own track; the tracks of finished
+  tasks are reused so the trace stays readable.
+
+A span costs a few microseconds (see benchmarks/bench_tracing.py), against tens of milliseconds for
+the steps it measures, so tracing is on by default. With DOCAI_TRACE=0 or configure(enabled=False),
+span() returns a shared no-op context manager. The files are written atomically, and main_file.py
+rewrites them every METRICS_INTERVAL seconds in watch mode.
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+TRACE_ENABLED = os.environ.get("DOCAI_TRACE", "1") != "0"
+TRACE_DIR = os.environ.get("DOCAI_TRACE_DIR", os.path.join(script_dir, 'temp', 'traces'))
+MAX_TRACE_EVENTS = int(os.environ.get("DOCAI_TRACE_MAX_EVENTS", 200000))  # Spans kept in the trace, the histograms count every span
+METRICS_INTERVAL = float(os.environ.get("DOCAI_METRICS_INTERVAL", 60))  # Seconds between two metric files in watch mode
+METRICS_FILE = 'docai_metrics.prom'
+TRACE_FILE = 'docai_trace.json'
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# The span opened in the current thread or task
+_current_span = contextvars.ContextVar("docai_current_span", default=None)
+
+_lock = threading.Lock()
+_histograms = {}  # (span name, processor) -> [bucket counts..., count, sum]
+_counters = {}  # (name, sorted labels) -> value
+_events = []
+_dropped_events = 0
+# Trace tracks: thread ident or asyncio task -> track number, and the names of the tracks
+_tracks = {}
+_track_names = {}
+_free_tracks = []
+_next_track = 1
+_origin = time.perf_counter()
+
+
+def configure(enabled=None, trace_dir=None, max_trace_events=None):
+    """
+    Changes the tracing configuration.
+
+    Args:
+        enabled (bool, optional): Whether the spans are measured.
+        trace_dir (str, optional): The directory of the metric and trace files.
+        max_trace_events (int, optional): The maximum number of spans kept in the trace.
+    """
+    global TRACE_ENABLED, TRACE_DIR, MAX_TRACE_EVENTS
+
+    if enabled is not None:
+        TRACE_ENABLED = bool(enabled)
+    if trace_dir is not None:
+        TRACE_DIR = trace_dir
+    if max_trace_events is not None:
+        MAX_TRACE_EVENTS = int(max_trace_events)
+
+
+def _release_track(task):
+    """Done callback of an asyncio task: its track can be reused by a new task."""
+    with _lock:
+        track = _tracks.pop(task, None)
+        if track is not None:
+            _free_tracks.append(track)
+
+
+def _track():
+    """Returns the trace track of the current asyncio task, or of the current thread."""
+    global _next_track
+
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None  # No event loop in this thread
+    key = task if task is not None else threading.get_ident()
+
+    with _lock:
+        track = _tracks.get(key)
+        if track is not None:
+            return track
+        if task is not None and _free_tracks:
+            track = _free_tracks.pop()
+        else:
+            track = _next_track
+            _next_track += 1
+            _track_names[track] = f"asyncio task {track}" if task is not None else threading.current_thread().name
+        _tracks[key] = track
+    if task is not None:
+        task.add_done_callback(_release_track)
+    return track
+
+
+class Span:
+    """
+    A timed step of the pipeline (see span()).
+
+    Args:
+        name (str): The name of the step.
+        attributes (dict): The file, page, processor... of the step, added to the attributes of the parent span.
+    """
+
+    __slots__ = ("name", "attributes", "_start", "_token")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            self.attributes = {**parent.attributes, **self.attributes}
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _record(self, self._start, end)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return self.__exit__(exc_type, exc_value, traceback)
+
+    def set(self, **attributes):
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+
+class _NoSpan:
+    """The span returned while tracing is disabled, it does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **attributes):
+    """
+    Returns a span measuring the code of a with (or async with) block.
+
+    Args:
+        name (str): The name of the step, e.g. "split", "fetch", "docai_request", "write".
+        **attributes: The file, page, processor... of the step. Values must be JSON serializable.
+
+    Returns:
+        Span: The span, or a no-op span while tracing is disabled.
+    """
+    if not TRACE_ENABLED:
+        return _NO_SPAN
+    return Span(name, attributes)
+
+
+def annotate(**attributes):
+    """Adds attributes to the current span and to the spans opened inside it from now on."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def current_attribute(name, default=None):
+    """Returns an attribute of the current span, e.g. the processor of the step."""
+    current = _current_span.get()
+    return current.attributes.get(name, default) if current is not None else default
+
+
+def _record(span, start, end):
+    """Adds a finished span to its histogram and to the trace."""
+    global _dropped_events
+
+    duration = end - start
+    key = (span.name, span.attributes.get("processor", ""))
+    bucket = bisect.bisect_left(BUCKETS, duration)
+    track = _track() if len(_events) < MAX_TRACE_EVENTS else None
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        histogram[bucket] += 1
+        histogram[-2] += 1
+        histogram[-1] += duration
+        if track is not None and len(_events) < MAX_TRACE_EVENTS:
+            _events.append((span.name, start, duration, track, span.attributes))
+        else:
+            _dropped_events += 1
+
+
+def count(name, value=1, **labels):
+    """
+    Adds to a counter of the metrics.
+
+    Args:
+        name (str): The counter name, exported as docai_<name>_total.
+        value (float): The value added.
+        **labels: The labels of the counter, e.g. processor.
+    """
+    if not TRACE_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    """Clears the histograms, counters and trace events, e.g. between two benchmark runs."""
+    global _dropped_events, _origin
+
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _events.clear()
+        _dropped_events = 0
+        _origin = time.perf_counter()
+
+
+def _escape(value):
+    """Escapes a Prometheus label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    """Formats Prometheus labels: {name="value",...}."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def metrics_text():
+    """Returns the histograms and counters in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        counters = dict(_counters)
+        dropped = _dropped_events
+
+    lines = ["# HELP docai_span_seconds Duration of the pipeline steps, by step and processor.",
+             "# TYPE docai_span_seconds histogram"]
+    for (name, processor), values in sorted(histograms.items()):
+        labels = [("span", name)] + ([("processor", processor)] if processor else [])
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, values):
+            cumulative += bucket_count
+            lines.append(f"docai_span_seconds_bucket{_labels(labels + [('le', repr(bound))])} {cumulative}")
+        lines.append(f"docai_span_seconds_bucket{_labels(labels + [('le', '+Inf')])} {values[-2]}")
+        lines.append(f"docai_span_seconds_sum{_labels(labels)} {values[-1]:.6f}")
+        lines.append(f"docai_span_seconds_count{_labels(labels)} {values[-2]}")
+
+    for counter in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE docai_{counter}_total counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == counter:
+                lines.append(f"docai_{name}_total{_labels(labels)} {value!r}")
+    lines.append("# TYPE docai_trace_dropped_events_total counter")
+    lines.append(f"docai_trace_dropped_events_total {dropped}")
+    return "\n".join(lines) + "\n"
+
+
+def trace_events():
+    """Returns the spans in the Chrome trace event format (timestamps in microseconds)."""
+    pid = os.getpid()
+    with _lock:
+        events = list(_events)
+        track_names = dict(_track_names)
+        origin = _origin
+
+    trace = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "h24-ai-app"}}]
+    trace.extend({"name": "thread_name", "ph": "M", "pid": pid, "tid": track, "args": {"name": name}}
+                 for track, name in sorted(track_names.items()))
+    for name, start, duration, track, attributes in events:
+        if start < origin:
+            continue  # Span started before reset()
+        trace.append({"name": name, "cat": attributes.get("processor", "pipeline"), "ph": "X", "pid": pid, "tid": track,
+                      "ts": round((start - origin) * 1e6, 1), "dur": round(duration * 1e6, 1), "args": attributes})
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def _write_atomic(path, write):
+    """Writes a file through a temporary file, so a reader never sees a partial file."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+def write_metrics(trace_dir=None):
+    """Writes the metrics file (METRICS_FILE) to trace_dir (TRACE_DIR by default) and returns its path."""
+    path = os.path.join(trace_dir or TRACE_DIR, METRICS_FILE)
+    _write_atomic(path, lambda f: f.write(metrics_text()))
+    return path
+
+
+def write_trace(trace_dir=None):
+    """Writes the trace file (TRACE_FILE) to trace_dir (TRACE_DIR by default) and returns its path."""
+    path = os.path.join(trace_dir or TRACE_DIR, TRACE_FILE)
+    _write_atomic(path, lambda f: json.dump(trace_events(), f, separators=(',', ':'), default=str))
+    return path
+
+
+def summary(top=10):
+    """Returns the steps with the longest total time: {span name[/processor]: {count, seconds, mean_ms}}."""
+    with _lock:
+        histograms = {key: (values[-2], values[-1]) for key, values in _histograms.items()}
+    ordered = sorted(histograms.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    return {f"{name}/{processor}" if processor else name: {"count": spans, "seconds": round(seconds, 3),
+                                                           "mean_ms": round(seconds / spans * 1000, 2)}
+            for (name, processor), (spans, seconds) in ordered}
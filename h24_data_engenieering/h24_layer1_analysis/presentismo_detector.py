@@ -0,0 +1,312 @@
+# presentismo_detector.py
+import os
+import re
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fitz
+from tqdm import tqdm
+
+"""
+Counts the "Presentismo" keyword in the PDF files of the layer 1 folders and writes the
+informe_presentismo_<folder>.txt reports.
+
+The notebook (ETF-pdf_data.ipynb, step 3) renders every page of every file with pdf2image and runs
+pytesseract on it, one file after the other, each time the reports are generated: hours per service.
+This script reads the text layer of each page first and only OCRs the pages without text:
+
+- Text layer: a page with at least MIN_TEXT_CHARS characters of text (born-digital files, and the
+  scans the scanner already OCRed) is counted from its text, without rendering it.
+- OCR: the other pages are rendered with PyMuPDF at OCR_DPI, in grayscale, and read by pytesseract.
+  The files are scanned in a process pool (--workers). 150 DPI is the resolution GCP requires for
+  8 point text; the keyword is printed larger on the forms, and the pages take about half the pixels
+  (and OCR time) of the 200 DPI of pdf2image. Pages above MAX_OCR_PIXELS are rendered at a lower DPI.
+- Cache: the OCR text of each page is kept in an SQLite cache, keyed by a hash of the page (its
+  content streams and the raw data of its images) with the DPI and language: the same page in
+  another file, renamed or moved, is not OCRed again. The counts of each file are also kept by path,
+  modification time and size, so the unchanged files are not opened at all on a rerun.
+
+The keyword forms are the ones of find_all_word_forms() in the notebook (the WordNet lemma of both
+keywords is the keyword itself, so NLTK is not needed), counted the same way: the forms of each
+keyword are concatenated in one list, so "PRESENTISMO", a form of both keywords, counts twice, and
+the counts match the existing informe_presentismo_*.txt reports. The reports keep the format of the
+notebook: the files of each folder by number of occurrences, 0 to 6 or more. A report is only
+written when its content changed.
+
+Usage:
+    python presentismo_detector.py "Training Dataset/Cuidador" --output-dir Cuidador [--workers 8]
+    python presentismo_detector.py "Training Dataset/Cuidador" --output-dir Cuidador --no-ocr
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.environ.get("H24_PRESENTISMO_CACHE_PATH", os.path.join(script_dir, 'presentismo_cache.sqlite'))
+WORKERS = os.cpu_count() or 1
+OCR_DPI = int(os.environ.get("H24_OCR_DPI", 150))
+OCR_LANG = os.environ.get("H24_OCR_LANG", 'eng')  # pytesseract default of the notebook
+MIN_TEXT_CHARS = 20  # Fewer characters of text: the page is a scan, OCRed
+MAX_OCR_PIXELS = 40_000_000  # Largest rendered page, the notebook hit the decompression bomb limit of PIL
+MAX_OCCURRENCES = 6  # Last group of the reports: 6 or more times
+COMMIT_EVERY = 100  # Files written to the cache per transaction
+
+KEYWORDS = ["Presentismo", "P R E S E N T I S M O"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_pages (
+    page_hash TEXT NOT NULL,
+    dpi INTEGER NOT NULL,
+    lang TEXT NOT NULL,
+    text TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (page_hash, dpi, lang)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    settings TEXT NOT NULL,
+    occurrences INTEGER NOT NULL,
+    pages INTEGER NOT NULL,
+    ocr_pages INTEGER NOT NULL
+);
+"""
+
+# The read-only cache connection of the worker process
+_cache = None
+
+
+def find_all_word_forms(word):
+    """Returns the forms of a keyword counted in the text, as find_all_word_forms() of the notebook."""
+    forms = {word, "PRESENTISMO", word.lower(), word.upper(), word.capitalize()}
+    forms.add(re.sub(r'[^\x00-\x7F]+', '', word))
+    return forms
+
+
+# A list, as in the notebook: a form of both keywords is counted once per keyword
+WORD_FORMS = [form for keyword in KEYWORDS for form in sorted(find_all_word_forms(keyword))]
+
+
+def count_occurrences(text):
+    """Counts the keyword forms in a text (every form of every keyword is counted, as the notebook does)."""
+    return sum(text.count(form) for form in WORD_FORMS)
+
+
+def open_cache(cache_path=CACHE_PATH):
+    """Opens (and creates) the cache database."""
+    connection = sqlite3.connect(cache_path)
+    # The workers read the cache while the main process writes it
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def page_hash(pdf, page):
+    """Returns the SHA-256 hex digest of a page: its size, rotation, content streams and the raw data of its images."""
+    digest = hashlib.sha256(f"{tuple(page.rect)}/{page.rotation}".encode())
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(pdf.xref_stream_raw(image[0]) or b'')
+    return digest.hexdigest()
+
+
+def ocr_page(page, dpi, lang):
+    """Renders a page in grayscale and returns its text read by pytesseract."""
+    import pytesseract
+    from PIL import Image
+
+    pixels = (page.rect.width / 72 * dpi) * (page.rect.height / 72 * dpi)
+    if pixels > MAX_OCR_PIXELS:
+        dpi = int(dpi * (MAX_OCR_PIXELS / pixels) ** 0.5)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+def cached_text(cache_path, key):
+    """Returns the cached OCR text of a page, or None. Runs in the worker processes."""
+    global _cache
+    if _cache is None:
+        _cache = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True)
+    row = _cache.execute("SELECT text FROM ocr_pages WHERE page_hash = ? AND dpi = ? AND lang = ?", key).fetchone()
+    return row[0] if row else None
+
+
+def scan_file(pdf_path, cache_path, dpi=OCR_DPI, lang=OCR_LANG, ocr=True):
+    """
+    Counts the keyword in a PDF file. Runs in the worker processes of scan_folders().
+
+    Returns:
+        dict: The occurrences, the pages, text_pages (read from the text layer), ocr_pages (OCRed),
+        cached_pages (OCR text found in the cache), skipped_pages (without text, not OCRed),
+        new_texts (the (page_hash, dpi, lang, text, seconds) rows to cache) and the error, if any.
+    """
+    result = {"occurrences": 0, "pages": 0, "text_pages": 0, "ocr_pages": 0, "cached_pages": 0, "skipped_pages": 0,
+              "new_texts": [], "error": None}
+    try:
+        with fitz.open(pdf_path) as pdf:
+            for page in pdf:
+                result["pages"] += 1
+                text = page.get_text()
+                if len(text.strip()) >= MIN_TEXT_CHARS:
+                    result["text_pages"] += 1
+                elif not ocr:
+                    result["skipped_pages"] += 1
+                    continue
+                else:
+                    key = (page_hash(pdf, page), dpi, lang)
+                    text = cached_text(cache_path, key)
+                    if text is not None:
+                        result["cached_pages"] += 1
+                    else:
+                        start = time.perf_counter()
+                        text = ocr_page(page, dpi, lang)
+                        result["ocr_pages"] += 1
+                        result["new_texts"].append((*key, text, time.perf_counter() - start))
+                result["occurrences"] += count_occurrences(text)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def find_folders(base_directory):
+    """Returns the PDF files of each folder of the base directory (not its subfolders), sorted as Windows lists them."""
+    folders = {}
+    for folder in sorted(os.listdir(base_directory), key=str.lower):
+        folder_path = os.path.join(base_directory, folder)
+        if os.path.isdir(folder_path):
+            folders[folder] = [os.path.join(folder_path, file) for file in sorted(os.listdir(folder_path), key=str.lower)
+                               if file.lower().endswith('.pdf')]
+    return folders
+
+
+def presentismo_report(folder, occurrences):
+    """
+    Returns the report of a folder, in the format of the notebook.
+
+    Args:
+        folder (str): The folder name.
+        occurrences (dict): The occurrences of the keyword, by file name, in report order.
+    """
+    groups = {times: [] for times in range(MAX_OCCURRENCES + 1)}
+    for file, count in occurrences.items():
+        groups[min(count, MAX_OCCURRENCES)].append(file)
+
+    report = f"Informe de archivos con la palabra 'Presentismo' en la carpeta '{folder}':\n\n"
+    for times, files in groups.items():
+        report += f"{times} veces: {len(files)} archivos\n"
+        report += f"Archivos con 'Presentismo' ({times} veces):\n"
+        for file in files:
+            report += f"- {file}\n"
+        report += "\n"
+    return report
+
+
+def write_report(report_path, report):
+    """Writes a report (with the Windows line endings of the existing ones) when its content changed. Returns True if written."""
+    if os.path.exists(report_path):
+        with open(report_path, encoding='utf-8', newline='') as f:
+            if f.read().replace('\r\n', '\n') == report:
+                return False
+    with open(report_path, 'w', encoding='utf-8', newline='\r\n') as f:
+        f.write(report)
+    return True
+
+
+def scan_folders(base_directory, output_dir='.', cache_path=CACHE_PATH, workers=WORKERS, dpi=OCR_DPI, lang=OCR_LANG,
+                 ocr=True, show_progress=True):
+    """
+    Counts the keyword in the PDF files of each folder of a base directory and writes a report per folder.
+
+    Args:
+        base_directory (str): The directory of the folders (e.g. CUI-1-2pags, CUI-3pags).
+        output_dir (str): The directory of the informe_presentismo_<folder>.txt reports.
+        cache_path (str): The SQLite cache of the OCR text and of the counts of each file.
+        workers (int): The worker processes scanning the files.
+        dpi (int): The resolution of the pages rendered for the OCR.
+        lang (str): The Tesseract language.
+        ocr (bool): OCR the pages without text; when False they count 0 occurrences.
+        show_progress (bool): Show a progress bar.
+
+    Returns:
+        dict: The files found, cached (not opened), scanned and failed, the pages read from the text
+        layer, OCRed, found in the cache and skipped, the reports written and unchanged, and the seconds taken.
+    """
+    start = time.perf_counter()
+    # The cached counts of the files are only valid for the same keyword forms
+    forms = hashlib.sha256('|'.join(WORD_FORMS).encode()).hexdigest()[:12]
+    settings = f"dpi={dpi}/lang={lang}/ocr={ocr}/min_text={MIN_TEXT_CHARS}/forms={forms}"
+    connection = open_cache(cache_path)
+    folders = find_folders(base_directory)
+    stats = {"files": 0, "cached_files": 0, "scanned_files": 0, "failed_files": 0, "text_pages": 0, "ocr_pages": 0,
+             "cached_pages": 0, "skipped_pages": 0, "reports_written": 0, "reports_unchanged": 0}
+
+    occurrences = {}
+    pending = []
+    for pdf_path in (pdf_path for pdf_paths in folders.values() for pdf_path in pdf_paths):
+        stats["files"] += 1
+        file_stat = os.stat(pdf_path)
+        row = connection.execute("SELECT occurrences FROM files WHERE path = ? AND mtime_ns = ? AND size = ? AND settings = ?",
+                                 (os.path.abspath(pdf_path), file_stat.st_mtime_ns, file_stat.st_size, settings)).fetchone()
+        if row is not None:
+            occurrences[pdf_path] = row[0]
+            stats["cached_files"] += 1
+        else:
+            pending.append((pdf_path, file_stat))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(scan_file, pdf_path, os.path.abspath(cache_path), dpi, lang, ocr): (pdf_path, file_stat)
+                       for pdf_path, file_stat in pending}
+            for count, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Scanning PDF files",
+                                                unit="file", disable=not show_progress), start=1):
+                pdf_path, file_stat = futures[future]
+                result = future.result()
+                if result["error"] is not None:
+                    # Not cached, the file is scanned again on the next run
+                    stats["failed_files"] += 1
+                    print(f"Error processing {pdf_path}: {result['error']}", file=sys.stderr)
+                    continue
+                stats["scanned_files"] += 1
+                for counter in ("text_pages", "ocr_pages", "cached_pages", "skipped_pages"):
+                    stats[counter] += result[counter]
+                occurrences[pdf_path] = result["occurrences"]
+                connection.executemany("INSERT OR REPLACE INTO ocr_pages (page_hash, dpi, lang, text, seconds) VALUES (?, ?, ?, ?, ?)",
+                                       result["new_texts"])
+                connection.execute("INSERT OR REPLACE INTO files (path, mtime_ns, size, settings, occurrences, pages, ocr_pages) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (os.path.abspath(pdf_path), file_stat.st_mtime_ns, file_stat.st_size, settings,
+                                    result["occurrences"], result["pages"], result["ocr_pages"]))
+                if count % COMMIT_EVERY == 0:
+                    connection.commit()
+    connection.commit()
+    connection.close()
+
+    os.makedirs(output_dir, exist_ok=True)
+    for folder, pdf_paths in folders.items():
+        report = presentismo_report(folder, {os.path.basename(pdf_path): occurrences[pdf_path]
+                                             for pdf_path in pdf_paths if pdf_path in occurrences})
+        written = write_report(os.path.join(output_dir, f"informe_presentismo_{folder}.txt"), report)
+        stats["reports_written" if written else "reports_unchanged"] += 1
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Counts the 'Presentismo' keyword in the PDF files of each folder and writes the reports.")
+    parser.add_argument('base_directory', help="The directory of the folders, one report per folder.")
+    parser.add_argument('--output-dir', default='.', help="The directory of the reports (default: %(default)s).")
+    parser.add_argument('--cache', default=CACHE_PATH, help="The SQLite cache (default: %(default)s).")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Worker processes scanning the files (default: %(default)s).")
+    parser.add_argument('--dpi', type=int, default=OCR_DPI, help="Resolution of the pages rendered for the OCR (default: %(default)s).")
+    parser.add_argument('--lang', default=OCR_LANG, help="Tesseract language (default: %(default)s).")
+    parser.add_argument('--no-ocr', action='store_true', help="Only read the text layer, the pages without text count 0.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(scan_folders(args.base_directory, args.output_dir, args.cache, args.workers, args.dpi, args.lang, not args.no_ocr))
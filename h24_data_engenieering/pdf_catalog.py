@@ -0,0 +1,367 @@
+# pdf_catalog.py
+import os
+import sys
+import csv
+import time
+import sqlite3
+import hashlib
+import argparse
+import datetime
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+from tqdm import tqdm
+
+"""
+Incremental catalog of the metadata of the PDF files of the training corpus.
+
+The notebooks of the three layers each scan the corpus (about 9,934 PDF files) with PyPDF2, one file
+after the other, to build their CSV files: metadata_1.0.csv and metadata_3.0.csv (layer 2),
+training_data.csv and training_hq_data_1.0.csv (layer 3), and the page-count folders and reports of
+layer 1 (1-2pags, 3pags, 4-5pags, 6+pags, informe_v2.0.txt). Every change of a folder meant scanning
+the whole corpus again.
+
+This script indexes the files once in an SQLite catalog, keyed by path, modification time and size:
+
+- index: walks a directory and opens the new and modified PDF files with PyMuPDF in a process pool
+  (--workers). The unchanged files are not opened, and the files no longer found are removed from
+  the catalog. Each file records its Producer, Creator, Title, Author, Subject, CreationDate and
+  ModDate (the raw values of the document information, as PyPDF2 returned them), TotalPages,
+  FileSize, the SHA-256 of its content and the statistics of its page sizes in points: the most
+  common size, the number of distinct sizes, the smallest and largest width and height, and the
+  number of landscape pages. A file that cannot be opened keeps its error until it changes.
+- export: writes a view of the catalog as CSV (or Parquet, with pandas and pyarrow):
+
+    metadata_v1       metadata_1.0.csv: Filepath, Title, Author, Subject, Creator, Producer, CreationDate, ModDate
+    metadata_v3       metadata_3.0.csv and training_data.csv: Name, Producer, Creator, TotalPages, FileSize
+    training_hq_data  training_hq_data_1.0.csv: the files of HQ_PRODUCER, Name, Producer, TotalPages, FileSize
+    page_buckets      the page-count bucket of each file (Filepath, Name, Folder, TotalPages, Bucket)
+    duplicate_files   the files whose content is found more than once (ContentHash, Filepath, FileSize)
+    files             every column of the catalog
+
+- report: the composition of each folder by page-count bucket, in the format of the layer 1 reports.
+
+The views are also SQL views of the catalog database: exporting them does not open any PDF file.
+
+Usage:
+    python pdf_catalog.py index "Training Dataset" [--workers 8]
+    python pdf_catalog.py export metadata_v3 metadata_3.0.csv
+    python pdf_catalog.py report --version 5.0 > informe_v5.0.txt
+"""
+
+#Configuration
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.environ.get("H24_PDF_CATALOG_PATH", os.path.join(script_dir, 'pdf_catalog.sqlite'))
+WORKERS = os.cpu_count() or 1
+HQ_PRODUCER = 'Samsung-M4580FX'  # Producer of the high quality scans (layer 3)
+COMMIT_EVERY = 500  # Files written to the catalog per transaction
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Page-count buckets of layer 1: (name, largest page count)
+PAGE_BUCKETS = [("1-2pags", 2), ("3pags", 3), ("4-5pags", 5), ("6+pags", None)]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    name TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT,
+    producer TEXT,
+    creator TEXT,
+    title TEXT,
+    author TEXT,
+    subject TEXT,
+    creation_date TEXT,
+    mod_date TEXT,
+    total_pages INTEGER,
+    page_width REAL,
+    page_height REAL,
+    page_sizes INTEGER,
+    min_width REAL,
+    max_width REAL,
+    min_height REAL,
+    max_height REAL,
+    landscape_pages INTEGER,
+    error TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_root ON files (root);
+CREATE INDEX IF NOT EXISTS files_hash ON files (content_hash);
+"""
+
+COLUMNS = ["path", "root", "name", "folder", "mtime_ns", "size", "content_hash", "producer", "creator", "title", "author",
+           "subject", "creation_date", "mod_date", "total_pages", "page_width", "page_height", "page_sizes", "min_width",
+           "max_width", "min_height", "max_height", "landscape_pages", "error", "indexed_at"]
+
+BUCKET_CASES = " ".join(f"WHEN total_pages <= {largest} THEN '{bucket}'" if largest is not None else f"ELSE '{bucket}'"
+                        for bucket, largest in PAGE_BUCKETS)
+
+# The views of the catalog: (columns, condition, order)
+VIEWS = {
+    "metadata_v1": ("path AS Filepath, title AS Title, author AS Author, subject AS Subject, creator AS Creator, "
+                    "producer AS Producer, creation_date AS CreationDate, mod_date AS ModDate", "error IS NULL", "path"),
+    "metadata_v3": ("name AS Name, producer AS Producer, creator AS Creator, total_pages AS TotalPages, size AS FileSize",
+                    "error IS NULL", "path"),
+    "training_hq_data": ("name AS Name, producer AS Producer, total_pages AS TotalPages, size AS FileSize",
+                         f"error IS NULL AND producer = '{HQ_PRODUCER}'", "path"),
+    "page_buckets": (f"path AS Filepath, name AS Name, folder AS Folder, total_pages AS TotalPages, CASE {BUCKET_CASES} END AS Bucket",
+                     "error IS NULL", "path"),
+    "duplicate_files": ("content_hash AS ContentHash, path AS Filepath, size AS FileSize",
+                        "content_hash IN (SELECT content_hash FROM files GROUP BY content_hash HAVING COUNT(*) > 1)", "content_hash, path"),
+    "files": ("*", "1", "path"),
+}
+
+
+def open_catalog(catalog_path=CATALOG_PATH):
+    """Opens (and creates) the catalog database."""
+    connection = sqlite3.connect(catalog_path)
+    connection.executescript(SCHEMA)
+    # The views are created again, so they follow the configuration (e.g. HQ_PRODUCER)
+    for view, (columns, condition, order) in VIEWS.items():
+        if view != "files":
+            connection.execute(f"DROP VIEW IF EXISTS {view}")
+            connection.execute(f"CREATE VIEW {view} AS SELECT {columns} FROM files WHERE {condition} ORDER BY {order}")
+    connection.commit()
+    return connection
+
+
+def content_hash(pdf_path):
+    """Returns the SHA-256 hex digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_size_stats(pdf):
+    """Returns the statistics of the page sizes of an open document, in points (the page rotation applied)."""
+    sizes = [(round(page.rect.width, 1), round(page.rect.height, 1)) for page in pdf]
+    if not sizes:
+        return {}
+    widths, heights = zip(*sizes)
+    (page_width, page_height), _ = Counter(sizes).most_common(1)[0]
+    return {
+        "page_width": page_width,
+        "page_height": page_height,
+        "page_sizes": len(set(sizes)),
+        "min_width": min(widths),
+        "max_width": max(widths),
+        "min_height": min(heights),
+        "max_height": max(heights),
+        "landscape_pages": sum(width > height for width, height in sizes),
+    }
+
+
+def extract_metadata(pdf_path):
+    """
+    Reads the metadata of a PDF file. Runs in the worker processes of index_directory().
+
+    Returns:
+        dict: The columns of the file in the catalog, but path, root, name, folder and indexed_at (no
+        mtime_ns and size when the file was deleted since the walk).
+    """
+    row = {"mtime_ns": None, "size": None, "error": None}
+    try:
+        file_stat = os.stat(pdf_path)
+        row.update(mtime_ns=file_stat.st_mtime_ns, size=file_stat.st_size)
+        row["content_hash"] = content_hash(pdf_path)
+        with fitz.open(pdf_path) as pdf:
+            metadata = pdf.metadata or {}
+            row.update({
+                "producer": metadata.get("producer", ""),
+                "creator": metadata.get("creator", ""),
+                "title": metadata.get("title", ""),
+                "author": metadata.get("author", ""),
+                "subject": metadata.get("subject", ""),
+                "creation_date": metadata.get("creationDate", ""),
+                "mod_date": metadata.get("modDate", ""),
+                "total_pages": len(pdf),
+                **page_size_stats(pdf),
+            })
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def find_pdf_files(directory_path):
+    """Returns the paths of the PDF files of a directory and its subdirectories, with their modification time and size."""
+    found = {}
+    for root, dirs, files in os.walk(directory_path):
+        for file in files:
+            if file.lower().endswith(".pdf"):
+                pdf_path = os.path.join(root, file)
+                try:
+                    file_stat = os.stat(pdf_path)
+                except OSError:
+                    continue  # Deleted during the walk
+                found[pdf_path] = (file_stat.st_mtime_ns, file_stat.st_size)
+    return found
+
+
+def index_directory(directory_path, catalog_path=CATALOG_PATH, workers=WORKERS, show_progress=True):
+    """
+    Indexes the new and modified PDF files of a directory, and removes the files no longer found.
+
+    The files are looked up by path, whatever directory indexed them: indexing a subfolder of an
+    indexed directory (or the other way round) does not read the files of the overlap again. A file
+    keeps the outermost indexed directory as root, its folder is the first folder below it.
+
+    Args:
+        directory_path (str): The directory, walked with its subdirectories.
+        catalog_path (str): The SQLite catalog.
+        workers (int): The worker processes reading the files.
+        show_progress (bool): Show a progress bar.
+
+    Returns:
+        dict: The number of files found, indexed, unchanged, removed and failed, and the seconds taken.
+    """
+    start = time.perf_counter()
+    root = os.path.abspath(directory_path)
+    connection = open_catalog(catalog_path)
+    found = find_pdf_files(root)
+    prefix = os.path.join(root, '')
+    known = {path: ((mtime_ns, size), file_root) for path, mtime_ns, size, file_root in
+             connection.execute("SELECT path, mtime_ns, size, root FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))}
+
+    def file_root(pdf_path):
+        # A file indexed from an enclosing directory keeps it as root
+        if pdf_path in known and os.path.join(root, '').startswith(os.path.join(known[pdf_path][1], '')):
+            return known[pdf_path][1]
+        return root
+
+    def folder(pdf_path, file_root):
+        relative_path = os.path.relpath(pdf_path, file_root)
+        return relative_path.split(os.sep)[0] if os.sep in relative_path else ""
+
+    changed = [path for path, signature in found.items() if path not in known or known[path][0] != signature]
+    removed = [path for path in known if path not in found]
+    connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+    # The unchanged files indexed from a subfolder move to this root, without being read again
+    connection.executemany("UPDATE files SET root = ?, folder = ? WHERE path = ?",
+                           [(root, folder(path, root), path) for path, (signature, indexed_root) in known.items()
+                            if path in found and signature == found[path] and indexed_root != root and file_root(path) == root])
+
+    failed = 0
+    insert = f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        rows = executor.map(extract_metadata, changed, chunksize=max(1, min(64, len(changed) // (workers * 4) or 1)))
+        for count, (pdf_path, row) in enumerate(tqdm(zip(changed, rows), total=len(changed), desc="Indexing PDF files",
+                                                     unit="file", disable=not show_progress), start=1):
+            if row["error"] is not None:
+                failed += 1
+                print(f"Error processing {pdf_path}: {row['error']}", file=sys.stderr)
+            if row["mtime_ns"] is None:
+                # Deleted since the walk
+                connection.execute("DELETE FROM files WHERE path = ?", (pdf_path,))
+                continue
+            row.update(path=pdf_path, root=file_root(pdf_path), name=os.path.basename(pdf_path), indexed_at=time.time())
+            row["folder"] = folder(pdf_path, row["root"])
+            connection.execute(insert, [row.get(column) for column in COLUMNS])
+            if count % COMMIT_EVERY == 0:
+                connection.commit()
+    connection.commit()
+    connection.close()
+    return {"found": len(found), "indexed": len(changed), "unchanged": len(found) - len(changed), "removed": len(removed),
+            "failed": failed, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def read_view(view, catalog_path=CATALOG_PATH, root=None):
+    """
+    Returns the column names and rows of a view of the catalog.
+
+    Args:
+        view (str): One of VIEWS.
+        root (str, optional): Only the files under this directory.
+    """
+    if view not in VIEWS:
+        raise ValueError(f"Unknown view '{view}', expected one of {list(VIEWS)}.")
+    columns, condition, order = VIEWS[view]
+    query = f"SELECT {columns} FROM files WHERE {condition}"
+    parameters = ()
+    if root is not None:
+        prefix = os.path.join(os.path.abspath(root), '')
+        query += " AND substr(path, 1, ?) = ?"
+        parameters = (len(prefix), prefix)
+
+    connection = open_catalog(catalog_path)
+    try:
+        cursor = connection.execute(f"{query} ORDER BY {order}", parameters)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+    finally:
+        connection.close()
+
+
+def export_view(view, output_path, catalog_path=CATALOG_PATH, root=None):
+    """
+    Writes a view of the catalog as CSV, or as Parquet when output_path ends with .parquet.
+
+    Returns:
+        int: The number of rows written.
+    """
+    columns, rows = read_view(view, catalog_path, root)
+    if output_path.endswith('.parquet'):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise SystemExit("The Parquet export needs pandas and pyarrow (pip install pandas pyarrow).")
+        pd.DataFrame.from_records(rows, columns=columns).to_parquet(output_path, index=False)
+        return len(rows)
+
+    with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    return len(rows)
+
+
+def folder_report(catalog_path=CATALOG_PATH, root=None, version='1.0'):
+    """Returns the composition of each folder by page-count bucket, in the format of the layer 1 reports."""
+    _, rows = read_view("page_buckets", catalog_path, root)
+    folders = {}
+    for _, _, folder, _, bucket in rows:
+        folders.setdefault(folder, Counter())[bucket] += 1
+
+    report = ""
+    for folder in sorted(folders):
+        counts = folders[folder]
+        total_files = sum(counts.values())
+        report += f"Fecha: {datetime.date.today()}\nVersion: {version}\n\nCarpeta: {folder or '.'}\nTotal PDFs: {total_files}\n"
+        for bucket, _ in PAGE_BUCKETS:
+            report += f"  -{bucket}: {counts[bucket]} PDFs - {counts[bucket] / total_files * 100:.2f}%\n"
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incremental catalog of the metadata of the PDF files of the training corpus.")
+    parser.add_argument('--catalog', default=CATALOG_PATH, help="The SQLite catalog (default: %(default)s).")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    index = commands.add_parser('index', help="Index the new and modified PDF files of a directory.")
+    index.add_argument('directory')
+    index.add_argument('--workers', type=int, default=WORKERS, help="Worker processes reading the files (default: %(default)s).")
+
+    export = commands.add_parser('export', help="Write a view of the catalog as CSV (or Parquet for a .parquet output).")
+    export.add_argument('view', choices=list(VIEWS))
+    export.add_argument('output')
+    export.add_argument('--root', help="Only the files under this indexed directory.")
+
+    report = commands.add_parser('report', help="Print the composition of each folder by page-count bucket.")
+    report.add_argument('--root', help="Only the files under this indexed directory.")
+    report.add_argument('--version', default='1.0', help="The version written in the report.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'index':
+        print(index_directory(args.directory, args.catalog, args.workers))
+    elif args.command == 'export':
+        rows = export_view(args.view, args.output, args.catalog, args.root)
+        print(f"{rows} rows written to {args.output}")
+    else:
+        print(folder_report(args.catalog, args.root, args.version), end='')